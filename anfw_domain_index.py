@@ -0,0 +1,69 @@
+# Hostname lookup index over the Network Firewall domain list targets written to anfw_domains.csv by list_anfw_rules.py, used by anfw_domain_lookup.py.
+# The targets are stored in a trie of reversed domain labels (com -> example -> www), so the rules matching a hostname are found by walking
+# its labels from the right, in O(number of labels) regardless of the number of targets. Targets follow the Network Firewall semantics:
+#   - "abc.example.com" matches only the hostname abc.example.com
+#   - ".example.com" (leading dot) matches example.com and every subdomain of it, e.g. abc.example.com and www.abc.example.com
+import csv
+
+# Columns of the matches returned by lookups, in order
+MATCH_COLUMNS = [
+    "account",
+    "region",
+    "firewall_name",
+    "rule_group_priority",
+    "rule_group_name",
+    "generated_rules_type",
+    "target"
+]
+
+
+# Return the labels of a hostname or target, from the top-level domain down (matching is case-insensitive, and ignores a trailing dot)
+def reversed_labels(domain_name):
+    return domain_name.strip().strip(".").lower().split(".")[::-1]
+
+
+class _TrieNode:
+    __slots__ = ("children", "exact", "wildcard")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = [] # Matches of the targets naming exactly this domain
+        self.wildcard = [] # Matches of the leading-dot targets, covering this domain and its subdomains
+
+
+class DomainIndex:
+    def __init__(self):
+        self.root = _TrieNode()
+        self.target_count = 0 # Number of targets in the index
+
+    # Add a domain list target, with the match (a list of MATCH_COLUMNS values) to return for the hostnames it matches
+    def add(self, target, match):
+        node = self.root
+        for label in reversed_labels(target):
+            node = node.children.setdefault(label, _TrieNode())
+        (node.wildcard if target.strip().startswith(".") else node.exact).append(match)
+        self.target_count += 1
+
+    # Return the matches of every target matching a hostname: the leading-dot targets of the hostname and each of its parent domains,
+    # and the targets naming the hostname exactly
+    def lookup(self, hostname):
+        matches = []
+        node = self.root
+        for label in reversed_labels(hostname):
+            node = node.children.get(label)
+            if node is None:
+                return matches
+            matches.extend(node.wildcard)
+        matches.extend(node.exact)
+        return matches
+
+    # Return an index of the targets in a domains CSV written by list_anfw_rules.py (with or without the Account_ID and Region
+    # columns of --all-firewalls mode)
+    @classmethod
+    def from_csv(cls, file_name):
+        index = cls()
+        with open(file_name, 'r', newline="") as domains_file:
+            for row in csv.DictReader(domains_file):
+                index.add(row['Domain'], [row.get('Account_ID', ''), row.get('Region', ''), row['FirewallName'], row['RuleGroupPriority'],
+                                          row['RuleGroupName'], row['Action'], row['Domain']])
+        return index
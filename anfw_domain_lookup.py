@@ -0,0 +1,53 @@
+import argparse
+import csv
+import time
+from anfw_domain_index import DomainIndex, MATCH_COLUMNS
+from table_renderer import render_table
+
+# Add command-line arguments for the domains file and the hostnames to look up
+parser = argparse.ArgumentParser(description="Look Up Hostnames in AWS Network Firewall Domain Lists Script - Arguments")
+parser.add_argument("hostnames", nargs="*", help="Hostnames to look up, e.g. www.example.com")
+parser.add_argument("-i", "--input-file", default="anfw_domains.csv", type=str, help="Domains file to look up hostnames in: the anfw_domains.csv output of list_anfw_rules.py")
+parser.add_argument("-f", "--hosts-file", type=str, help="File of hostnames to look up, one per line (blank lines and lines starting with # are skipped)")
+parser.add_argument("-o", "--output-file", type=str, help="File to write the matches to as CSV, instead of printing a table")
+parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
+args=parser.parse_args()
+
+# Collect the hostnames from the command line and the hosts file
+hostnames = list(args.hostnames)
+if args.hosts_file:
+    with open(args.hosts_file, 'r') as hosts_file:
+        hostnames += [line.strip() for line in hosts_file if line.strip() and not line.startswith("#")]
+if not hostnames:
+    print("You must specify at least one hostname, or a hosts file.")
+    print("please use the '-h' flag for help and more options.")
+    exit()
+
+# Build the index of the domain list targets
+start_time = time.perf_counter()
+domain_index = DomainIndex.from_csv(args.input_file)
+if args.verbose: print(f"Indexed {domain_index.target_count} domain list targets in {time.perf_counter() - start_time:.3f}s")
+
+# Look up each hostname, with a row per matching rule group target (hostnames without any match get a row with empty match columns)
+start_time = time.perf_counter()
+rows = []
+matched_count = 0
+for hostname in hostnames:
+    matches = domain_index.lookup(hostname)
+    if matches:
+        matched_count += 1
+    for match in matches or [[""] * len(MATCH_COLUMNS)]:
+        rows.append([hostname] + match)
+lookup_time = time.perf_counter() - start_time
+
+if args.output_file:
+    with open(args.output_file, 'w', newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(["hostname"] + MATCH_COLUMNS)
+        writer.writerows(rows)
+    print(f"CSV output is saved at: {args.output_file}")
+else:
+    print(render_table(rows, ["hostname"] + MATCH_COLUMNS))
+
+# Hostnames that match no target are blocked by any ALLOWLIST rule group, and not affected by DENYLIST rule groups
+print(f"{matched_count} of {len(hostnames)} hostnames match a domain list target ({lookup_time * 1000:.1f} ms)")
@@ -0,0 +1,70 @@
+# Persistent on-disk cache of Network Firewall rule group contents, keyed by RuleGroupArn and UpdateToken, used by list_anfw_rules.py.
+# Rule group bodies (domain lists, Suricata rule sets) can be several MB, so each is stored once in a content-addressed file named by the
+# SHA-256 of its contents, and the index maps each rule group ARN to its UpdateToken, LastModifiedTime and content digest.
+# describe_rule_group_metadata doesn't return the UpdateToken, so a cached body is used when the LastModifiedTime returned by that cheap
+# call matches the one stored with it, and the rule group is described again (and re-keyed by its new UpdateToken) otherwise.
+import hashlib
+import json
+import os
+import threading
+
+INDEX_FILE_NAME = "index.json"
+
+
+class RuleGroupCache:
+    def __init__(self, directory="anfw_rule_group_cache"):
+        self.directory = directory
+        self.hits = 0 # Counter to hold the number of rule groups taken from the cache
+        self.misses = 0 # Counter to hold the number of rule groups that had to be described
+        self._lock = threading.Lock()
+        self._index = {}
+        os.makedirs(directory, exist_ok=True)
+        index_file_name = os.path.join(directory, INDEX_FILE_NAME)
+        if os.path.exists(index_file_name):
+            with open(index_file_name, 'r') as index_file:
+                self._index = json.load(index_file)
+
+    def _body_file_name(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    # Return the cached describe_rule_group response for a rule group ARN if it was last modified at last_modified_time, otherwise None
+    def get(self, rule_group_arn, last_modified_time):
+        with self._lock:
+            entry = self._index.get(rule_group_arn)
+            if (last_modified_time is None or entry is None or entry['LastModifiedTime'] != str(last_modified_time)
+                    or not os.path.exists(self._body_file_name(entry['Digest']))):
+                self.misses += 1
+                return None
+            self.hits += 1
+        with open(self._body_file_name(entry['Digest']), 'r') as body_file:
+            return json.load(body_file)
+
+    # Store a describe_rule_group response, keyed by its rule group ARN and UpdateToken
+    def put(self, rule_group_arn, describe_rule_group_response):
+        response = {key: value for key, value in describe_rule_group_response.items() if key != 'ResponseMetadata'}
+        body = json.dumps(response, default=str, sort_keys=True)
+        digest = hashlib.sha256(body.encode()).hexdigest()
+        body_file_name = self._body_file_name(digest)
+        if not os.path.exists(body_file_name):
+            with open(f"{body_file_name}.{threading.get_ident()}.tmp", 'w') as body_file:
+                body_file.write(body)
+            os.replace(f"{body_file_name}.{threading.get_ident()}.tmp", body_file_name)
+        with self._lock:
+            self._index[rule_group_arn] = {
+                'UpdateToken': response.get('UpdateToken'),
+                'LastModifiedTime': str(response['RuleGroupResponse'].get('LastModifiedTime')),
+                'Digest': digest
+            }
+
+    # Write the index to disk (via a temporary file, so an interrupted run can't leave a corrupt cache behind),
+    # and remove the bodies no longer referenced by any rule group
+    def save(self):
+        with self._lock:
+            index_file_name = os.path.join(self.directory, INDEX_FILE_NAME)
+            with open(f"{index_file_name}.tmp", 'w') as index_file:
+                json.dump(self._index, index_file)
+            os.replace(f"{index_file_name}.tmp", index_file_name)
+            digests = set(entry['Digest'] for entry in self._index.values())
+            for file_name in os.listdir(self.directory):
+                if file_name.endswith(".json") and file_name != INDEX_FILE_NAME and file_name[:-len(".json")] not in digests:
+                    os.remove(os.path.join(self.directory, file_name))
@@ -0,0 +1,101 @@
+# Network Firewall rule parsing, used by list_anfw_rules.py (through inventory_collectors.rule_group_rows) and anfw_rules_benchmark.py.
+# Stateless rules are expanded from their MatchAttributes, and stateful rule groups defined as a Suricata RulesString are tokenized
+# into the same columns as the structured StatefulRules. The Suricata tokenizer makes a single pass over each rule (a split of its header,
+# and one regular expression scan of its options), so its run time is linear in the size of the rules string.
+import itertools
+import re
+from collections import namedtuple
+
+# Names of the IP protocol numbers used in stateless rules (other protocols are given by number)
+PROTOCOL_NAMES = {1: "ICMP", 6: "TCP", 17: "UDP", 58: "ICMPv6"}
+
+# Suricata rule directions, as Network Firewall names them in StatefulRules headers
+DIRECTIONS = {"->": "FORWARD", "<>": "ANY"}
+
+# A Suricata rule option, "keyword;" or "keyword: value;" (the last option's ';' may be missing). Quoted values may contain ';',
+# and '\' escapes the next character.
+_OPTION = re.compile(r'\s*([^\s:;]+)\s*(?::\s*((?:"(?:[^"\\]|\\.)*"|[^;"\\]|\\.)*))?(?:;|\s*$)')
+
+# Fields of a parsed Suricata rule, in the order of the stateful rule columns of list_anfw_rules.py
+SuricataRule = namedtuple('SuricataRule', ['action', 'direction', 'protocol', 'source', 'source_port', 'destination', 'destination_port', 'sid', 'content'])
+
+
+# Return the display value of a list of match attribute values, or ANY for an empty list
+def _any(values):
+    return values if values else ["ANY"]
+
+# Return the display value of a list of port ranges, or ANY for an empty list
+def _port_ranges(port_ranges):
+    return _any([str(port_range['FromPort']) if port_range['FromPort'] == port_range['ToPort'] else f"{port_range['FromPort']}-{port_range['ToPort']}"
+                 for port_range in port_ranges])
+
+# Yield a (priority, actions, protocol, source, source port, destination, destination port, TCP flags) tuple for every combination of the
+# MatchAttributes of each stateless rule (the same combinations that make up the rule's capacity). TCP flags apply to every combination,
+# and are shown as flags/masks.
+def stateless_rules(stateless_rules_and_custom_actions):
+    for stateless_rule in stateless_rules_and_custom_actions.get('StatelessRules', []):
+        rule_definition = stateless_rule['RuleDefinition']
+        match_attributes = rule_definition['MatchAttributes']
+        actions = " ".join(rule_definition['Actions'])
+        tcp_flags = " ".join(f"{','.join(tcp_flag['Flags'])}/{','.join(tcp_flag.get('Masks', []))}" for tcp_flag in match_attributes.get('TCPFlags', []))
+        for protocol, source, source_port, destination, destination_port in itertools.product(
+                _any([PROTOCOL_NAMES.get(protocol, str(protocol)) for protocol in match_attributes.get('Protocols', [])]),
+                _any([address['AddressDefinition'] for address in match_attributes.get('Sources', [])]),
+                _port_ranges(match_attributes.get('SourcePorts', [])),
+                _any([address['AddressDefinition'] for address in match_attributes.get('Destinations', [])]),
+                _port_ranges(match_attributes.get('DestinationPorts', []))):
+            yield stateless_rule['Priority'], actions, protocol, source, source_port, destination, destination_port, tcp_flags
+
+# Return the header fields of a Suricata rule. Addresses and ports may be bracketed lists containing spaces (e.g. "[10.0.0.0/8, !10.1.0.0/16]"),
+# so whitespace-separated tokens are joined back together until their brackets balance.
+def _header_fields(header):
+    fields = []
+    depth = 0
+    for token in header.split():
+        if depth:
+            fields[-1] += " " + token
+        else:
+            fields.append(token)
+        depth += token.count("[") - token.count("]")
+    return fields
+
+# Return the SuricataRule of a single rule, or None if the rule can't be parsed
+def parse_suricata_rule(rule):
+    options_start = rule.find("(")
+    options_end = rule.rfind(")")
+    if options_start < 0 or options_end < options_start:
+        return None
+    fields = _header_fields(rule[:options_start])
+    if len(fields) != 7 or fields[4] not in DIRECTIONS:
+        return None
+    sid = ""
+    content = []
+    for option in _OPTION.finditer(rule, options_start + 1, options_end):
+        keyword, value = option.group(1), option.group(2)
+        if keyword == "sid" and value is not None:
+            sid = value.strip()
+        elif keyword == "content" and value is not None:
+            content.append(value.strip())
+    action, protocol, source, source_port, direction, destination, destination_port = fields
+    return SuricataRule(action.upper(), DIRECTIONS[direction], protocol.upper(), source, source_port, destination, destination_port, sid, " ".join(content))
+
+# Yield the SuricataRule of each rule in a Suricata rules string. Comments and blank lines are skipped, and lines ending in '\' are
+# continued on the next line. The line numbers of rules that can't be parsed are appended to invalid_lines, if given.
+def parse_suricata_rules(rules_string, invalid_lines=None):
+    continued = []
+    for line_number, line in enumerate(rules_string.splitlines(), 1):
+        line = line.strip()
+        if line.endswith("\\"):
+            continued.append(line[:-1])
+            continue
+        if continued:
+            continued.append(line)
+            line = " ".join(continued)
+            continued = []
+        if not line or line.startswith("#"):
+            continue
+        rule = parse_suricata_rule(line)
+        if rule is not None:
+            yield rule
+        elif invalid_lines is not None:
+            invalid_lines.append(line_number)
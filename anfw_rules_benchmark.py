@@ -0,0 +1,53 @@
+import argparse
+import random
+import time
+from anfw_rules import parse_suricata_rules
+
+# Add command-line arguments for the size of the synthetic Suricata rules fixture
+parser = argparse.ArgumentParser(description="Benchmark the Network Firewall Suricata rule parser on a synthetic RulesString fixture - Arguments")
+parser.add_argument("-l", "--lines", default=100000, type=int, help="Number of lines in the largest rules string")
+parser.add_argument("-s", "--seed", default=42, type=int, help="Random seed for the fixture")
+args=parser.parse_args()
+
+# Return a random Suricata rule line, covering the shapes seen in Network Firewall RulesString rule groups:
+# bracketed address and port lists, variables, bidirectional rules, quoted content with escaped characters, and rules split over two lines
+def random_rule(rng, sid):
+    action = rng.choice(["pass", "drop", "alert", "reject"])
+    protocol = rng.choice(["tcp", "udp", "tls", "http", "ip", "dns"])
+    source = rng.choice(["any", "$HOME_NET", f"10.{rng.randint(0, 255)}.0.0/16", f"[10.{rng.randint(0, 255)}.0.0/16, !10.{rng.randint(0, 255)}.1.0/24]"])
+    destination = rng.choice(["any", "$EXTERNAL_NET", f"192.168.{rng.randint(0, 255)}.0/24"])
+    destination_port = rng.choice(["any", "443", "[80,443,8080:8090]", str(rng.randint(1, 65535))])
+    direction = rng.choice(["->", "->", "<>"])
+    options = [f'msg:"rule {sid}; synthetic"']
+    for _ in range(rng.randint(0, 3)):
+        options.append('content:"' + rng.choice(["GET", "example.com", "a\\;b", "x\\\"y"]) + '"')
+        options.append(rng.choice(["nocase", "endswith", "startswith"]))
+    options += [f"sid:{sid}", "rev:1"]
+    rule = f"{action} {protocol} {source} any {direction} {destination} {destination_port} (" + "; ".join(options) + ";)"
+    if rng.random() < 0.05:
+        rule = rule.replace(" (", " \\\n    (", 1)
+    return rule
+
+# Return a rules string of about line_count lines, with a comment or blank line in every 20
+def synthetic_rules_string(rng, line_count):
+    lines = []
+    sid = 1000000
+    while len(lines) < line_count:
+        if rng.random() < 0.05:
+            lines.append(rng.choice(["", "# Synthetic rule section"]))
+            continue
+        sid += 1
+        lines.extend(random_rule(rng, sid).split("\n"))
+    return "\n".join(lines[:line_count])
+
+# Time the parser on fixtures of a quarter, half and all of the lines: with a linear parser, the time per line stays flat as the input grows
+rng = random.Random(args.seed)
+rules_string = synthetic_rules_string(rng, args.lines)
+print(f"Synthetic fixture: {args.lines} lines, {len(rules_string) / 1e6:.1f} MB")
+for fraction in (4, 2, 1):
+    fixture = "\n".join(rules_string.split("\n")[:args.lines // fraction])
+    invalid_lines = []
+    start = time.perf_counter()
+    rule_count = sum(1 for rule in parse_suricata_rules(fixture, invalid_lines))
+    seconds = time.perf_counter() - start
+    print(f"{args.lines // fraction} lines: {rule_count} rules parsed in {seconds:.2f}s ({seconds / (args.lines // fraction) * 1e6:.2f} us per line, {len(invalid_lines)} invalid lines)")
@@ -0,0 +1,236 @@
+# asyncio scan engine for OrgScanner (org_inventory.py), selected with --engine async in sg_inventory.py and waf_acl_inventory.py (requires aiobotocore).
+# Every account/region combination runs as a coroutine on a single event loop thread, so thousands of requests can be in flight with
+# little memory per request. The number of combinations in flight is limited by --workers, and the requests per account by --max-account-requests.
+#
+# Collectors provide an async generator (Collector.async_function) taking an AsyncScanUnit, e.g.:
+#
+#   async def collect_example_async(unit):
+#       client = await unit.client('ec2')
+#       async for page in unit.paginate(client, 'describe_vpcs'):
+#           for vpc in page['Vpcs']:
+#               yield vpc
+#
+# Results are yielded to the (synchronous) caller in the same stable order as the thread engine. Each combination streams its items through
+# a bounded buffer, so a slow output writer blocks the coroutines producing its items, and they stop fetching pages until it catches up.
+from aiobotocore.config import AioConfig
+from aiobotocore.credentials import AioRefreshableCredentials
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError, BotoCoreError
+import asyncio
+import contextlib
+import threading
+from collections import namedtuple
+from org_inventory import ScanResult, ITEM_BUFFER_SIZE
+
+# Maximum number of items passed from the event loop to the caller at a time
+ITEM_BATCH_SIZE = 100
+
+# Markers passed through the item buffers by the coroutines
+_UNIT_COMPLETE = object()
+_UnitFailed = namedtuple('_UnitFailed', ['error'])
+
+
+# A single account/region combination, handed to async collector functions
+class AsyncScanUnit:
+    def __init__(self, engine, account_id, region):
+        self.engine = engine
+        self.scanner = engine.scanner
+        self.account_id = account_id
+        self.region = region
+        self.failed = False # Set if the collector failed in this account/region combination
+        self.error_code = None # Error code of the failure, if the collector failed
+
+    # Return the aiobotocore client for a service in the unit's account and region, shared by every unit of the same account, service and region
+    async def client(self, service, region=None):
+        return await self.engine.client(self.account_id, service, region or self.region)
+
+    # Call an API operation, limiting the number of concurrent requests made to the unit's account
+    async def call(self, operation, **kwargs):
+        async with self.engine.account_semaphore(self.account_id):
+            return await operation(**kwargs)
+
+    # Run a request plan as ScanUnit.run_plan does, through an asyncio semaphore
+    async def run_plan(self, plan, request_limit):
+        response, error = None, None
+        while True:
+            try:
+                client, operation_name, kwargs = plan.send(response) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                async with request_limit:
+                    response, error = await self.call(getattr(client, operation_name), **kwargs), None
+            except ClientError as request_error:
+                response, error = None, request_error
+
+    # Yield each page of an API operation, making one request at a time through the account's request limit.
+    # Operations without a botocore paginator (e.g. wafv2 list_web_acls) are paged by hand with NextMarker.
+    async def paginate(self, client, operation_name, **kwargs):
+        if client.can_paginate(operation_name):
+            pages = client.get_paginator(operation_name).paginate(**kwargs).__aiter__()
+            while True:
+                async with self.engine.account_semaphore(self.account_id):
+                    try:
+                        page = await pages.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield page
+        else:
+            operation = getattr(client, operation_name)
+            while True:
+                page = await self.call(operation, **kwargs)
+                yield page
+                if not page.get('NextMarker'):
+                    return
+                kwargs['NextMarker'] = page['NextMarker']
+
+
+class AsyncScanEngine:
+    def __init__(self, scanner):
+        self.scanner = scanner
+        pool_config = scanner.client_pool.config
+        self.client_config = AioConfig(retries=pool_config.retries, max_pool_connections=pool_config.max_pool_connections)
+        self.sessions = {} # Dict to hold the aiobotocore session per account ID
+        self.clients = {} # Dict to hold the aiobotocore client per (account ID, service, region)
+        self._semaphores = {}
+        self._client_lock = None
+        self._exit_stack = None
+
+    # Return the semaphore limiting the concurrent API requests to an account (only used from the event loop thread)
+    def account_semaphore(self, account_id):
+        if account_id not in self._semaphores:
+            self._semaphores[account_id] = asyncio.Semaphore(self.scanner.max_account_requests)
+        return self._semaphores[account_id]
+
+    # Return the aiobotocore session of an account, using the credentials of the role assumed by the scanner (refreshed before they expire)
+    # and the client pool's shared data loader
+    def session(self, account_id):
+        if account_id not in self.sessions:
+            session = get_session()
+            session.register_component('data_loader', self.scanner.client_pool.loader)
+            if account_id != self.scanner.current_account_id:
+                credential_cache = self.scanner.credential_cache
+                role_arn = self.scanner.role_arn(account_id)
+                session_name = self.scanner.session_name
+
+                async def refresh():
+                    return await asyncio.get_running_loop().run_in_executor(None, credential_cache.get_credentials, role_arn, session_name)
+                session._credentials = AioRefreshableCredentials.create_from_metadata(
+                    metadata=credential_cache.get_credentials(role_arn, session_name),
+                    refresh_using=refresh,
+                    method='sts-assume-role'
+                )
+            self.sessions[account_id] = session
+        return self.sessions[account_id]
+
+    async def client(self, account_id, service, region):
+        client_key = (account_id, service, region)
+        async with self._client_lock:
+            if client_key not in self.clients:
+                client = self.session(account_id).create_client(service, region_name=region, config=self.client_config)
+                self.clients[client_key] = await self._exit_stack.enter_async_context(client)
+            return self.clients[client_key]
+
+    # Run the collectors in the account/region combinations (a list of (collector, ScanUnit) built by OrgScanner.run) on an event loop thread,
+    # yielding a ScanResult per combination. Combinations completed by a previous run are replayed from the checkpoint (if any).
+    def run(self, scan_units, checkpoint=None, region_map=None):
+        async_units = [(collector, AsyncScanUnit(self, unit.account_id, unit.region)) for collector, unit in scan_units]
+        unit_keys = [(collector.name, unit.account_id, unit.region) for collector, unit in async_units]
+        replayed = [checkpoint is not None and checkpoint.is_complete(unit_key) for unit_key in unit_keys]
+
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+        loop_thread.start()
+        item_buffers = asyncio.run_coroutine_threadsafe(self._create_buffers(len(async_units)), loop).result()
+        scan = asyncio.run_coroutine_threadsafe(self._scan(async_units, item_buffers, replayed), loop)
+        try:
+            for (collector, unit), unit_key, item_buffer, is_replayed in zip(async_units, unit_keys, item_buffers, replayed):
+                if is_replayed:
+                    yield ScanResult(collector.name, unit.account_id, unit.region, checkpoint.replay(unit_key))
+                else:
+                    yield ScanResult(collector.name, unit.account_id, unit.region, self.scanner._track(self._consume(loop, item_buffer), collector, unit, unit_key, checkpoint, region_map), unit)
+            scan.result()
+        finally:
+            # Stop any coroutines still running if the caller stopped early or failed, then close the clients and the event loop
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+
+    async def _create_buffers(self, count):
+        self._client_lock = asyncio.Lock()
+        self._exit_stack = contextlib.AsyncExitStack()
+        return [asyncio.Queue(maxsize=ITEM_BUFFER_SIZE) for _ in range(count)]
+
+    async def _close(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._exit_stack.aclose()
+
+    # Start a coroutine per combination, in order, keeping at most --workers of them running at a time.
+    # Starting them in order means the combination the caller is waiting on always runs first, even when later ones are blocked on full buffers.
+    async def _scan(self, async_units, item_buffers, replayed):
+        unit_slots = asyncio.Semaphore(max(1, self.scanner.workers))
+        tasks = []
+        try:
+            for (collector, unit), item_buffer, is_replayed in zip(async_units, item_buffers, replayed):
+                if is_replayed:
+                    continue
+                await unit_slots.acquire()
+                tasks.append(asyncio.create_task(self._produce(collector, unit, item_buffer, unit_slots)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # Run a collector, passing its items to the caller through the buffer
+    async def _produce(self, collector, unit, item_buffer, unit_slots):
+        try:
+            async for item in self._run_unit(collector, unit):
+                await item_buffer.put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            await item_buffer.put(_UnitFailed(error))
+        else:
+            await item_buffer.put(_UNIT_COMPLETE)
+        finally:
+            unit_slots.release()
+
+    # Run a collector in an account/region combination, retrying the combination as OrgScanner._run_unit does
+    async def _run_unit(self, collector, unit):
+        items_yielded = 0
+        for attempt in range(1, self.scanner.unit_attempts + 1):
+            try:
+                item_index = 0
+                async for item in collector.async_function(unit):
+                    item_index += 1
+                    if item_index <= items_yielded:
+                        continue
+                    items_yielded += 1
+                    yield item
+                return
+            except (ClientError, BotoCoreError) as error:
+                retry_delay = self.scanner._unit_error(collector, unit, error, attempt)
+                if retry_delay is None:
+                    return
+                await asyncio.sleep(retry_delay)
+
+    # Return the next batch of items from a buffer, waiting for at least one
+    async def _get_batch(self, item_buffer):
+        batch = [await item_buffer.get()]
+        while len(batch) < ITEM_BATCH_SIZE and not item_buffer.empty():
+            batch.append(item_buffer.get_nowait())
+        return batch
+
+    # Yield the items of an account/region combination from its buffer on the caller's thread, re-raising any collector error
+    def _consume(self, loop, item_buffer):
+        while True:
+            for item in asyncio.run_coroutine_threadsafe(self._get_batch(item_buffer), loop).result():
+                if item is _UNIT_COMPLETE:
+                    return
+                if isinstance(item, _UnitFailed):
+                    raise item.error
+                yield item
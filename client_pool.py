@@ -0,0 +1,39 @@
+# Pool of boto3 clients keyed by credentials, service and region, used by OrgScanner (org_inventory.py).
+# A client is created once per key and shared by every account/region combination and collector using it, so its HTTP connection pool
+# (sized by max_pool_connections) and adaptive retry token bucket are reused. Every botocore session created through the pool shares one
+# data loader, so service models and endpoint data are loaded from disk once per run rather than once per account.
+import botocore.loaders
+import botocore.session
+from botocore.config import Config
+import threading
+
+
+class ClientPool:
+    def __init__(self, config=None, max_pool_connections=10):
+        self.config = Config(max_pool_connections=max_pool_connections)
+        if config is not None:
+            self.config = config.merge(self.config)
+        self.hits = 0 # Counter to hold the number of client requests served by an existing client
+        self.misses = 0 # Counter to hold the number of clients created
+        self.loader = botocore.loaders.create_loader()
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    # Return a new botocore session sharing the pool's data loader, for building a boto3 session on
+    def botocore_session(self):
+        session = botocore.session.get_session()
+        session.register_component('data_loader', self.loader)
+        return session
+
+    # Return the client for a service and region with a set of credentials (identified by credentials_key, e.g. the role ARN),
+    # creating it from the boto3 session on first use. (boto3 sessions are not thread-safe, so client creation is serialized.)
+    def client(self, credentials_key, session, service, region):
+        client_key = (credentials_key, service, region)
+        with self._lock:
+            client = self._clients.get(client_key)
+            if client is None:
+                self.misses += 1
+                client = self._clients[client_key] = session.client(service, region_name=region, config=self.config)
+            else:
+                self.hits += 1
+            return client
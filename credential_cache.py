@@ -0,0 +1,123 @@
+# Cache of assumed-role credentials keyed by role ARN, used by OrgScanner (org_inventory.py).
+# Roles are assumed through a single shared STS client, and the temporary credentials are kept in memory and (optionally) in a cache file
+# shared by the inventory scripts, so back-to-back runs assume each role only once per session lifetime.
+# Sessions are built on botocore refreshable credentials: the role is assumed again shortly before the credentials expire, so scans that
+# run longer than the role's session duration don't fail partway through.
+# The cache file can be encrypted with a Fernet key (requires the cryptography package), taken from the INVENTORY_CREDENTIAL_KEY environment variable.
+# Without a key the credentials are written in plaintext (to a file readable by its owner only), and a warning is printed.
+import boto3
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session
+import datetime
+import json
+import os
+import threading
+
+# Environment variable holding the Fernet key used to encrypt the cache file (generate one with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())")
+ENCRYPTION_KEY_VARIABLE = "INVENTORY_CREDENTIAL_KEY"
+
+# Credentials expiring within this many seconds are assumed again (matches botocore's advisory refresh window)
+REFRESH_MARGIN = 15 * 60
+
+
+class CredentialCache:
+    def __init__(self, file_name=None, encryption_key=None, config=None, refresh_margin=REFRESH_MARGIN):
+        self.file_name = file_name
+        self.refresh_margin = refresh_margin
+        self.config = config
+        self.hits = 0 # Counter to hold the number of roles whose cached credentials were reused
+        self.misses = 0 # Counter to hold the number of roles that had to be assumed
+        self.fernet = None
+        if encryption_key is None:
+            encryption_key = os.environ.get(ENCRYPTION_KEY_VARIABLE)
+        if encryption_key:
+            from cryptography.fernet import Fernet
+            self.fernet = Fernet(encryption_key)
+        elif file_name:
+            print(f"Warning: {ENCRYPTION_KEY_VARIABLE} is not set, so the credential cache {file_name} holds the assumed-role credentials in plaintext "
+                  "(readable by its owner only). Set it to encrypt the cache.")
+        self._sts_client = None
+        self._lock = threading.Lock()
+        self._role_locks = {}
+        self._credentials = {} # Dict to hold the credential metadata (access_key, secret_key, token, expiry_time) per role ARN
+        if file_name and os.path.exists(file_name):
+            self._load()
+
+    # Read the unexpired credentials from the cache file. A cache that can't be read (e.g. encrypted with a different key) is ignored.
+    def _load(self):
+        with open(self.file_name, 'rb') as cache_file:
+            data = cache_file.read()
+        try:
+            if self.fernet is not None:
+                data = self.fernet.decrypt(data)
+            cached_credentials = json.loads(data)
+        except Exception:
+            print(f"Couldn't read the credential cache {self.file_name}, ignoring it")
+            return
+        self._credentials = {role_arn: credentials for role_arn, credentials in cached_credentials.items() if self._is_fresh(credentials)}
+
+    # Return the shared STS client, creating it on first use
+    def sts_client(self):
+        with self._lock:
+            if self._sts_client is None:
+                self._sts_client = boto3.client('sts', config=self.config)
+            return self._sts_client
+
+    # Return whether credentials are valid for longer than the refresh margin
+    def _is_fresh(self, credentials):
+        expiry_time = datetime.datetime.fromisoformat(credentials['expiry_time'])
+        return (expiry_time - datetime.datetime.now(datetime.timezone.utc)).total_seconds() > self.refresh_margin
+
+    def _role_lock(self, role_arn):
+        with self._lock:
+            return self._role_locks.setdefault(role_arn, threading.Lock())
+
+    # Return the credential metadata for a role, assuming the role only if there are no cached credentials that are still fresh
+    def get_credentials(self, role_arn, session_name):
+        with self._role_lock(role_arn):
+            credentials = self._credentials.get(role_arn)
+            if credentials is not None and self._is_fresh(credentials):
+                with self._lock:
+                    self.hits += 1
+                return credentials
+            with self._lock:
+                self.misses += 1
+            temp_credentials = self.sts_client().assume_role(RoleArn=role_arn, RoleSessionName=session_name)['Credentials']
+            credentials = {
+                'access_key': temp_credentials['AccessKeyId'],
+                'secret_key': temp_credentials['SecretAccessKey'],
+                'token': temp_credentials['SessionToken'],
+                'expiry_time': temp_credentials['Expiration'].isoformat(),
+            }
+            self._credentials[role_arn] = credentials
+            return credentials
+
+    # Return a boto3 session for a role, whose credentials are refreshed (and the cache file updated) before they expire.
+    # The session can be built on a given botocore session (e.g. one sharing a ClientPool's data loader).
+    def session(self, role_arn, session_name, botocore_session=None):
+        def refresh():
+            credentials = self.get_credentials(role_arn, session_name)
+            self.save()
+            return credentials
+        refreshable_credentials = RefreshableCredentials.create_from_metadata(
+            metadata=self.get_credentials(role_arn, session_name),
+            refresh_using=refresh,
+            method='sts-assume-role'
+        )
+        if botocore_session is None:
+            botocore_session = get_session()
+        botocore_session._credentials = refreshable_credentials
+        return boto3.Session(botocore_session=botocore_session)
+
+    # Write the cache file, if any (readable by the owner only, and via a temporary file so an interrupted run can't leave a corrupt cache behind)
+    def save(self):
+        if not self.file_name:
+            return
+        with self._lock:
+            data = json.dumps(self._credentials).encode()
+            if self.fernet is not None:
+                data = self.fernet.encrypt(data)
+            temp_file_name = f"{self.file_name}.tmp"
+            with open(os.open(temp_file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(temp_file_name, self.file_name)
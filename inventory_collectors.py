@@ -0,0 +1,422 @@
+# Per-region collector functions for the inventory scripts, run by the OrgScanner in org_inventory.py.
+# Each collector takes a ScanUnit (account ID, boto3 session and region) and yields the items found in that account/region, page by page.
+# Collectors that also run on the asyncio engine share everything but their I/O: paginated collectors are built from a page function by
+# paginated_collector, and follow-up requests are written as request plans (see web_acl_requests) run by ScanUnit/AsyncScanUnit.run_plan.
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, Future
+import asyncio
+import threading
+from org_inventory import Collector, error_entry
+from anfw_rules import stateless_rules, parse_suricata_rules
+
+# Return a Collector yielding the items returned by page_items(unit, page) for each page of an API operation in the account/region,
+# with both its thread engine and asyncio engine functions
+def paginated_collector(name, service, operation_name, page_items, operation_kwargs=None, regions=None, skip_empty=True):
+    def collect(unit):
+        client = unit.client(service)
+        for page in unit.paginate(client, operation_name, **(operation_kwargs or {})):
+            yield from page_items(unit, page)
+
+    async def collect_async(unit):
+        client = await unit.client(service)
+        async for page in unit.paginate(client, operation_name, **(operation_kwargs or {})):
+            for item in page_items(unit, page):
+                yield item
+
+    return Collector(name, collect, regions, collect_async, skip_empty)
+
+# ---------- Security Groups (sg_inventory.py) -----------
+
+# Return the describe security group responses to yield for a page (empty pages are skipped)
+def security_group_pages(unit, describe_security_groups_response):
+    return [describe_security_groups_response] if describe_security_groups_response['SecurityGroups'] else []
+
+# Return a dict of security group ID to the number of network interfaces it is attached to, for a page of describe network interface responses
+def count_network_interface_groups(describe_network_interfaces_response):
+    group_counts = {}
+    for network_interface in describe_network_interfaces_response['NetworkInterfaces']:
+        for group in network_interface.get('Groups', []):
+            group_counts[group['GroupId']] = group_counts.get(group['GroupId'], 0) + 1
+    return group_counts
+
+# Return the security group attachment counts (see count_network_interface_groups) to yield for a page of network interfaces
+# (pages without any attachments are skipped)
+def network_interface_group_pages(unit, describe_network_interfaces_response):
+    group_counts = count_network_interface_groups(describe_network_interfaces_response)
+    return [group_counts] if group_counts else []
+
+# ---------- KMS Keys (kms_keys_inventory.py) -----------
+
+kms_headers = [
+    'Account_ID',
+    'Region',
+    'Key ID',
+    'Key ARN',
+    'Key Manager'
+]
+
+# Return the metadata of a KMS key, from the key cache if it has been described before
+def describe_kms_key(unit, kms, key, key_cache=None):
+    if key_cache is not None:
+        key_metadata = key_cache.get(key['KeyArn'])
+        if key_metadata is not None:
+            return key_metadata
+    key_metadata = unit.call(kms.describe_key, KeyId=key['KeyArn'])['KeyMetadata']
+    if key_cache is not None:
+        key_cache.put(key['KeyArn'], key_metadata)
+    return key_metadata
+
+# Return a dict of KMS key ID to alias names in the account/region, fetched in bulk with list_aliases
+def list_kms_aliases(unit, kms):
+    key_aliases = {}
+    for aliases_response in unit.paginate(kms, 'list_aliases'):
+        for alias in aliases_response['Aliases']:
+            if 'TargetKeyId' in alias:
+                key_aliases.setdefault(alias['TargetKeyId'], []).append(alias['AliasName'])
+    return key_aliases
+
+# Yield a row per KMS key in the account/region.
+# Each page of keys is enriched as a batch: uncached keys are described concurrently by describe_workers threads
+# (still within the account's request limit), and aliases are looked up from a single list_aliases pass.
+def collect_kms_keys(unit, key_cache=None, describe_workers=1, include_aliases=False):
+    kms = unit.client('kms')
+    key_aliases = list_kms_aliases(unit, kms) if include_aliases else {}
+    with ThreadPoolExecutor(max_workers=describe_workers) as executor:
+        for kms_response in unit.paginate(kms, 'list_keys'):
+            keys = kms_response['Keys']
+            keys_metadata = executor.map(lambda key: describe_kms_key(unit, kms, key, key_cache), keys)
+            for key, key_metadata in zip(keys, keys_metadata):
+                kms_row_list = [unit.account_id, unit.region, key['KeyId'], key['KeyArn'], key_metadata['KeyManager']]
+                if include_aliases:
+                    kms_row_list.append(" ".join(key_aliases.get(key['KeyId'], [])))
+                yield kms_row_list
+
+# Return the KMS collectors, configured with a key cache, describe worker count and alias enrichment
+def make_kms_collectors(key_cache=None, describe_workers=1, include_aliases=False):
+    return [Collector('kms_keys', lambda unit: collect_kms_keys(unit, key_cache, describe_workers, include_aliases))]
+
+# ---------- WAF Web ACLs (waf_acl_inventory.py) -----------
+
+waf_headers = [
+    'Account_ID',
+    'Region',
+    'Web_ACL_Name',
+    'Web_ACL_ID',
+    'Web_ACL_Description',
+    'Web_ACL_ARN'
+]
+
+# Return a row per regional WAF Web ACL in a page of list_web_acls responses for the account/region
+def waf_regional_rows(unit, regional_waf):
+    return [[unit.account_id, unit.region, acl['Name'], acl['Id'], acl['Description'], acl['ARN']] for acl in regional_waf['WebACLs']]
+
+# Return a row per Global/CloudFront WAF Web ACL in a page of list_web_acls responses for the account (CloudFront Web ACLs are only available from us-east-1)
+def waf_cloudfront_rows(unit, cf_waf):
+    return [[unit.account_id, 'CLOUDFRONT', acl['Name'], acl['Id'], acl['Description'], acl['ARN']] for acl in cf_waf['WebACLs']]
+
+# Columns added to the Web ACL rows by --detail, and the columns of the flattened Web ACL rules table
+waf_detail_headers = waf_headers + [
+    'Capacity',
+    'Default_Action',
+    'Rule_Count',
+    'Managed_Rule_Groups',
+    'Associated_Resources'
+]
+
+waf_rule_headers = [
+    'Account_ID',
+    'Region',
+    'Web_ACL_Name',
+    'Web_ACL_ARN',
+    'Rule_Name',
+    'Priority',
+    'Action',
+    'Statement_Type',
+    'Rule_Group',
+    'Rule_Group_Version',
+    'Rule_Action_Overrides'
+]
+
+# Types of regional resources a Web ACL can be associated with (list_resources_for_web_acl lists one type per request)
+WAF_REGIONAL_RESOURCE_TYPES = ['APPLICATION_LOAD_BALANCER', 'API_GATEWAY', 'APPSYNC', 'COGNITO_USER_POOL', 'APP_RUNNER_SERVICE', 'VERIFIED_ACCESS_INSTANCE']
+
+# Return the first key of a WAF action or statement dict, e.g. 'Block' for {'Block': {}}
+def _first_key(value):
+    return next(iter(value), '')
+
+# Return a row per rule of a get_web_acl WebACL, including the Firewall Manager rule groups evaluated before and after its own rules.
+# Managed rule groups are shown as Vendor:Name, and rule group references by their ARN.
+def web_acl_rule_rows(account_id, region, web_acl):
+    rule_rows = []
+    rules = web_acl.get('PreProcessFirewallManagerRuleGroups', []) + web_acl.get('Rules', []) + web_acl.get('PostProcessFirewallManagerRuleGroups', [])
+    for rule in rules:
+        statement = rule.get('Statement') or rule.get('FirewallManagerStatement', {})
+        rule_group, rule_group_version, rule_action_overrides = '', '', []
+        if 'ManagedRuleGroupStatement' in statement:
+            managed_rule_group = statement['ManagedRuleGroupStatement']
+            rule_group = f"{managed_rule_group['VendorName']}:{managed_rule_group['Name']}"
+            rule_group_version = managed_rule_group.get('Version', '')
+            rule_action_overrides = managed_rule_group.get('RuleActionOverrides', []) + managed_rule_group.get('ExcludedRules', [])
+        elif 'RuleGroupReferenceStatement' in statement:
+            rule_group = statement['RuleGroupReferenceStatement']['ARN']
+            rule_action_overrides = statement['RuleGroupReferenceStatement'].get('RuleActionOverrides', []) + statement['RuleGroupReferenceStatement'].get('ExcludedRules', [])
+        if 'Action' in rule:
+            action = _first_key(rule['Action'])
+        elif 'OverrideAction' in rule:
+            action = f"Override:{_first_key(rule['OverrideAction'])}"
+        else:
+            action = ''
+        rule_rows.append([account_id, region, web_acl['Name'], web_acl['ARN'], rule['Name'], rule['Priority'], action, _first_key(statement),
+                          rule_group, rule_group_version, " ".join(override['Name'] for override in rule_action_overrides)])
+    return rule_rows
+
+# Return the [row, rule rows] item of a Web ACL: its row with the detail columns, and the rows of its rules
+def web_acl_detail(account_id, region, acl, web_acl, resource_arns):
+    rule_rows = web_acl_rule_rows(account_id, region, web_acl)
+    managed_rule_groups = [rule_row[8] for rule_row in rule_rows if rule_row[7] == 'ManagedRuleGroupStatement']
+    row = [account_id, region, acl['Name'], acl['Id'], acl['Description'], acl['ARN'],
+           web_acl.get('Capacity'), _first_key(web_acl.get('DefaultAction', {})), len(rule_rows), " ".join(managed_rule_groups), " ".join(resource_arns)]
+    return [row, rule_rows]
+
+# Request plan of a Web ACL's detail, run by ScanUnit.run_plan (or AsyncScanUnit.run_plan on the asyncio engine): yields each request as a
+# (client, operation name, kwargs) tuple, and returns the get_web_acl WebACL and the ARNs of the resources the Web ACL is associated with
+# (CloudFront distributions for the CLOUDFRONT scope), or None if the Web ACL was deleted after it was listed.
+# A resource type that can't be listed (e.g. a type not available in the region) is added to the error report and skipped, rather than
+# failing the whole account/region.
+def web_acl_requests(unit, wafv2, cloudfront, scope, acl):
+    try:
+        web_acl = (yield wafv2, 'get_web_acl', {'Name': acl['Name'], 'Scope': scope, 'Id': acl['Id']})['WebACL']
+    except ClientError as error:
+        if error.response['Error'].get('Code') == 'WAFNonexistentItemException':
+            return None
+        raise
+    resource_arns = []
+    if scope == 'REGIONAL':
+        for resource_type in WAF_REGIONAL_RESOURCE_TYPES:
+            try:
+                resource_arns += (yield wafv2, 'list_resources_for_web_acl', {'WebACLArn': acl['ARN'], 'ResourceType': resource_type})['ResourceArns']
+            except ClientError as error:
+                print(f"Couldn't list the {resource_type} resources of Web ACL {acl['Name']} in account {unit.account_id} region {unit.region}. Here's why: {error}")
+                unit.scanner.record_error(error_entry(error, unit.account_id, unit.region, f"list_resources_for_web_acl:{resource_type}"))
+    else:
+        kwargs = {'WebACLId': acl['ARN']}
+        while True:
+            distribution_list = (yield cloudfront, 'list_distributions_by_web_acl_id', dict(kwargs))['DistributionList']
+            resource_arns += [distribution['ARN'] for distribution in distribution_list.get('Items', [])]
+            if not distribution_list.get('IsTruncated'):
+                break
+            kwargs['Marker'] = distribution_list['NextMarker']
+    return web_acl, resource_arns
+
+# Yield a [row, rule rows] item (see web_acl_detail) per Web ACL of a scope in the account/region. Each page of Web ACLs is described
+# concurrently by detail_workers threads, within the account/region's request limit (region_requests).
+def collect_waf_web_acl_details(unit, scope, detail_workers, region_requests):
+    wafv2 = unit.client('wafv2')
+    cloudfront = unit.client('cloudfront') if scope == 'CLOUDFRONT' else None
+    region = 'CLOUDFRONT' if scope == 'CLOUDFRONT' else unit.region
+    with ThreadPoolExecutor(max_workers=detail_workers) as executor:
+        for list_web_acls_response in unit.paginate(wafv2, 'list_web_acls', Scope=scope):
+            acls = list_web_acls_response['WebACLs']
+            details = executor.map(lambda acl: unit.run_plan(web_acl_requests(unit, wafv2, cloudfront, scope, acl), region_requests), acls)
+            for acl, detail in zip(acls, details):
+                if detail is not None:
+                    yield web_acl_detail(unit.account_id, region, acl, *detail)
+
+# Async version of collect_waf_web_acl_details, for the asyncio engine (each page of Web ACLs is described concurrently, within region_requests)
+async def collect_waf_web_acl_details_async(unit, scope, region_requests):
+    wafv2 = await unit.client('wafv2')
+    cloudfront = await unit.client('cloudfront') if scope == 'CLOUDFRONT' else None
+    region = 'CLOUDFRONT' if scope == 'CLOUDFRONT' else unit.region
+    async for list_web_acls_response in unit.paginate(wafv2, 'list_web_acls', Scope=scope):
+        acls = list_web_acls_response['WebACLs']
+        details = await asyncio.gather(*(unit.run_plan(web_acl_requests(unit, wafv2, cloudfront, scope, acl), region_requests) for acl in acls))
+        for acl, detail in zip(acls, details):
+            if detail is not None:
+                yield web_acl_detail(unit.account_id, region, acl, *detail)
+
+# Return the WAF collectors with Web ACL detail. WAFv2 rate limits apply per account and region, so the detail requests to each
+# account/region (including the CloudFront scope, served from us-east-1) are limited to max_region_requests at a time.
+def make_waf_detail_collectors(detail_workers=4, max_region_requests=2):
+    region_semaphores = {}
+    region_semaphores_lock = threading.Lock()
+    async_region_semaphores = {} # Only used from the asyncio engine's event loop thread
+
+    def region_requests(unit):
+        with region_semaphores_lock:
+            return region_semaphores.setdefault((unit.account_id, unit.region), threading.Semaphore(max_region_requests))
+
+    def async_region_requests(unit):
+        return async_region_semaphores.setdefault((unit.account_id, unit.region), asyncio.Semaphore(max_region_requests))
+
+    return [
+        Collector('waf_regional', lambda unit: collect_waf_web_acl_details(unit, 'REGIONAL', detail_workers, region_requests(unit)),
+                  async_function=lambda unit: collect_waf_web_acl_details_async(unit, 'REGIONAL', async_region_requests(unit))),
+        Collector('waf_cloudfront', lambda unit: collect_waf_web_acl_details(unit, 'CLOUDFRONT', detail_workers, region_requests(unit)), regions=['us-east-1'],
+                  async_function=lambda unit: collect_waf_web_acl_details_async(unit, 'CLOUDFRONT', async_region_requests(unit))),
+    ]
+
+# ---------- Network Firewall rules (list_anfw_rules.py) -----------
+
+stateful_rule_headers = [
+    'FirewallName',
+    'RuleGroupPriority',
+    'RuleGroupName',
+    'Action',
+    'Direction',
+    'Protocol',
+    'Source',
+    'SourcePort',
+    'Destination',
+    'DestinationPort',
+    'Sid',
+    'Content'
+]
+
+domain_rule_headers = [
+    'FirewallName',
+    'RuleGroupPriority',
+    'RuleGroupName',
+    'Action',
+    'Domain',
+]
+
+stateless_rule_headers = [
+    'FirewallName',
+    'RuleGroupPriority',
+    'RuleGroupName',
+    'RulePriority',
+    'Actions',
+    'Protocol',
+    'Source',
+    'SourcePort',
+    'Destination',
+    'DestinationPort',
+    'TCPFlags'
+]
+
+# Return the stateful rule rows, domain rule rows and stateless rule rows of a describe rule group response, for a firewall using the rule
+# group at a priority. Stateful rules come from StatefulRules or a Suricata RulesString (lines that aren't valid rules are skipped), and
+# stateless rules are expanded into a row per combination of their MatchAttributes.
+def rule_group_rows(firewall_name, rule_group_priority, describe_rule_group_response):
+    stateful_rows, domain_rows, stateless_rows = [], [], []
+    rule_group_name = describe_rule_group_response['RuleGroupResponse']['RuleGroupName']
+    rules_source = describe_rule_group_response['RuleGroup']['RulesSource']
+    if 'StatefulRules' in rules_source:
+        for stateful_rule in rules_source['StatefulRules']:
+            rule_options = {}
+            for keyword in stateful_rule.get('RuleOptions', []):
+                if 'Keyword' in keyword:
+                    rule_options.setdefault(keyword['Keyword'], []).extend(keyword.get('Settings', []))
+            stateful_rows.append([
+                firewall_name,
+                rule_group_priority,
+                rule_group_name,
+                stateful_rule['Action'],
+                stateful_rule['Header']['Direction'],
+                stateful_rule['Header']['Protocol'],
+                stateful_rule['Header']['Source'],
+                stateful_rule['Header']['SourcePort'],
+                stateful_rule['Header']['Destination'],
+                stateful_rule['Header']['DestinationPort'],
+                rule_options.get('sid', [''])[0],
+                " ".join(rule_options.get('content', []))
+            ])
+    elif 'RulesString' in rules_source:
+        for rule in parse_suricata_rules(rules_source['RulesString']):
+            stateful_rows.append([firewall_name, rule_group_priority, rule_group_name] + list(rule))
+    elif 'RulesSourceList' in rules_source:
+        for target in rules_source['RulesSourceList']['Targets']:
+            domain_rows.append([firewall_name, rule_group_priority, rule_group_name, rules_source['RulesSourceList']['GeneratedRulesType'], target])
+    elif 'StatelessRulesAndCustomActions' in rules_source:
+        for rule in stateless_rules(rules_source['StatelessRulesAndCustomActions']):
+            stateless_rows.append([firewall_name, rule_group_priority, rule_group_name] + list(rule))
+    return stateful_rows, domain_rows, stateless_rows
+
+# Describe calls shared by every account/region combination of a scan, keyed by resource ARN, so a firewall policy or rule group used by
+# several firewalls (or policies) is described only once. Callers asking for an ARN that is being described wait for the first call's result.
+class SharedDescribes:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.call_count = 0 # Number of describe calls made
+        self.shared_count = 0 # Number of describe calls saved by sharing a result
+
+    # Return the result of describe() for an ARN, calling it only if the ARN hasn't been described yet.
+    # Failed calls aren't kept, so a later caller (e.g. from an account with access) describes the ARN again.
+    def get(self, arn, describe):
+        with self.lock:
+            future = self.futures.get(arn)
+            is_caller = future is None
+            if is_caller:
+                future = self.futures[arn] = Future()
+                self.call_count += 1
+            else:
+                self.shared_count += 1
+        if is_caller:
+            try:
+                future.set_result(describe())
+            except Exception as error:
+                with self.lock:
+                    del self.futures[arn]
+                future.set_exception(error)
+        return future.result()
+
+# Return the describe rule group response for a rule group ARN, from the rule group cache if the rule group hasn't been modified since it
+# was cached (checked with the much smaller describe_rule_group_metadata response). call makes each API request, e.g. ScanUnit.call.
+def describe_rule_group(anfw, rule_group_arn, rule_group_cache=None, call=lambda operation, **kwargs: operation(**kwargs)):
+    if rule_group_cache is not None:
+        rule_group_metadata = call(anfw.describe_rule_group_metadata, RuleGroupArn=rule_group_arn)
+        describe_rule_group_response = rule_group_cache.get(rule_group_arn, rule_group_metadata.get('LastModifiedTime'))
+        if describe_rule_group_response is not None:
+            return describe_rule_group_response
+    describe_rule_group_response = call(anfw.describe_rule_group, RuleGroupArn=rule_group_arn)
+    if rule_group_cache is not None:
+        rule_group_cache.put(rule_group_arn, describe_rule_group_response)
+    return describe_rule_group_response
+
+# Yield a ('stateful', row), ('domain', row) or ('stateless', row) item per rule of every firewall in the account/region, with the account ID and region
+# prepended to the rows. Each page of firewalls is described concurrently by describe_workers threads (within the account's request limit),
+# then the rule groups of their policies are fetched concurrently, each distinct policy and rule group ARN being described once per scan
+# (and rule groups unchanged since they were cached taken from the rule group cache, if given).
+def collect_firewall_rules(unit, shared_describes, describe_workers=4, rule_group_cache=None):
+    anfw = unit.client('network-firewall')
+
+    def describe_policy(firewall):
+        firewall_response = unit.call(anfw.describe_firewall, FirewallArn=firewall['FirewallArn'])['Firewall']
+        policy_arn = firewall_response['FirewallPolicyArn']
+        policy_response = shared_describes.get(policy_arn, lambda: unit.call(anfw.describe_firewall_policy, FirewallPolicyArn=policy_arn))
+        return firewall_response['FirewallName'], policy_response['FirewallPolicy']
+
+    def describe_shared_rule_group(rule_group_arn):
+        return shared_describes.get(rule_group_arn, lambda: describe_rule_group(anfw, rule_group_arn, rule_group_cache, unit.call))
+
+    with ThreadPoolExecutor(max_workers=describe_workers) as executor:
+        for list_firewalls_response in unit.paginate(anfw, 'list_firewalls'):
+            firewall_policies = list(executor.map(describe_policy, list_firewalls_response['Firewalls']))
+            rule_group_refs = [(firewall_name, rule_group_ref) for firewall_name, firewall_policy in firewall_policies
+                               for rule_group_ref in firewall_policy.get('StatelessRuleGroupReferences', []) + firewall_policy.get('StatefulRuleGroupReferences', [])]
+            rule_group_arns = list(dict.fromkeys(rule_group_ref['ResourceArn'] for firewall_name, rule_group_ref in rule_group_refs))
+            rule_groups = dict(zip(rule_group_arns, executor.map(describe_shared_rule_group, rule_group_arns)))
+            for firewall_name, rule_group_ref in rule_group_refs:
+                stateful_rows, domain_rows, stateless_rows = rule_group_rows(firewall_name, rule_group_ref.get('Priority'), rule_groups[rule_group_ref['ResourceArn']])
+                for row in stateful_rows:
+                    yield 'stateful', [unit.account_id, unit.region] + row
+                for row in domain_rows:
+                    yield 'domain', [unit.account_id, unit.region] + row
+                for row in stateless_rows:
+                    yield 'stateless', [unit.account_id, unit.region] + row
+
+# Return the Network Firewall collectors, sharing policy and rule group describes across the scan, with an optional rule group cache
+def make_firewall_collectors(shared_describes, describe_workers=4, rule_group_cache=None):
+    return [Collector('network_firewalls', lambda unit: collect_firewall_rules(unit, shared_describes, describe_workers, rule_group_cache))]
+
+security_group_collectors = [paginated_collector('security_groups', 'ec2', 'describe_security_groups', security_group_pages)]
+# Network interfaces are listed in bulk, 1000 per request, so the cost doesn't grow with the number of security groups.
+# Regions without network interfaces are never skipped by --all-regions, as every security group in them is unused.
+network_interface_collectors = [paginated_collector('network_interfaces', 'ec2', 'describe_network_interfaces', network_interface_group_pages,
+                                                    operation_kwargs={'PaginationConfig': {'PageSize': 1000}}, skip_empty=False)]
+kms_collectors = make_kms_collectors()
+waf_collectors = [
+    paginated_collector('waf_regional', 'wafv2', 'list_web_acls', waf_regional_rows, operation_kwargs={'Scope': 'REGIONAL'}),
+    paginated_collector('waf_cloudfront', 'wafv2', 'list_web_acls', waf_cloudfront_rows, operation_kwargs={'Scope': 'CLOUDFRONT'}, regions=['us-east-1']),
+]
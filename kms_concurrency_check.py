@@ -0,0 +1,119 @@
+import argparse
+import csv
+import hashlib
+import io
+import random
+import threading
+import time
+from org_inventory import OrgScanner
+from inventory_collectors import make_kms_collectors, kms_headers
+
+# Add command-line arguments for the size of the synthetic KMS fixture and the worker counts to compare
+parser = argparse.ArgumentParser(description="Check that concurrent KMS scans write the same CSV as serial scans, on a synthetic Organization-scale fixture - Arguments")
+parser.add_argument("-a", "--accounts", default=20, type=int, help="Number of accounts in the fixture")
+parser.add_argument("-r", "--regions", default=3, type=int, help="Number of regions per account")
+parser.add_argument("-k", "--keys", default=150, type=int, help="Average number of KMS keys per account/region")
+parser.add_argument("-w", "--workers", default="1,4,16", type=str, help="Comma-separated worker counts to compare (the first is the reference)")
+parser.add_argument("-d", "--describe-workers", default=4, type=int, help="Number of concurrent describe_key requests within each account/region")
+parser.add_argument("--delay", default=0.002, type=float, help="Maximum random delay of each fixture API call in seconds, so concurrent requests complete out of order")
+parser.add_argument("-s", "--seed", default=42, type=int, help="Random seed for the fixture")
+args=parser.parse_args()
+
+# Number of keys and aliases per page of the fixture's list_keys and list_aliases responses
+PAGE_SIZE = 100
+
+
+# In-memory KMS client of one account/region, serving list_keys, describe_key and list_aliases from the fixture.
+# Every call sleeps for a random time, so the order in which concurrent requests complete changes from run to run.
+class FixtureKmsClient:
+    def __init__(self, key_ids, key_managers, aliases):
+        self.key_ids = key_ids
+        self.key_managers = key_managers
+        self.aliases = aliases
+
+    # Pages are followed with NextMarker by ScanUnit.paginate
+    def can_paginate(self, operation_name):
+        return False
+
+    def _page(self, items, name, kwargs):
+        time.sleep(random.uniform(0, args.delay))
+        start = int(kwargs.get('NextMarker', 0))
+        page = {name: items[start:start + PAGE_SIZE]}
+        if start + PAGE_SIZE < len(items):
+            page['NextMarker'] = str(start + PAGE_SIZE)
+        return page
+
+    def list_keys(self, **kwargs):
+        return self._page([{'KeyId': key_id, 'KeyArn': f"arn:aws:kms:fixture:key/{key_id}"} for key_id in self.key_ids], 'Keys', kwargs)
+
+    def list_aliases(self, **kwargs):
+        return self._page(self.aliases, 'Aliases', kwargs)
+
+    def describe_key(self, KeyId):
+        time.sleep(random.uniform(0, args.delay))
+        key_id = KeyId.rsplit("/", 1)[-1]
+        return {'KeyMetadata': {'KeyId': key_id, 'Arn': KeyId, 'KeyManager': self.key_managers[key_id]}}
+
+
+# OrgScanner over the fixture clients: only the state used by OrgScanner.run is set up, so no role is assumed and no AWS request is made
+class FixtureScanner(OrgScanner):
+    def __init__(self, clients, account_ids, workers):
+        self.clients = clients
+        self.workers = workers
+        self.max_account_requests = 4
+        self.verbose = False
+        self.engine = "threads"
+        self.unit_attempts = 3
+        self.errors = []
+        self.account_ids_failed = []
+        self.account_ids_scanned = account_ids
+        self.regions_scanned = []
+        self.sessions = {account_id: None for account_id in account_ids}
+        self.errors_lock = threading.Lock()
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+
+    def client(self, account_id, service, region):
+        return self.clients[(account_id, region)]
+
+
+# Return the fixture clients per (account ID, region), with random key IDs, key managers and aliases (some keys without any, some with several)
+def synthetic_clients(rng, account_ids, regions):
+    clients = {}
+    for account_id in account_ids:
+        for region in regions:
+            key_ids = [f"{rng.getrandbits(128):032x}" for _ in range(rng.randint(0, 2 * args.keys))]
+            key_managers = {key_id: rng.choice(["AWS", "CUSTOMER", "CUSTOMER"]) for key_id in key_ids}
+            aliases = [{'AliasName': f"alias/key-{alias_number}", 'TargetKeyId': rng.choice(key_ids)}
+                       for alias_number in range(len(key_ids) // 2)]
+            aliases.append({'AliasName': "alias/aws/unassigned"})
+            clients[(account_id, region)] = FixtureKmsClient(key_ids, key_managers, aliases)
+    return clients
+
+# Scan the fixture with a number of workers, writing the rows as kms_keys_inventory.py --aliases does, and return the CSV output
+def scan_csv(clients, account_ids, regions, workers):
+    scanner = FixtureScanner(clients, account_ids, workers)
+    csv_file = io.StringIO()
+    writer = csv.writer(csv_file)
+    writer.writerow(kms_headers + ['Aliases'])
+    for result in scanner.run(make_kms_collectors(None, args.describe_workers, True), regions):
+        writer.writerows(result.items)
+    if scanner.errors:
+        print(f"{len(scanner.errors)} account/region combinations failed with {workers} workers")
+    return csv_file.getvalue()
+
+rng = random.Random(args.seed)
+account_ids = [f"{100000000000 + account_number}" for account_number in range(args.accounts)]
+regions = [f"fixture-region-{region_number}" for region_number in range(args.regions)]
+clients = synthetic_clients(rng, account_ids, regions)
+print(f"Synthetic fixture: {len(account_ids)} accounts, {len(regions)} regions, {sum(len(client.key_ids) for client in clients.values())} KMS keys")
+
+worker_counts = [int(workers) for workers in args.workers.split(",")]
+outputs = []
+for workers in worker_counts:
+    start = time.perf_counter()
+    outputs.append(scan_csv(clients, account_ids, regions, workers))
+    print(f"{workers} workers: {outputs[-1].count(chr(10)) - 1} rows in {time.perf_counter() - start:.2f}s (sha256 {hashlib.sha256(outputs[-1].encode()).hexdigest()[:16]})")
+
+for workers, output in zip(worker_counts[1:], outputs[1:]):
+    print(f"CSV output with {workers} workers is byte-identical to {worker_counts[0]} workers: {output == outputs[0]}")
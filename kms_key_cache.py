@@ -0,0 +1,42 @@
+# Persistent on-disk cache of KMS key metadata, keyed by KeyArn, used by kms_keys_inventory.py.
+# Only immutable metadata (e.g. KeyManager) is cached, so keys seen in a previous run never need another describe_key request.
+import json
+import os
+import threading
+
+# Fields of the describe_key KeyMetadata to keep in the cache
+CACHED_METADATA_FIELDS = ['KeyManager']
+
+
+class KmsKeyCache:
+    def __init__(self, file_name="kms_key_cache.json"):
+        self.file_name = file_name
+        self.hits = 0 # Counter to hold the number of keys found in the cache
+        self.misses = 0 # Counter to hold the number of keys that had to be described
+        self._lock = threading.Lock()
+        self._metadata = {}
+        if os.path.exists(file_name):
+            with open(file_name, 'r') as cache_file:
+                self._metadata = json.load(cache_file)
+
+    # Return the cached metadata for a key ARN, or None if the key hasn't been described before
+    def get(self, key_arn):
+        with self._lock:
+            key_metadata = self._metadata.get(key_arn)
+            if key_metadata is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return key_metadata
+
+    # Store the cached fields of a describe_key KeyMetadata response
+    def put(self, key_arn, key_metadata):
+        with self._lock:
+            self._metadata[key_arn] = {field: key_metadata[field] for field in CACHED_METADATA_FIELDS}
+
+    # Write the cache to disk (via a temporary file, so an interrupted run can't leave a corrupt cache behind)
+    def save(self):
+        with self._lock:
+            with open(f"{self.file_name}.tmp", 'w') as cache_file:
+                json.dump(self._metadata, cache_file)
+            os.replace(f"{self.file_name}.tmp", self.file_name)
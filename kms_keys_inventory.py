@@ -1,9 +1,12 @@
-import boto3
-from botocore.exceptions import ClientError
-import json
 import argparse
 import os
 import csv
+from org_inventory import OrgScanner
+from region_map import RegionMap
+from inventory_collectors import make_kms_collectors, kms_headers
+from kms_key_cache import KmsKeyCache
+from snapshot_store import SnapshotStore
+from scan_checkpoint import ScanCheckpoint
 
 # Add command-line arguments for region and role to assume within accounts
 parser = argparse.ArgumentParser(description="Get KMS Keys Cross-Account Python Script - Arguments")
@@ -11,22 +14,37 @@ parser.add_argument("-r", "--region", default="us-east-1", type=str, help="AWS R
 parser.add_argument("-o", "--organization", action="store_true", help="If specified, execute across all accounts in AWS Organization")
 parser.add_argument("-a", "--assumed-role", default="ReadOnlyRole", type=str, help="Role to assume in each organization account")
 parser.add_argument("-f", "--file", default="kms_keys.csv", type=str, help="File to write KMS keys to")
+parser.add_argument("-w", "--workers", default=1, type=int, help="Number of account/region combinations to scan concurrently (1 = serial)")
+parser.add_argument("-m", "--max-account-requests", default=4, type=int, help="Maximum number of concurrent KMS API requests per account, to stay under throttling limits")
+parser.add_argument("-d", "--describe-workers", default=4, type=int, help="Number of concurrent describe_key requests within each account/region")
+parser.add_argument("-c", "--cache-file", default="kms_key_cache.json", type=str, help="File to cache KMS key metadata in, so keys are only described once across runs")
+parser.add_argument("--no-cache", action="store_true", help="If specified, describe every KMS key without reading or writing the key cache")
+parser.add_argument("--aliases", action="store_true", help="If specified, add the aliases of each KMS key to the output (one list_aliases call per region)")
+parser.add_argument("--since-last", action="store_true", help="If specified, only write the resources added, changed or removed since the last --since-last run (with a Change column)")
+parser.add_argument("--state-dir", default="inventory_state", type=str, help="Directory holding the snapshot store used by --since-last")
+parser.add_argument("--resume", action="store_true", help="If specified, resume an interrupted run: account/region combinations completed by the previous run are taken from the checkpoint file instead of being scanned again")
+parser.add_argument("--checkpoint-file", type=str, help="File to checkpoint completed account/region combinations to (default: the output file name + '.checkpoint')")
+parser.add_argument("--all-regions", action="store_true", help="If specified, scan every region enabled in each account (instead of --region), skipping the regions found empty or denied by earlier runs")
+parser.add_argument("--region-map-file", default="region_map.json", type=str, help="File caching the enabled, empty and denied regions of each account, used by --all-regions")
+parser.add_argument("--refresh-regions", action="store_true", help="If specified with --all-regions, discover the enabled regions again and re-scan the regions found empty or denied by earlier runs")
+parser.add_argument("--max-pool-connections", default=10, type=int, help="Maximum number of HTTP connections kept open per pooled client (should be at least --max-account-requests)")
+parser.add_argument("--credential-cache", type=str, help="File to cache assumed-role credentials in, so back-to-back runs assume each role only once per session lifetime. The file is encrypted if INVENTORY_CREDENTIAL_KEY is set, and holds the credentials in plaintext otherwise")
 parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
 args=parser.parse_args()
 
 # Get the Current Account ID and role and print to screen
-caller_identity = boto3.client('sts').get_caller_identity()
-current_account_id = caller_identity['Account']
-current_role = caller_identity['Arn']
+scanner = OrgScanner(args.assumed_role, "ListKMSInventoryScript", args.workers, args.max_account_requests, args.verbose, credential_cache_file=args.credential_cache,
+                     max_pool_connections=args.max_pool_connections)
+current_account_id = scanner.current_account_id
 
 if (args.verbose):
     print(f"Current Account ID: {current_account_id}")
-    print(f"Current Role: {current_role}")
+    print(f"Current Role: {scanner.current_role}")
 
 # Configure the list of regions to iterate through, and print to screen.
 regions = [
     # Add any additional regions you want to check here.
-    # Regions that are denied by SCPs will cause the script to fail.
+    # Use --all-regions to scan every region enabled in each account instead.
 ]
 if args.region not in regions:
     regions.insert(0, args.region)
@@ -35,110 +53,74 @@ if (args.verbose):
     print("Regions selected:")
     print(regions)
 
-# Create a list object to hold the KMS Keys in each account:
-kms_list_of_values = [] # List to hold the list of values for each row in the customized KMS output
+# If all-regions mode is selected, scan every region enabled in each account, skipping the regions found empty or denied by earlier runs
+region_map = RegionMap(args.region_map_file, refresh=args.refresh_regions) if args.all_regions else None
+
+# Configure the KMS collector with the key metadata cache and alias enrichment
+key_cache = None if args.no_cache else KmsKeyCache(args.cache_file)
+kms_collectors = make_kms_collectors(key_cache, args.describe_workers, args.aliases)
+if args.aliases:
+    kms_headers = kms_headers + ['Aliases']
+
+# If delta mode is selected, compare the keys against the snapshot of the last run, and only write the changes
+delta = SnapshotStore(args.state_dir).delta('kms_keys') if args.since_last else None
+if delta is not None:
+    kms_headers = ['Change'] + kms_headers
+
+# Counters for the KMS Keys in each account:
 total_key_count = 0 # Counter to hold the total number of KMS Keys identified
-key_count_account = 0 # Counter to hold the number of KMS Keys identified in each account
 key_count_dict = {} # Dict to hold the number of KMS Keys per account
 # key_count_region (instantiated in each loop) holds the number of KMS Keys identified in the current region in each account
 
-# Capture KMS keys for the current account: 
-
-key_count_account = 0
-for region in regions:
-    if args.verbose: print(f"Identifying KMS Keys within account {current_account_id}, region {region}...")
-    kms = boto3.client('kms', region_name=region)
-    kms_response = kms.list_keys()
-    if kms_response['Keys']:
-        for key in kms_response['Keys']:
-            describe = kms.describe_key(KeyId=key['KeyArn'])
-            kms_row_list = [current_account_id, region, key['KeyId'], key['KeyArn'], describe['KeyMetadata']['KeyManager']]
-            kms_list_of_values.append(kms_row_list)
-        key_count_region = len(kms_response['Keys'])
-        key_count_account += key_count_region
-        if args.verbose: print(f"Identified {key_count_region} KMS keys in account {current_account_id} region {region}.")
-total_key_count += key_count_account
-key_count_dict[current_account_id] = key_count_account
-if args.verbose: print(f"Identified {key_count_account} KMS Keys in account {current_account_id}.")
-
-if args.verbose: print("Completed identification of KMS keys in the current account")
-
-# ---------- Cross-account functionality below ----------- 
-account_ids = [] # List to hold account IDs to iterate through
-error_list = [] # List to hold errors encountered
-account_ids_scanned = [current_account_id] # List to hold account IDs that have been scanned
-account_ids_failed = [] # List to hold account IDs that failed to scan
-
-# If organization / cross-account capabilities are selected, execute across all accounts by assuming roles and appending to the same file:
-if (args.organization == True):
-    # Create a list of AWS Account IDs in the AWS Organization, and print to screen
-    try:
-        organizations_client = boto3.client('organizations')
-        account_list = organizations_client.list_accounts()
-        for account in account_list['Accounts']:
-            if account['Id'] != current_account_id:
-                account_ids.append(account['Id'])
-    except ClientError as error: 
-        print(f"Couldn't retrieve account IDs from AWS Organization. Here's why: {error.response['Error']['Message']}")
-        error_list.append(error.response['Error']['Message'])
-    else:
-        if args.verbose: print(f"{len(account_ids)} additional accounts found in your AWS Organization: ")
-        if args.verbose: print(account_ids)
-
-        # Iterate through account Ids and regions, capturing KMS Keys
-        for account_id in account_ids:
-            if account_id is not current_account_id:
-                key_count_account = 0 # Reset KMS Keys per-account counter
-                if args.verbose: print(f"Assuming role {args.assumed_role} in account {account_id}...")
-                try:
-                    # Assume role_name in each account and get temporary credentials (can use OrganizationAccountAccessRole but it is admin-level, advised to create/utilize read-only roles for this purposes)
-                    sts_client = boto3.client('sts')
-                    sts_response = sts_client.assume_role(RoleArn=f"arn:aws:iam::{account_id}:role/{args.assumed_role}", RoleSessionName="ListKMSInventoryScript")
-                    temp_credentials = sts_response['Credentials']
-                    assumed_session = boto3.Session(                                                                                                                   
-                        aws_access_key_id=temp_credentials['AccessKeyId'],                                                                                             
-                        aws_secret_access_key=temp_credentials['SecretAccessKey'],                                                                                     
-                        aws_session_token=temp_credentials['SessionToken']
-                    )
-                except ClientError as error:
-                    error_list.append(error.response['Error']['Message'])
-                    account_ids_failed.append(account_id)
-                    print(f"Couldn't assume role. Here's why: {error.response['Error']['Message']}")
-                    print(f"Skipping account {account_id}")
-                else:
-                    # Capture KMS Keys for the current account in each region iteratively, and append to the list
-                    account_ids_scanned.append(account_id)
-                    for region in regions:
-                        if args.verbose: print(f"Identifying KMS Keys within account {account_id}, region {region}...")
-                        kms = assumed_session.client('kms', region_name=region)
-                        kms_response = kms.list_keys()
-                        if kms_response['Keys']:
-                            for key in kms_response['Keys']:
-                                describe = kms.describe_key(KeyId=key['KeyArn'])
-                                kms_row_list = [account_id, region, key['KeyId'], key['KeyArn'], describe['KeyMetadata']['KeyManager']]
-                                kms_list_of_values.append(kms_row_list)
-                            key_count_region = len(kms_response['Keys'])
-                            key_count_account += key_count_region
-                            if args.verbose: print(f"Identified {key_count_region} KMS Keysin account {account_id} region {region}.")
-                total_key_count += key_count_account
-                key_count_dict[account_id] = key_count_account
-
-kms_headers = [
-    'Account_ID',
-    'Region',
-    'Key ID',
-    'Key ARN',
-    'Key Manager'
-]
+# Checkpoint each completed account/region combination, so an interrupted run can be resumed with --resume
+checkpoint = ScanCheckpoint(args.checkpoint_file or f"{args.file}.checkpoint", resume=args.resume)
+
+# Select the current account, and if organization / cross-account capabilities are selected, every account in the AWS Organization
+account_ids_scanned = scanner.select_accounts(args.organization)
 
-# Write KMS Keys to csv file
+# Capture KMS Keys for every account/region combination, streaming each row to the csv file as it is identified
+# (results are returned in a stable order, regardless of the number of workers)
 with open(args.file, 'w', newline="") as kmscsvfile:
     writer = csv.writer(kmscsvfile)
     writer.writerow(kms_headers)
     if args.verbose: print(kms_headers)
-    for row in kms_list_of_values:
-        writer.writerow(row)
-        if args.verbose: print(row)
+    for result in scanner.run(kms_collectors, regions, checkpoint=checkpoint, region_map=region_map):
+        key_count_region = 0
+        for row in result.items:
+            key_count_region += 1
+            if delta is not None:
+                change = delta.record(result.account_id, result.region, row[2], row)
+                if change is None:
+                    continue
+                row = [change] + row
+            writer.writerow(row)
+            if args.verbose: print(row)
+        # Keys missing from a combination that failed to scan aren't reported as removed
+        if delta is not None and not result.failed: delta.mark_scanned(result.account_id, result.region)
+        key_count_dict[result.account_id] = key_count_dict.get(result.account_id, 0) + key_count_region
+        total_key_count += key_count_region
+        if args.verbose and key_count_region: print(f"Identified {key_count_region} KMS Keys in account {result.account_id} region {result.region}.")
+    # Write the keys that no longer exist since the last run
+    if delta is not None:
+        for account_id, region, key_id, row in delta.removed():
+            writer.writerow(['removed'] + row)
+            if args.verbose: print(['removed'] + row)
+
+# Save the key metadata cache for the next run
+if key_cache is not None:
+    key_cache.save()
+    if args.verbose: print(f"KMS key cache: {key_cache.hits} keys found in the cache, {key_cache.misses} keys described")
+
+# Save the region map for the next --all-regions run
+if region_map is not None:
+    region_map.save()
+
+# The run has finished, so the checkpoint is no longer needed
+checkpoint.close()
+
+if delta is not None:
+    delta.commit()
+    print(f"Changes since the last run: {delta.change_counts['added']} added, {delta.change_counts['changed']} changed, {delta.change_counts['removed']} removed")
 
 print("----------------------------------------")
 print("AWS KMS key inventory is complete")
@@ -148,18 +130,12 @@ print(f"The following {len(account_ids_scanned)} accounts and regions were scann
 print("Accounts:")
 print(account_ids_scanned)
 print("Regions:")
-print(regions)
+print(scanner.regions_scanned if region_map is not None else regions)
 
 if args.verbose: 
     print("Number of KMS Keys identified in each account:")
     print(key_count_dict)
 
-if error_list:
-    with open("errors.txt", "w") as error_file:
-        for error in error_list:
-            error_file.write(f"\n{error}")
-    print(f"The following {len(account_ids_failed)} accounts encountered errors:")
-    print(account_ids_failed)
-    print(f"{len(error_list)} errors occurred. Error messages are located at: {os.getcwd()}/errors.txt")
+scanner.write_errors()
 
 print(f"CSV output is saved at: {os.getcwd()}/{args.file}")
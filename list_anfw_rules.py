@@ -4,7 +4,11 @@ import json
 import argparse
 import os
 import csv
-from tabulate import tabulate
+from table_renderer import StreamingTableWriter
+from org_inventory import OrgScanner
+from region_map import RegionMap
+from inventory_collectors import stateful_rule_headers, domain_rule_headers, stateless_rule_headers, rule_group_rows, describe_rule_group, make_firewall_collectors, SharedDescribes
+from anfw_rule_group_cache import RuleGroupCache
 
 # Add command-line arguments for region and role to assume within accounts
 parser = argparse.ArgumentParser(description="Get AWS Network Firewall Rule Listing Python Script - Arguments")
@@ -12,130 +16,136 @@ parser.add_argument("-r", "--region", default="us-east-1", type=str, help="AWS R
 parser.add_argument("-n", "--firewall-name", type=str, help="Name of the AWS network firewall to list the rules for")
 parser.add_argument("-a", "--firewall-arn", type=str, help="ARN of the AWS network firewall to list the rules for")
 parser.add_argument("-o", "--output-file", default="anfw_rules.csv", type=str, help="File to write rule groups to")
+parser.add_argument("--all-firewalls", action="store_true", help="If specified, list the rules of every firewall (found with list_firewalls) instead of a single firewall, with the account and region of each rule")
+parser.add_argument("--organization", action="store_true", help="If specified with --all-firewalls, execute across all accounts in AWS Organization")
+parser.add_argument("--assumed-role", default="ReadOnlyRole", type=str, help="Role to assume in each organization account, with --all-firewalls")
+parser.add_argument("--all-regions", action="store_true", help="If specified with --all-firewalls, scan every region enabled in each account (instead of --region), skipping the regions found empty or denied by earlier runs")
+parser.add_argument("--region-map-file", default="region_map.json", type=str, help="File caching the enabled, empty and denied regions of each account, used by --all-regions")
+parser.add_argument("--refresh-regions", action="store_true", help="If specified with --all-regions, discover the enabled regions again and re-scan the regions found empty or denied by earlier runs")
+parser.add_argument("-w", "--workers", default=1, type=int, help="Number of account/region combinations to scan concurrently with --all-firewalls (1 = serial)")
+parser.add_argument("-m", "--max-account-requests", default=4, type=int, help="Maximum number of concurrent Network Firewall API requests per account, to stay under throttling limits")
+parser.add_argument("-d", "--describe-workers", default=4, type=int, help="Number of concurrent firewall and rule group describe requests within each account/region, with --all-firewalls")
+parser.add_argument("--credential-cache", type=str, help="File to cache assumed-role credentials in, so back-to-back runs assume each role only once per session lifetime. The file is encrypted if INVENTORY_CREDENTIAL_KEY is set, and holds the credentials in plaintext otherwise")
+parser.add_argument("-c", "--cache-dir", default="anfw_rule_group_cache", type=str, help="Directory to cache rule group contents in, so unchanged rule groups are only checked with describe_rule_group_metadata instead of downloaded again")
+parser.add_argument("--no-cache", action="store_true", help="If specified, describe every rule group without reading or writing the rule group cache")
 parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
 parser.add_argument("-t", "--text", action="store_true", help="Print output in text format")
 args=parser.parse_args()
 
 # Data elements
-stateful_rule_headers = [
-    'FirewallName',
-    'RuleGroupPriority',
-    'RuleGroupName',
-    'Action',
-    'Direction',
-    'Protocol',
-    'Source',
-    'SourcePort',
-    'Destination',
-    'DestinationPort',
-    'Sid'
-]
-stateful_rule_values = []
 stateful_rules_list = []
-
-domain_rule_headers = [
-    'FirewallName',
-    'RuleGroupPriority',
-    'RuleGroupName',
-    'Action',
-    'Domain',
-]
-domain_rule_values = []
 domain_rules_list = []
-
-# Get the Current Account ID and role and print to screen
-caller_identity = boto3.client('sts').get_caller_identity()
-current_account_id = caller_identity['Account']
-current_role = caller_identity['Arn']
-
-if (args.verbose):
-    print(f"Current Account ID: {current_account_id}")
-    print(f"Current Role: {current_role}")
-
-# Initiate the boto3 client for AWS Network Firewall:
-anfw = boto3.client('network-firewall')
-
-# Call the "Describe_Firewall" API to obtain the firewall details and firewall policy arn:
-if (args.firewall_name):
-    describe_firewall_response = anfw.describe_firewall(FirewallName=args.firewall_name)
-elif (args.firewall_arn):
-    describe_firewall_response = anfw.describe_firewall(FirewallArn=args.firewall_arn)
+stateless_rules_list = []
+
+# Rule group contents are cached by ARN and UpdateToken, and only downloaded again when the rule group has been modified
+rule_group_cache = None if args.no_cache else RuleGroupCache(args.cache_dir)
+
+# If all-firewalls mode is selected, list the rules of every firewall in the account (or every account in the AWS Organization) and region(s)
+if (args.all_firewalls):
+    scanner = OrgScanner(args.assumed_role, "ListANFWRulesScript", args.workers, args.max_account_requests, args.verbose,
+                         credential_cache_file=args.credential_cache)
+    if (args.verbose):
+        print(f"Current Account ID: {scanner.current_account_id}")
+        print(f"Current Role: {scanner.current_role}")
+
+    # If all-regions mode is selected, scan every region enabled in each account, skipping the regions found empty or denied by earlier runs
+    region_map = RegionMap(args.region_map_file, refresh=args.refresh_regions) if args.all_regions else None
+    account_ids_scanned = scanner.select_accounts(args.organization)
+
+    # Each firewall policy and rule group is described once, even when several firewalls or policies share it
+    shared_describes = SharedDescribes()
+    stateful_rule_headers = ['Account_ID', 'Region'] + stateful_rule_headers
+    domain_rule_headers = ['Account_ID', 'Region'] + domain_rule_headers
+    stateless_rule_headers = ['Account_ID', 'Region'] + stateless_rule_headers
+    for result in scanner.run(make_firewall_collectors(shared_describes, args.describe_workers, rule_group_cache), [args.region], region_map=region_map):
+        for rule_type, row in result.items:
+            if rule_type == 'stateful':
+                stateful_rules_list.append(row)
+            elif rule_type == 'domain':
+                domain_rules_list.append(row)
+            else:
+                stateless_rules_list.append(row)
+            if (args.verbose): print(row)
+
+    if region_map is not None:
+        region_map.save()
+    print(f"Accounts scanned: {account_ids_scanned}")
+    print(f"Regions scanned: {scanner.regions_scanned if region_map is not None else [args.region]}")
+    print(f"{shared_describes.call_count} firewall policies and rule groups were described ({shared_describes.shared_count} shared describes were reused)")
+    scanner.write_errors()
 else:
-    print("You must specify either a firewall ARN or a firewall name.")
-    print("please use the '-h' flag for help and more options.")
-    exit()
-anfw_firewall_name = describe_firewall_response['Firewall']['FirewallName']
-anfw_firewall_arn = describe_firewall_response['Firewall']['FirewallArn']
-anfw_policy_arn = describe_firewall_response['Firewall']['FirewallPolicyArn']
-print(f"Firewall Name: {anfw_firewall_name}")
-print(f"Firewall ARN: {anfw_firewall_arn}")
-
-# Call the "Describe_Firewall_Policy" API to obtain the rule group references:
-describe_firewall_policy_response = anfw.describe_firewall_policy(FirewallPolicyArn=anfw_policy_arn)
-
-# If the firewall policy has stateless rule group references, print the rule group arns and priorities:
-if 'StatelessRuleGroupReferences' in describe_firewall_policy_response['FirewallPolicy']:
-    if (args.verbose): print("Stateless Rule Group References:")
-    for stateless_rg_ref in describe_firewall_policy_response['FirewallPolicy']['StatelessRuleGroupReferences']:
-        stateless_rg_arn = stateless_rg_ref['ResourceArn']
-        stateless_rg_priority = stateless_rg_ref['Priority']
-        if (args.verbose): print(f"  {stateless_rg_arn}")
-        if (args.verbose): print(f"  {stateless_rg_priority}")
-        describe_rule_group_response = anfw.describe_rule_group(RuleGroupArn=stateless_rg_ref['ResourceArn'])
-        # TODO : The Stateless Rule Groups section is currently unfinished
-
-# If the firewall policy has stateful rule group references, print the rule group arns and priorities, and store the rule details in a list:
-if 'StatefulRuleGroupReferences' in describe_firewall_policy_response['FirewallPolicy']:
-    if (args.verbose): print("Stateful Rule Group References:")
-    for stateful_rg_ref in describe_firewall_policy_response['FirewallPolicy']['StatefulRuleGroupReferences']:
-        stateful_rg_arn = stateful_rg_ref['ResourceArn']
-        stateful_rg_priority = stateful_rg_ref['Priority']
-        if (args.verbose): print(f"  {stateful_rg_arn}")
-        if (args.verbose): print(f"  {stateful_rg_priority}")
-        describe_rule_group_response = anfw.describe_rule_group(RuleGroupArn=stateful_rg_ref['ResourceArn'])
-        stateful_rg_name = describe_rule_group_response['RuleGroupResponse']['RuleGroupName']
-        if 'StatefulRules' in describe_rule_group_response['RuleGroup']['RulesSource']:
-            if (args.verbose): print("Stateful Rules")
-            for stateful_rule in describe_rule_group_response['RuleGroup']['RulesSource']['StatefulRules']:
-                stateful_rule_values = [
-                    anfw_firewall_name,
-                    stateful_rg_priority,
-                    stateful_rg_name,
-                    stateful_rule['Action'],
-                    stateful_rule['Header']['Direction'],
-                    stateful_rule['Header']['Protocol'],
-                    stateful_rule['Header']['Source'],
-                    stateful_rule['Header']['SourcePort'],
-                    stateful_rule['Header']['Destination'],
-                    stateful_rule['Header']['DestinationPort'],
-                ]
-
-                if 'RuleOptions' in stateful_rule:
-                    for keyword in stateful_rule['RuleOptions']:
-                        if 'Keyword' in keyword and keyword['Keyword'] == 'sid':
-                            stateful_rule_values.append(keyword['Settings'][0])
-                    
-                stateful_rules_list.append(stateful_rule_values)
-
+    # Get the Current Account ID and role and print to screen
+    caller_identity = boto3.client('sts').get_caller_identity()
+    current_account_id = caller_identity['Account']
+    current_role = caller_identity['Arn']
+
+    if (args.verbose):
+        print(f"Current Account ID: {current_account_id}")
+        print(f"Current Role: {current_role}")
+
+    # Initiate the boto3 client for AWS Network Firewall:
+    anfw = boto3.client('network-firewall', region_name=args.region)
+
+    # Call the "Describe_Firewall" API to obtain the firewall details and firewall policy arn:
+    if (args.firewall_name):
+        describe_firewall_response = anfw.describe_firewall(FirewallName=args.firewall_name)
+    elif (args.firewall_arn):
+        describe_firewall_response = anfw.describe_firewall(FirewallArn=args.firewall_arn)
+    else:
+        print("You must specify either a firewall ARN or a firewall name, or --all-firewalls.")
+        print("please use the '-h' flag for help and more options.")
+        exit()
+    anfw_firewall_name = describe_firewall_response['Firewall']['FirewallName']
+    anfw_firewall_arn = describe_firewall_response['Firewall']['FirewallArn']
+    anfw_policy_arn = describe_firewall_response['Firewall']['FirewallPolicyArn']
+    print(f"Firewall Name: {anfw_firewall_name}")
+    print(f"Firewall ARN: {anfw_firewall_arn}")
+
+    # Call the "Describe_Firewall_Policy" API to obtain the rule group references:
+    describe_firewall_policy_response = anfw.describe_firewall_policy(FirewallPolicyArn=anfw_policy_arn)
+
+    # If the firewall policy has stateless rule group references, print the rule group arns and priorities, and store the rule details in a list:
+    if 'StatelessRuleGroupReferences' in describe_firewall_policy_response['FirewallPolicy']:
+        if (args.verbose): print("Stateless Rule Group References:")
+        for stateless_rg_ref in describe_firewall_policy_response['FirewallPolicy']['StatelessRuleGroupReferences']:
+            stateless_rg_arn = stateless_rg_ref['ResourceArn']
+            stateless_rg_priority = stateless_rg_ref['Priority']
+            if (args.verbose): print(f"  {stateless_rg_arn}")
+            if (args.verbose): print(f"  {stateless_rg_priority}")
+            describe_rule_group_response = describe_rule_group(anfw, stateless_rg_ref['ResourceArn'], rule_group_cache)
+            stateful_rows, domain_rows, stateless_rows = rule_group_rows(anfw_firewall_name, stateless_rg_priority, describe_rule_group_response)
+            stateless_rules_list.extend(stateless_rows)
+            for stateless_rule_values in stateless_rows:
+                if (args.verbose): print("Stateless Rule: ")
+                if (args.verbose): print(stateless_rule_values)
+
+    # If the firewall policy has stateful rule group references, print the rule group arns and priorities, and store the rule details in a list:
+    if 'StatefulRuleGroupReferences' in describe_firewall_policy_response['FirewallPolicy']:
+        if (args.verbose): print("Stateful Rule Group References:")
+        for stateful_rg_ref in describe_firewall_policy_response['FirewallPolicy']['StatefulRuleGroupReferences']:
+            stateful_rg_arn = stateful_rg_ref['ResourceArn']
+            stateful_rg_priority = stateful_rg_ref['Priority']
+            if (args.verbose): print(f"  {stateful_rg_arn}")
+            if (args.verbose): print(f"  {stateful_rg_priority}")
+            describe_rule_group_response = describe_rule_group(anfw, stateful_rg_ref['ResourceArn'], rule_group_cache)
+            stateful_rows, domain_rows, stateless_rows = rule_group_rows(anfw_firewall_name, stateful_rg_priority, describe_rule_group_response)
+            stateful_rules_list.extend(stateful_rows)
+            domain_rules_list.extend(domain_rows)
+            for stateful_rule_values in stateful_rows:
                 if (args.verbose): print("Stateful Rule: ")
                 if (args.verbose): print(stateful_rule_values)
-        elif 'RulesSourceList' in describe_rule_group_response['RuleGroup']['RulesSource']:
-            if (args.verbose): print("Domain Rules")
-            for target in describe_rule_group_response['RuleGroup']['RulesSource']['RulesSourceList']['Targets']:
-                domain_rule_values = [
-                    anfw_firewall_name,
-                    stateful_rg_priority,
-                    stateful_rg_name,
-                    describe_rule_group_response['RuleGroup']['RulesSource']['RulesSourceList']['GeneratedRulesType'],
-                    target
-                ]
-                domain_rules_list.append(domain_rule_values)
 
 
+# Save the rule group cache for the next run
+if rule_group_cache is not None:
+    rule_group_cache.save()
+    if (args.verbose): print(f"Rule group cache: {rule_group_cache.hits} rule groups found in the cache, {rule_group_cache.misses} rule groups described")
+
 print("----------------------------------------")
 print("AWS Network Firewall rule listing is complete")
 print(f"Total number of stateful rules: {len(stateful_rules_list)}")
 print(f"Total number of domain rules: {len(domain_rules_list)}")
+print(f"Total number of stateless rules: {len(stateless_rules_list)}")
 
 # Write AWS Network Firewall Rules to file
 with open(args.output_file, 'w') as csvfile:
@@ -157,13 +167,24 @@ with open("anfw_domains.csv", 'w') as csvfile:
         if (args.verbose): print(row)
     print(f"CSV output (domains) is saved at: {os.getcwd()}/anfw_domains.csv")
 
+# Write AWS Network Firewall stateless rules to file
+with open("anfw_stateless.csv", 'w') as csvfile:
+    anfw_csv_writer = csv.writer(csvfile)
+    anfw_csv_writer.writerow(stateless_rule_headers)
+    if (args.verbose): print(stateless_rule_headers)
+    for row in stateless_rules_list:
+        anfw_csv_writer.writerow(row)
+        if (args.verbose): print(row)
+    print(f"CSV output (stateless rules) is saved at: {os.getcwd()}/anfw_stateless.csv")
+
 
+# Stream each table to the text file one row at a time; each line is rendered once, for the file and the screen
 if (args.text):
-    with open("anfw_rules.txt", "w") as text_file:
-        text_file.write(tabulate(stateful_rules_list, headers=stateful_rule_headers, tablefmt="grid"))
-        text_file.write(tabulate(domain_rules_list, headers=domain_rule_headers, tablefmt="grid"))
-    if (args.verbose): print(tabulate(stateful_rules_list, headers=stateful_rule_headers, tablefmt="grid"))
-    if (args.verbose): print(tabulate(domain_rules_list, headers=domain_rule_headers, tablefmt="grid"))
+    text_tables = [(stateful_rules_list, stateful_rule_headers), (domain_rules_list, domain_rule_headers), (stateless_rules_list, stateless_rule_headers)]
+    for table_number, (rules_list, rule_headers) in enumerate(text_tables):
+        text_writer = StreamingTableWriter("anfw_rules.txt", rule_headers, echo=args.verbose, mode='w' if table_number == 0 else 'a')
+        text_writer.write_rows(rules_list)
+        text_writer.close()
     print(f"Text output is saved at: {os.getcwd()}/anfw_rules.txt")
     
 #if error_list:
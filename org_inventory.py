@@ -0,0 +1,429 @@
+# Shared AWS Organization fan-out library used by the inventory scripts (sg_inventory.py, kms_keys_inventory.py, waf_acl_inventory.py, org_inventory_all.py)
+# It gets the caller identity, lists the accounts in the AWS Organization, assumes a role in each account once (caching the credentials, see credential_cache.py),
+# and runs a list of per-region collector functions for every account/region combination on a bounded thread pool.
+#
+# A collector is a generator function that takes a ScanUnit and yields the items found in that account/region, e.g.:
+#
+#   def collect_example(unit):
+#       client = unit.client('ec2')
+#       for page in unit.paginate(client, 'describe_vpcs'):
+#           yield from page['Vpcs']
+#
+# Items are streamed page by page to the caller (and on to the output writer), so memory use stays flat regardless of the number of resources.
+#
+# Adding a new inventory type only requires writing the collector function and wrapping it in a Collector.
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, BotoCoreError, EndpointConnectionError, ConnectionClosedError, ReadTimeoutError, ConnectTimeoutError
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from client_pool import ClientPool
+from credential_cache import CredentialCache
+
+# A named collector function. If regions is set, the collector only runs in those regions (e.g. ['us-east-1'] for global CloudFront resources),
+# otherwise it runs in every region selected for the scan. async_function is the collector's async generator, used by the asyncio engine (async_engine.py).
+# skip_empty is cleared for collectors whose empty result is itself needed by the caller (e.g. network interfaces, to find unused security groups),
+# so that --all-regions doesn't skip the regions where they found nothing.
+Collector = namedtuple('Collector', ['name', 'function', 'regions', 'async_function', 'skip_empty'], defaults=[None, None, True])
+
+# The result of running one collector in one account/region combination.
+# items is an iterator over the collector's output, and must be consumed before moving on to the next result.
+# unit is the ScanUnit the collector ran in (None for combinations replayed from a checkpoint).
+class ScanResult(namedtuple('ScanResult', ['collector', 'account_id', 'region', 'items', 'unit'], defaults=[None])):
+    __slots__ = ()
+
+    # Whether the collector failed in the combination, so its items may be incomplete. Only known once items has been consumed.
+    @property
+    def failed(self):
+        return self.unit is not None and self.unit.failed
+
+# Maximum number of items buffered per account/region combination when scanning with multiple workers
+ITEM_BUFFER_SIZE = 1000
+
+# Error codes of throttling and transient server-side failures, for which a failed account/region combination is retried
+RETRYABLE_ERROR_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'RequestLimitExceededException', 'SlowDown', 'LimitExceededException',
+    'InternalError', 'InternalFailure', 'InternalServerError', 'ServiceUnavailable', 'ServiceUnavailableException', 'RequestTimeout',
+}
+
+# Connection and timeout errors, for which a failed account/region combination is retried
+# (other BotoCoreErrors, e.g. missing credentials or invalid parameters, fail the same way every time)
+RETRYABLE_EXCEPTIONS = (EndpointConnectionError, ConnectionClosedError, ReadTimeoutError, ConnectTimeoutError)
+
+# Markers passed through the item buffers by the worker threads
+_UNIT_COMPLETE = object()
+_UnitFailed = namedtuple('_UnitFailed', ['error'])
+
+
+# Return whether a failed API request or account/region combination is worth retrying
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+    return isinstance(error, RETRYABLE_EXCEPTIONS)
+
+
+# Return a structured error report entry for a failed request
+def error_entry(error, account_id, region=None, collector=None, attempts=1):
+    if isinstance(error, ClientError):
+        code, message = error.response['Error'].get('Code', ''), error.response['Error'].get('Message', '')
+    else:
+        code, message = type(error).__name__, str(error)
+    return {
+        'AccountId': account_id,
+        'Region': region,
+        'Collector': collector,
+        'ErrorCode': code,
+        'Message': message,
+        'Attempts': attempts,
+        'Time': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+# Return the current account ID and role ARN
+def get_caller_identity(sts_client=None):
+    caller_identity = (sts_client or boto3.client('sts')).get_caller_identity()
+    return caller_identity['Account'], caller_identity['Arn']
+
+
+# Return the account IDs in the AWS Organization, excluding the specified account ID
+def list_organization_account_ids(exclude_account_id=None, config=None):
+    organizations_client = boto3.client('organizations', config=config)
+    account_ids = []
+    for page in organizations_client.get_paginator('list_accounts').paginate():
+        account_ids.extend(account['Id'] for account in page['Accounts'] if account['Id'] != exclude_account_id)
+    return account_ids
+
+
+# A single account/region combination, handed to collector functions
+class ScanUnit:
+    def __init__(self, scanner, account_id, session, region):
+        self.scanner = scanner
+        self.account_id = account_id
+        self.session = session
+        self.region = region
+        self.failed = False # Set if the collector failed in this account/region combination
+        self.error_code = None # Error code of the failure, if the collector failed
+
+    # Return the boto3 client for a service in the unit's account and region. Clients are shared by every unit and collector of the same
+    # account, service and region, so botocore's adaptive retry mode keeps a single token bucket per endpoint: requests are rate limited
+    # client-side, and throttled requests are retried with exponential backoff and jitter. (boto3 sessions are not thread-safe, so client creation is serialized.)
+    def client(self, service, region=None):
+        return self.scanner.client(self.account_id, service, region or self.region)
+
+    # Call an API operation, limiting the number of concurrent requests made to the unit's account
+    def call(self, operation, **kwargs):
+        with self.scanner.account_semaphore(self.account_id):
+            return operation(**kwargs)
+
+    # Run a request plan: a generator yielding (client, operation name, kwargs) requests, which are made through the given request limit
+    # (a semaphore) and the account's. The response of each request is sent back to the plan, or its ClientError raised in the plan,
+    # and the plan's return value is returned. The plan holds the request logic, so the same plan also runs on the asyncio engine.
+    def run_plan(self, plan, request_limit):
+        response, error = None, None
+        while True:
+            try:
+                client, operation_name, kwargs = plan.send(response) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                with request_limit:
+                    response, error = self.call(getattr(client, operation_name), **kwargs), None
+            except ClientError as request_error:
+                response, error = None, request_error
+
+    # Yield each page of an API operation, making one request at a time through the account's request limit.
+    # Operations without a botocore paginator (e.g. wafv2 list_web_acls) are paged by hand with NextMarker.
+    def paginate(self, client, operation_name, **kwargs):
+        if client.can_paginate(operation_name):
+            pages = iter(client.get_paginator(operation_name).paginate(**kwargs))
+            while True:
+                with self.scanner.account_semaphore(self.account_id):
+                    page = next(pages, None)
+                if page is None:
+                    return
+                yield page
+        else:
+            operation = getattr(client, operation_name)
+            while True:
+                page = self.call(operation, **kwargs)
+                yield page
+                if not page.get('NextMarker'):
+                    return
+                kwargs['NextMarker'] = page['NextMarker']
+
+
+# Parallel, credential-caching scheduler for Organization-wide inventories
+class OrgScanner:
+    def __init__(self, assumed_role="ReadOnlyRole", session_name="ListResourcesScript", workers=1, max_account_requests=4, verbose=False,
+                 max_attempts=8, unit_attempts=3, credential_cache_file=None, max_pool_connections=10, engine="threads"):
+        self.assumed_role = assumed_role
+        self.session_name = session_name
+        self.workers = workers
+        self.max_account_requests = max_account_requests
+        self.verbose = verbose
+        self.engine = engine # "threads" (thread pool) or "async" (asyncio event loop, see async_engine.py)
+        self.unit_attempts = unit_attempts # Number of times a failed account/region combination is run before it is reported as an error
+        self.client_config = Config(retries={'mode': 'adaptive', 'max_attempts': max_attempts})
+
+        # Assumed-role credentials are cached per role ARN (optionally in a file shared across runs), and the cache's STS client is used for every STS request
+        self.credential_cache = CredentialCache(credential_cache_file, config=self.client_config)
+
+        self.current_account_id, self.current_role = get_caller_identity(self.credential_cache.sts_client())
+        self.account_ids = [] # List to hold additional Organization account IDs to iterate through
+        self.errors = [] # List to hold the structured error report entries of the accounts and account/region combinations that failed
+        self.account_ids_scanned = [] # List to hold account IDs that have been scanned
+        self.account_ids_failed = [] # List to hold account IDs that failed to scan
+        self.regions_scanned = [] # List to hold the regions scanned in at least one account
+        self.sessions = {} # Dict to hold the boto3 session per account ID, so each role is assumed only once
+
+        # Clients are pooled per (role ARN, service, region), with one HTTP connection pool of max_pool_connections each
+        self.client_pool = ClientPool(self.client_config, max_pool_connections)
+        self.errors_lock = threading.Lock()
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+
+    # Return the role ARN whose credentials are used in an account (the caller's own identity in the current account)
+    def role_arn(self, account_id):
+        if account_id == self.current_account_id:
+            return self.current_role
+        return f"arn:aws:iam::{account_id}:role/{self.assumed_role}"
+
+    # Return the shared boto3 client for a service in an account and region
+    def client(self, account_id, service, region):
+        return self.client_pool.client(self.role_arn(account_id), self.sessions[account_id], service, region)
+
+    # Add an entry to the error report, and the account to the list of accounts that failed (or partially failed) to scan
+    def record_error(self, entry):
+        with self.errors_lock:
+            self.errors.append(entry)
+            if entry['AccountId'] not in self.account_ids_failed:
+                self.account_ids_failed.append(entry['AccountId'])
+
+    # Return the semaphore limiting the concurrent API requests to an account
+    def account_semaphore(self, account_id):
+        with self._semaphores_lock:
+            return self._semaphores.setdefault(account_id, threading.BoundedSemaphore(self.max_account_requests))
+
+    # Assume the role in an account and return a boto3 session, reusing the session if the role was already assumed.
+    # The role is only assumed if the credential cache has no fresh credentials for it, and the session's credentials are refreshed before they expire.
+    def assume_role(self, account_id):
+        if account_id not in self.sessions:
+            # Assume role_name in each account and get temporary credentials (can use OrganizationAccountAccessRole but it is admin-level, advised to create/utilize read-only roles for this purposes)
+            self.sessions[account_id] = self.credential_cache.session(self.role_arn(account_id), self.session_name, self.client_pool.botocore_session())
+        return self.sessions[account_id]
+
+    # Select the accounts to scan: the current account, plus every Organization account the role can be assumed in
+    def select_accounts(self, organization=False):
+        self.sessions[self.current_account_id] = boto3.Session(botocore_session=self.client_pool.botocore_session())
+        self.account_ids_scanned = [self.current_account_id]
+        if not organization:
+            return self.account_ids_scanned
+
+        # Create a list of AWS Account IDs in the AWS Organization, and print to screen
+        try:
+            self.account_ids = list_organization_account_ids(exclude_account_id=self.current_account_id, config=self.client_config)
+        except ClientError as error:
+            print(f"Couldn't retrieve account IDs from AWS Organization. Here's why: {error.response['Error']['Message']}")
+            self.record_error(error_entry(error, self.current_account_id, collector='list_accounts'))
+            return self.account_ids_scanned
+        if self.verbose: print(f"{len(self.account_ids)} additional accounts found in your AWS Organization: ")
+        if self.verbose: print(self.account_ids)
+
+        # Assume the role in each account concurrently, returning the error for accounts where it can't be assumed
+        def assume(account_id):
+            try:
+                self.assume_role(account_id)
+            except ClientError as error:
+                return error
+
+        if self.verbose: print(f"Assuming role {self.assumed_role} in {len(self.account_ids)} accounts...")
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            assume_errors = list(executor.map(assume, self.account_ids))
+
+        # Report the results in Organization order, so the accounts are scanned in the same order regardless of the number of workers
+        for account_id, error in zip(self.account_ids, assume_errors):
+            if error is not None:
+                self.record_error(error_entry(error, account_id, collector='assume_role'))
+                print(f"Couldn't assume role. Here's why: {error.response['Error']['Message']}")
+                print(f"Skipping account {account_id}")
+            else:
+                self.account_ids_scanned.append(account_id)
+        self.credential_cache.save()
+        if self.verbose: print(f"Credential cache: {self.credential_cache.hits} roles reused from the cache, {self.credential_cache.misses} roles assumed")
+        return self.account_ids_scanned
+
+    # Run every collector in every scanned account/region combination, yielding a ScanResult per combination.
+    # Results are yielded in a stable order (account, then collector, then region), regardless of the number of workers.
+    # With a single worker the collectors run lazily as the results are consumed; with more workers each combination runs on
+    # the thread pool and streams its items through a bounded buffer, so slow output writers apply backpressure to the scan.
+    # If a ScanCheckpoint is given, the items of each combination are stored in it as they are consumed, and combinations
+    # completed by a previous (interrupted) run are replayed from it instead of being scanned again.
+    # If a RegionMap is given (--all-regions), each account is scanned in every region enabled in it, rather than in the given regions,
+    # except for the regions an earlier run found empty or denied for the collector; the outcome of each combination is recorded in the map.
+    def run(self, collectors, regions, checkpoint=None, region_map=None):
+        account_regions = self._discover_regions(region_map, regions) if region_map is not None else {}
+        scan_units = []
+        for account_id in self.account_ids_scanned:
+            for collector in collectors:
+                for region in (collector.regions or account_regions.get(account_id, regions)):
+                    if region_map is not None and region_map.is_skipped(account_id, collector.name, region, collector.skip_empty):
+                        continue
+                    scan_units.append((collector, ScanUnit(self, account_id, self.sessions[account_id], region)))
+        self.regions_scanned = sorted(set(unit.region for collector, unit in scan_units))
+        if self.verbose and region_map is not None: print(f"Skipping {region_map.skipped_count} account/region combinations found empty or denied by earlier runs")
+        if self.verbose: print(f"Scanning {len(scan_units)} account/region combinations with {self.workers} workers...")
+
+        if checkpoint is not None:
+            completed_count = sum(checkpoint.is_complete((collector.name, unit.account_id, unit.region)) for collector, unit in scan_units)
+            if self.verbose and completed_count: print(f"Resuming: {completed_count} account/region combinations were completed by the previous run")
+
+        if self.engine == "async":
+            # Imported here, as the asyncio engine requires aiobotocore
+            from async_engine import AsyncScanEngine
+            yield from AsyncScanEngine(self).run(scan_units, checkpoint, region_map)
+            return
+
+        if self.workers <= 1:
+            for collector, unit in scan_units:
+                unit_key = (collector.name, unit.account_id, unit.region)
+                if checkpoint is not None and checkpoint.is_complete(unit_key):
+                    yield ScanResult(collector.name, unit.account_id, unit.region, checkpoint.replay(unit_key))
+                else:
+                    yield ScanResult(collector.name, unit.account_id, unit.region, self._track(self._run_unit(collector, unit), collector, unit, unit_key, checkpoint, region_map), unit)
+            self._print_pool_stats()
+            return
+
+        stop_event = threading.Event()
+        item_buffers = [queue.Queue(maxsize=ITEM_BUFFER_SIZE) for _ in scan_units]
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for (collector, unit), item_buffer in zip(scan_units, item_buffers):
+                if checkpoint is None or not checkpoint.is_complete((collector.name, unit.account_id, unit.region)):
+                    executor.submit(self._produce, collector, unit, item_buffer, stop_event)
+            for (collector, unit), item_buffer in zip(scan_units, item_buffers):
+                unit_key = (collector.name, unit.account_id, unit.region)
+                if checkpoint is not None and checkpoint.is_complete(unit_key):
+                    yield ScanResult(collector.name, unit.account_id, unit.region, checkpoint.replay(unit_key))
+                else:
+                    yield ScanResult(collector.name, unit.account_id, unit.region, self._track(self._consume(item_buffer), collector, unit, unit_key, checkpoint, region_map), unit)
+        finally:
+            # Release any workers blocked on a full buffer if the caller stopped early or failed
+            stop_event.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+        self._print_pool_stats()
+
+    # Return the enabled regions of each scanned account from the region map, discovering the accounts not yet in the map on the thread pool.
+    # Accounts whose regions can't be discovered are scanned in the given regions instead.
+    def _discover_regions(self, region_map, regions):
+        def discover(account_id):
+            unit = ScanUnit(self, account_id, self.sessions[account_id], regions[0])
+            try:
+                region_map.discover(unit)
+            except (ClientError, BotoCoreError) as error:
+                print(f"Couldn't discover the enabled regions in account {account_id}. Here's why: {error}")
+                self.record_error(error_entry(error, account_id, unit.region, 'describe_regions'))
+
+        undiscovered_account_ids = [account_id for account_id in self.account_ids_scanned if region_map.needs_discovery(account_id)]
+        if self.verbose and undiscovered_account_ids: print(f"Discovering the enabled regions of {len(undiscovered_account_ids)} accounts...")
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            list(executor.map(discover, undiscovered_account_ids))
+        return {account_id: region_map.regions(account_id) or regions for account_id in self.account_ids_scanned}
+
+    def _print_pool_stats(self):
+        if self.verbose: print(f"Client pool: {self.client_pool.misses} clients created, {self.client_pool.hits} client requests served from the pool")
+
+    # Run a collector in an account/region combination, retrying the combination on its own if it fails with a throttling or transient error.
+    # Items already yielded by a failed attempt are skipped when the collector is re-run (listings are returned in a stable order), so nothing is duplicated.
+    # If the combination still fails, or fails with a non-retryable error (e.g. AccessDenied from an SCP), the error is added to the error report
+    # and the scan carries on with the other combinations.
+    def _run_unit(self, collector, unit):
+        items_yielded = 0
+        for attempt in range(1, self.unit_attempts + 1):
+            try:
+                for item_index, item in enumerate(collector.function(unit)):
+                    if item_index < items_yielded:
+                        continue
+                    items_yielded += 1
+                    yield item
+                return
+            except (ClientError, BotoCoreError) as error:
+                retry_delay = self._unit_error(collector, unit, error, attempt)
+                if retry_delay is None:
+                    return
+                time.sleep(retry_delay)
+
+    # Handle an attempt of an account/region combination that failed with an error (shared by the thread and asyncio engines).
+    # Returns the delay before the combination is retried, or None if it isn't retried, in which case the combination is marked
+    # as failed and the error added to the error report.
+    def _unit_error(self, collector, unit, error, attempt):
+        if attempt < self.unit_attempts and is_retryable(error):
+            # Exponential backoff with full jitter
+            return random.uniform(0, min(60, 2 ** attempt))
+        print(f"Couldn't scan {collector.name} in account {unit.account_id} region {unit.region}. Here's why: {error}")
+        entry = error_entry(error, unit.account_id, unit.region, collector.name, attempt)
+        unit.failed = True
+        unit.error_code = entry['ErrorCode']
+        self.record_error(entry)
+        return None
+
+    # Pass through the items of an account/region combination, storing them in the checkpoint (if any) as they are consumed,
+    # and marking the combination as completed once all its items have been consumed, unless it failed.
+    # Once consumed, the outcome of the combination (empty, denied, or neither) is recorded in the region map (if any).
+    def _track(self, items, collector, unit, unit_key, checkpoint, region_map):
+        item_count = 0
+        for item in items:
+            item_count += 1
+            if checkpoint is not None: checkpoint.add_item(unit_key, item)
+            yield item
+        if checkpoint is not None and not unit.failed:
+            checkpoint.complete(unit_key)
+        if region_map is not None:
+            region_map.record(unit.account_id, collector.name, unit.region, item_count, unit.error_code, collector.skip_empty)
+
+    # Run a collector on a worker thread, passing its items to the main thread through the buffer
+    def _produce(self, collector, unit, item_buffer, stop_event):
+        try:
+            for item in self._run_unit(collector, unit):
+                if not self._put(item_buffer, item, stop_event):
+                    return
+        except Exception as error:
+            self._put(item_buffer, _UnitFailed(error), stop_event)
+        else:
+            self._put(item_buffer, _UNIT_COMPLETE, stop_event)
+
+    # Put an item in a buffer, waiting for space unless the scan has been stopped. Returns False if the scan was stopped.
+    def _put(self, item_buffer, item, stop_event):
+        while not stop_event.is_set():
+            try:
+                item_buffer.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Yield the items of an account/region combination from its buffer, re-raising any collector error on the main thread
+    def _consume(self, item_buffer):
+        while True:
+            item = item_buffer.get()
+            if item is _UNIT_COMPLETE:
+                return
+            if isinstance(item, _UnitFailed):
+                raise item.error
+            yield item
+
+    # Write the structured error report (a JSON list of error entries) and print a summary to screen
+    def write_errors(self, file_name="errors.json"):
+        if not self.errors:
+            return
+        with open(file_name, "w") as error_file:
+            json.dump(self.errors, error_file, indent=4)
+        print(f"The following {len(self.account_ids_failed)} accounts encountered errors:")
+        print(self.account_ids_failed)
+        print(f"{len(self.errors)} errors occurred. The error report is located at: {os.getcwd()}/{file_name}")
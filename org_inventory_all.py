@@ -0,0 +1,102 @@
+import json
+import argparse
+import os
+import csv
+from org_inventory import OrgScanner
+from region_map import RegionMap
+from inventory_collectors import security_group_collectors, kms_collectors, kms_headers, waf_collectors, waf_headers
+
+# Add command-line arguments for region and role to assume within accounts
+parser = argparse.ArgumentParser(description="Get Security Groups, KMS Keys and WAF Web ACLs Cross-Account Python Script - Arguments")
+parser.add_argument("-r", "--region", default="us-east-1", type=str, help="AWS Region")
+parser.add_argument("-o", "--organization", action="store_true", help="If specified, execute across all accounts in AWS Organization")
+parser.add_argument("-a", "--assumed-role", default="ReadOnlyRole", type=str, help="Role to assume in each organization account")
+parser.add_argument("--sg-file", default="security_groups.json", type=str, help="File to write security groups to")
+parser.add_argument("--kms-file", default="kms_keys.csv", type=str, help="File to write KMS keys to")
+parser.add_argument("--waf-file", default="waf_web_acls.csv", type=str, help="File to write WAF web acls to")
+parser.add_argument("-w", "--workers", default=1, type=int, help="Number of account/region combinations to scan concurrently (1 = serial)")
+parser.add_argument("-m", "--max-account-requests", default=4, type=int, help="Maximum number of concurrent API requests per account, to stay under throttling limits")
+parser.add_argument("--all-regions", action="store_true", help="If specified, scan every region enabled in each account (instead of --region), skipping the regions found empty or denied by earlier runs")
+parser.add_argument("--region-map-file", default="region_map.json", type=str, help="File caching the enabled, empty and denied regions of each account, used by --all-regions")
+parser.add_argument("--refresh-regions", action="store_true", help="If specified with --all-regions, discover the enabled regions again and re-scan the regions found empty or denied by earlier runs")
+parser.add_argument("--max-pool-connections", default=10, type=int, help="Maximum number of HTTP connections kept open per pooled client (should be at least --max-account-requests)")
+parser.add_argument("--credential-cache", type=str, help="File to cache assumed-role credentials in, so back-to-back runs assume each role only once per session lifetime. The file is encrypted if INVENTORY_CREDENTIAL_KEY is set, and holds the credentials in plaintext otherwise")
+parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
+args=parser.parse_args()
+
+# Get the Current Account ID and role and print to screen
+scanner = OrgScanner(args.assumed_role, "ListResourcesScript", args.workers, args.max_account_requests, args.verbose, credential_cache_file=args.credential_cache,
+                     max_pool_connections=args.max_pool_connections)
+
+if (args.verbose):
+    print(f"Current Account ID: {scanner.current_account_id}")
+    print(f"Current Role: {scanner.current_role}")
+
+# Configure the list of regions to iterate through, and print to screen.
+regions = [
+    # Add any additional regions you want to check here.
+    # Use --all-regions to scan every region enabled in each account instead.
+]
+if args.region not in regions:
+    regions.insert(0, args.region)
+
+if (args.verbose):
+    print("Regions selected:")
+    print(regions)
+
+# If all-regions mode is selected, scan every region enabled in each account, skipping the regions found empty or denied by earlier runs
+region_map = RegionMap(args.region_map_file, refresh=args.refresh_regions) if args.all_regions else None
+
+# Counters for each inventory type
+sg_count = 0 # Counter to hold the number of security groups identified
+kms_count = 0 # Counter to hold the number of KMS Keys identified
+waf_count = 0 # Counter to hold the number of WAF Web ACLs identified
+
+# Select the accounts to scan. The role is assumed once per account, and shared by all collectors.
+account_ids_scanned = scanner.select_accounts(args.organization)
+
+# Run all the collectors in a single pass over the account/region combinations, streaming each item to its output file
+with open(args.sg_file, 'w') as sgfile, open(args.kms_file, 'w', newline="") as kmscsvfile, open(args.waf_file, 'w', newline="") as wafcsvfile:
+    kms_writer = csv.writer(kmscsvfile)
+    kms_writer.writerow(kms_headers)
+    waf_writer = csv.writer(wafcsvfile)
+    waf_writer.writerow(waf_headers)
+    sg_response_count = 0
+    sgfile.write("[")
+    for result in scanner.run(security_group_collectors + kms_collectors + waf_collectors, regions, region_map=region_map):
+        item_count = 0
+        for item in result.items:
+            if result.collector == 'security_groups':
+                if sg_response_count: sgfile.write(", ")
+                sgfile.write(json.dumps(item))
+                sg_response_count += 1
+                sg_count += len(item['SecurityGroups'])
+            elif result.collector == 'kms_keys':
+                kms_writer.writerow(item)
+                kms_count += 1
+            else:
+                waf_writer.writerow(item)
+                waf_count += 1
+            item_count += 1
+        if args.verbose: print(f"Identified {item_count} {result.collector} items in account {result.account_id} region {result.region}.")
+    sgfile.write("]")
+
+# Save the region map for the next --all-regions run
+if region_map is not None:
+    region_map.save()
+
+print("----------------------------------------")
+print("AWS inventory is complete")
+print(f"{sg_count} security groups, {kms_count} KMS Keys and {waf_count} WAF Web ACLs were identified")
+print(f"The following {len(account_ids_scanned)} accounts and regions were scanned: ")
+
+print("Accounts:")
+print(account_ids_scanned)
+print("Regions:")
+print(scanner.regions_scanned if region_map is not None else regions)
+
+scanner.write_errors()
+
+print(f"JSON output (security groups) is saved at: {os.getcwd()}/{args.sg_file}")
+print(f"CSV output (KMS keys) is saved at: {os.getcwd()}/{args.kms_file}")
+print(f"CSV output (WAF web ACLs) is saved at: {os.getcwd()}/{args.waf_file}")
@@ -0,0 +1,77 @@
+# Region map cache for the --all-regions mode of the inventory scripts, used by OrgScanner (org_inventory.py).
+# For each account it holds the enabled regions (from ec2 describe_regions), and for each collector the regions found to be empty or denied
+# (e.g. by an SCP) in earlier runs. Later runs skip those regions, so a full-coverage scan only costs slightly more than a single-region one.
+# Use a refresh to discover the enabled regions again and re-scan every region.
+import json
+import os
+import threading
+import time
+
+# Reasons a region is skipped for a collector
+EMPTY = "empty"
+DENIED = "denied"
+
+# Error codes of account/region combinations that are denied by policy (e.g. an SCP region restriction) or not enabled in the account
+DENIED_ERROR_CODES = {
+    'AccessDenied', 'AccessDeniedException', 'UnauthorizedOperation', 'AuthFailure', 'UnrecognizedClientException', 'InvalidClientTokenId', 'OptInRequired',
+}
+
+
+class RegionMap:
+    def __init__(self, file_name="region_map.json", refresh=False):
+        self.file_name = file_name
+        self.refresh = refresh
+        self.skipped_count = 0 # Counter to hold the number of account/region combinations skipped in this run
+        self._lock = threading.Lock()
+        # Dict to hold, per account ID: the enabled 'regions', the 'skipped' regions per collector name (region: EMPTY or DENIED), and when it was 'discovered'
+        self._accounts = {}
+        if not refresh and os.path.exists(file_name):
+            with open(file_name, 'r') as map_file:
+                self._accounts = json.load(map_file)
+
+    # Return whether the enabled regions of an account still need to be discovered
+    def needs_discovery(self, account_id):
+        return not self._accounts.get(account_id, {}).get('discovered')
+
+    # Discover and store the enabled regions of an account with ec2 describe_regions (which only returns the regions enabled in the account)
+    def discover(self, unit):
+        ec2_client = unit.client('ec2')
+        regions_response = unit.call(ec2_client.describe_regions)
+        regions = sorted(region['RegionName'] for region in regions_response['Regions'])
+        with self._lock:
+            account = self._accounts.setdefault(unit.account_id, {'regions': [], 'skipped': {}, 'discovered': None})
+            account['regions'] = regions
+            account['discovered'] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        return regions
+
+    # Return the enabled regions of an account, or None if they haven't been discovered
+    def regions(self, account_id):
+        account = self._accounts.get(account_id)
+        return account['regions'] if account and account['discovered'] else None
+
+    # Return whether a collector should skip a region of an account, because it was empty (unless skip_empty is False) or denied in an earlier run
+    def is_skipped(self, account_id, collector_name, region, skip_empty=True):
+        account = self._accounts.get(account_id)
+        reason = account['skipped'].get(collector_name, {}).get(region) if account is not None else None
+        skipped = reason == DENIED or (reason == EMPTY and skip_empty)
+        if skipped: self.skipped_count += 1
+        return skipped
+
+    # Record the outcome of scanning a region: skip it in later runs if the collector found nothing (unless skip_empty is False), or was denied
+    def record(self, account_id, collector_name, region, item_count, error_code=None, skip_empty=True):
+        if error_code in DENIED_ERROR_CODES:
+            reason = DENIED
+        elif error_code is None and item_count == 0 and skip_empty:
+            reason = EMPTY
+        else:
+            return
+        with self._lock:
+            account = self._accounts.setdefault(account_id, {'regions': [], 'skipped': {}, 'discovered': None})
+            account['skipped'].setdefault(collector_name, {})[region] = reason
+
+    # Write the region map to disk (via a temporary file, so an interrupted run can't leave a corrupt map behind)
+    def save(self):
+        with self._lock:
+            with open(f"{self.file_name}.tmp", 'w') as map_file:
+                json.dump(self._accounts, map_file, indent=4, sort_keys=True)
+            os.replace(f"{self.file_name}.tmp", self.file_name)
@@ -0,0 +1,85 @@
+# Checkpoint file for resumable Organization-wide scans, used by OrgScanner (org_inventory.py) and the --resume flag of the inventory scripts.
+# The items of each account/region combination are appended to a JSON Lines file as they are written to the output, followed by a
+# completion marker once the combination has finished successfully. When a run is resumed, completed combinations are skipped and their
+# stored items are replayed from the file (by offset, so they are not all loaded into memory), while incomplete ones are scanned again
+# (their stored items are dropped from the file when it is loaded).
+import json
+import os
+
+
+class ScanCheckpoint:
+    def __init__(self, file_name, resume=False):
+        self.file_name = file_name
+        self.completed = {} # Dict to hold the file offsets of the items of each completed unit, keyed by (collector, account ID, region)
+        if resume and os.path.exists(file_name):
+            self._load()
+        else:
+            open(file_name, 'w').close()
+        self.file = open(file_name, 'a')
+
+    # Read the offsets of the stored items of each completed unit, and rewrite the file with the entries of the completed units only.
+    # Items of units that didn't complete (interrupted, or failed) are dropped: the unit is scanned again, and its stale items would
+    # otherwise be replayed along with the items of the attempt that completes it.
+    def _load(self):
+        item_offsets = {}
+        completed_offsets = {}
+        with open(self.file_name, 'rb') as checkpoint_file:
+            offset = checkpoint_file.tell()
+            line = checkpoint_file.readline()
+            while line:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A partially written last line, from the run being interrupted mid-write
+                    break
+                unit_key = tuple(entry['unit'])
+                if entry.get('complete'):
+                    completed_offsets[unit_key] = item_offsets.pop(unit_key, [])
+                else:
+                    item_offsets.setdefault(unit_key, []).append(offset)
+                offset = checkpoint_file.tell()
+                line = checkpoint_file.readline()
+
+        # Copy the items of the completed units to a temporary file (in file order, recording their new offsets) followed by
+        # their completion markers, and replace the checkpoint with it, so an interrupted rewrite leaves the old file intact
+        offset_units = {offset: unit_key for unit_key, offsets in completed_offsets.items() for offset in offsets}
+        self.completed = {unit_key: [] for unit_key in completed_offsets}
+        temp_file_name = f"{self.file_name}.tmp"
+        with open(self.file_name, 'rb') as checkpoint_file, open(temp_file_name, 'wb') as temp_file:
+            offset = checkpoint_file.tell()
+            line = checkpoint_file.readline()
+            while line:
+                unit_key = offset_units.get(offset)
+                if unit_key is not None:
+                    self.completed[unit_key].append(temp_file.tell())
+                    temp_file.write(line)
+                offset = checkpoint_file.tell()
+                line = checkpoint_file.readline()
+            for unit_key in self.completed:
+                temp_file.write((json.dumps({'unit': unit_key, 'complete': True}) + "\n").encode())
+        os.replace(temp_file_name, self.file_name)
+
+    def is_complete(self, unit_key):
+        return unit_key in self.completed
+
+    # Yield the stored items of a completed unit
+    def replay(self, unit_key):
+        with open(self.file_name, 'rb') as checkpoint_file:
+            for offset in self.completed[unit_key]:
+                checkpoint_file.seek(offset)
+                yield json.loads(checkpoint_file.readline())['item']
+
+    # Store an item of a unit in progress
+    def add_item(self, unit_key, item):
+        self.file.write(json.dumps({'unit': unit_key, 'item': item}, default=str) + "\n")
+
+    # Mark a unit as completed, and flush it to disk
+    def complete(self, unit_key):
+        self.file.write(json.dumps({'unit': unit_key, 'complete': True}) + "\n")
+        self.file.flush()
+
+    # Close the checkpoint, removing the file once the whole run has finished (so the next run starts from scratch)
+    def close(self, finished=True):
+        self.file.close()
+        if finished:
+            os.remove(self.file_name)
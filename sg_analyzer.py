@@ -0,0 +1,202 @@
+import argparse
+import csv
+import functools
+import ipaddress
+import os
+import time
+from sg_rules import iter_security_groups, security_group_sources, display_ports, ICMP_PROTOCOLS
+from table_renderer import StreamingTableWriter
+
+# Add command-line arguments for the security group dump and the report files
+parser = argparse.ArgumentParser(description="Analyze Security Group Rules for Overly-Permissive and Redundant Rules Script - Arguments")
+parser.add_argument("-i", "--input-file", default="security_groups.json", type=str, help="File to read security groups from: the JSON or JSON Lines output of sg_inventory.py")
+parser.add_argument("-o", "--output-file", default="security_groups_analysis.csv", type=str, help="File to write the findings to")
+parser.add_argument("-t", "--text", action="store_true", help="Generate a grid text report also (security_groups_analysis.txt)")
+parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
+args=parser.parse_args()
+
+# Finding types
+WORLD_OPEN = "world_open" # Inbound rule open to the internet (0.0.0.0/0 or ::/0)
+DUPLICATE = "duplicate" # Rule identical to another rule in the group, apart from its description
+SHADOWED = "shadowed" # Rule covered by a broader rule in the group (protocol, port range and source)
+MERGEABLE_PORTS = "mergeable_port_ranges" # Rules for the same source whose port ranges overlap or are adjacent, and could be one rule
+AGGREGATABLE_CIDRS = "aggregatable_cidrs" # Rules for the same ports whose CIDRs could be collapsed into fewer CIDRs
+
+finding_headers = [
+    'finding',
+    'account',
+    'region',
+    'sec_group_id',
+    'sec_group_name',
+    'direction',
+    'protocol',
+    'from_port',
+    'to_port',
+    'source',
+    'detail'
+]
+
+# Return the network of a CIDR (cached, as the same CIDRs appear in many security groups)
+@functools.lru_cache(maxsize=65536)
+def parse_network(cidr):
+    return ipaddress.ip_network(cidr, strict=False)
+
+# Return the network of a CIDR rule source, or None if the rule's source isn't a CIDR
+def source_network(rule):
+    if rule[4] != "cidr" or not rule[5]:
+        return None
+    return parse_network(rule[5])
+
+# Return whether a rule allows all the traffic of another rule with the same source (its protocol and port range include the other's).
+# ICMP rules have a type and code rather than a port range, which are compared exactly (-1 being any type or code).
+def covers(rule, other_rule):
+    if rule[1] == "-1":
+        return True
+    if rule[1] != other_rule[1]:
+        return False
+    if rule[1] in ICMP_PROTOCOLS:
+        return rule[2] in (-1, other_rule[2]) and rule[3] in (-1, other_rule[3])
+    return rule[2] <= other_rule[2] and rule[3] >= other_rule[3]
+
+# Return a short description of a rule
+def describe_rule(rule):
+    protocol, from_port, to_port = display_ports(rule[1], rule[2], rule[3])
+    if rule[1] in ICMP_PROTOCOLS:
+        ports = f"{from_port} {to_port}"
+    else:
+        ports = "all ports" if from_port == "Any" else f"ports {from_port}-{to_port}"
+    return f"{protocol} {ports} from {rule[5]}"
+
+# Return the findings of one direction's rules (canonical rule tuples from security_group_sources) in a security group, as
+# (finding, rule or None, source, detail) tuples. Each rule is only checked against the rules it could be covered by: for CIDR sources,
+# those on each supernet of its CIDR (one dict lookup per prefix length in use in the group), otherwise those with the same source.
+# The work per rule is bounded by the prefix length, so the whole analysis stays linear in the number of rules.
+def analyze_rules(rules, direction):
+    findings = []
+
+    # Duplicate rules (the same apart from the description)
+    unique_rules = {}
+    for rule in rules:
+        rule_key = rule[1:6]
+        if rule_key in unique_rules:
+            findings.append((DUPLICATE, rule, rule[5], "same protocol, ports and source as another rule in the group"))
+        else:
+            unique_rules[rule_key] = rule
+    rules = list(unique_rules.values())
+
+    # Index the rules by source: CIDR rules by (version, prefix length, network address), others by (source type, source)
+    networks = {}
+    rules_by_source = {}
+    prefix_lengths = {4: set(), 6: set()} # Prefix lengths of the CIDRs in the group, per IP version
+    for rule in rules:
+        network = source_network(rule)
+        if network is not None:
+            networks[id(rule)] = network
+            prefix_lengths[network.version].add(network.prefixlen)
+            rules_by_source.setdefault((network.version, network.prefixlen, int(network.network_address)), []).append(rule)
+        else:
+            rules_by_source.setdefault((rule[4], rule[5]), []).append(rule)
+
+    # Shadowed rules, covered by a rule with the same or a broader source
+    effective_rules = []
+    for rule in rules:
+        network = networks.get(id(rule))
+        if network is not None:
+            version = network.version
+            address = int(network.network_address)
+            address_bits = network.max_prefixlen
+            candidates = []
+            for length in prefix_lengths[version]:
+                if length <= network.prefixlen:
+                    mask = ((1 << length) - 1) << (address_bits - length)
+                    candidates.extend(rules_by_source.get((version, length, address & mask), []))
+        else:
+            candidates = rules_by_source[(rule[4], rule[5])]
+        covering_rule = next((candidate for candidate in candidates if candidate is not rule and covers(candidate, rule)), None)
+        if covering_rule is not None:
+            findings.append((SHADOWED, rule, rule[5], f"covered by {describe_rule(covering_rule)}"))
+        else:
+            effective_rules.append(rule)
+        if direction == "Inbound" and network is not None and network.prefixlen == 0:
+            findings.append((WORLD_OPEN, rule, rule[5], "open to the internet"))
+
+    # Port ranges of the same protocol and source that overlap or are adjacent, and could be merged (ICMP types and codes aren't port ranges)
+    port_ranges = {}
+    for rule in effective_rules:
+        if rule[1] != "-1" and rule[1] not in ICMP_PROTOCOLS:
+            port_ranges.setdefault((rule[1], rule[4], rule[5]), []).append((rule[2], rule[3]))
+    for (protocol, source_type, source), ranges in port_ranges.items():
+        if len(ranges) < 2:
+            continue
+        ranges.sort()
+        merged_ranges = [list(ranges[0])]
+        for from_port, to_port in ranges[1:]:
+            if from_port <= merged_ranges[-1][1] + 1:
+                merged_ranges[-1][1] = max(merged_ranges[-1][1], to_port)
+            else:
+                merged_ranges.append([from_port, to_port])
+        if len(merged_ranges) < len(ranges):
+            detail = ", ".join(f"{from_port}-{to_port}" for from_port, to_port in ranges) + " -> " + ", ".join(f"{from_port}-{to_port}" for from_port, to_port in merged_ranges)
+            findings.append((MERGEABLE_PORTS, (direction, protocol, merged_ranges[0][0], merged_ranges[-1][1], source_type, source, ""), source, detail))
+
+    # CIDRs of rules for the same protocol and ports that could be collapsed into fewer CIDRs. With shadowed rules left out, none of
+    # the CIDRs contain each other, so they can only be collapsed if two of them are the halves of a larger CIDR.
+    port_networks = {}
+    for rule in effective_rules:
+        network = networks.get(id(rule))
+        if network is not None:
+            port_networks.setdefault((rule[1], rule[2], rule[3], network.version), []).append(network)
+    for (protocol, from_port, to_port, version), rule_networks in port_networks.items():
+        network_keys = set((network.prefixlen, int(network.network_address)) for network in rule_networks)
+        if not any((network.prefixlen, int(network.network_address) ^ (1 << (network.max_prefixlen - network.prefixlen))) in network_keys
+                   for network in rule_networks if network.prefixlen):
+            continue
+        collapsed_networks = list(ipaddress.collapse_addresses(rule_networks))
+        if len(collapsed_networks) < len(rule_networks):
+            sources = " ".join(str(network) for network in sorted(rule_networks))
+            detail = "can be collapsed to " + " ".join(str(network) for network in collapsed_networks)
+            findings.append((AGGREGATABLE_CIDRS, (direction, protocol, from_port, to_port, "cidr", sources, ""), sources, detail))
+    return findings
+
+# Yield a finding row for each finding in a security group
+def security_group_findings(security_group):
+    account_id = security_group.get("AccountId", security_group.get("OwnerId", ""))
+    region = security_group.get("Region", "")
+    rules = list(security_group_sources(security_group))
+    for direction in ("Inbound", "Outbound"):
+        for finding, rule, source, detail in analyze_rules([rule for rule in rules if rule[0] == direction], direction):
+            protocol, from_port, to_port = display_ports(rule[1], rule[2], rule[3])
+            yield [finding, account_id, region, security_group["GroupId"], security_group["GroupName"], direction, protocol, from_port, to_port, source, detail]
+
+# Counters for the analysis
+group_count = 0 # Counter to hold the number of security groups analyzed
+finding_counts = {finding: 0 for finding in (WORLD_OPEN, DUPLICATE, SHADOWED, MERGEABLE_PORTS, AGGREGATABLE_CIDRS)} # Dict to hold the number of findings of each type
+flagged_groups = set() # Set to hold the security group IDs with at least one finding
+
+# Analyze each security group as it is read, streaming the findings to the report files
+start_time = time.perf_counter()
+text_writer = StreamingTableWriter("security_groups_analysis.txt", finding_headers) if args.text else None
+with open(args.input_file, 'r') as sg_json, open(args.output_file, 'w', newline="") as findings_file:
+    writer = csv.writer(findings_file)
+    writer.writerow(finding_headers)
+    for security_group in iter_security_groups(sg_json):
+        group_count += 1
+        rows = list(security_group_findings(security_group))
+        if not rows:
+            continue
+        flagged_groups.add(security_group["GroupId"])
+        for row in rows:
+            finding_counts[row[0]] += 1
+            if args.verbose: print(row)
+        writer.writerows(rows)
+        if text_writer is not None: text_writer.write_rows(rows)
+if text_writer is not None: text_writer.close()
+
+print("----------------------------------------")
+print("Security group analysis is complete")
+print(f"{group_count} security groups were analyzed, and {len(flagged_groups)} have findings:")
+for finding, count in finding_counts.items():
+    print(f"  {finding}: {count}")
+if args.verbose: print(f"Analyzed in {time.perf_counter() - start_time:.1f}s")
+print(f"CSV output is saved at: {os.getcwd()}/{args.output_file}")
+if args.text: print(f"Text output is saved at: {os.getcwd()}/security_groups_analysis.txt")
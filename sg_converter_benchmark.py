@@ -0,0 +1,211 @@
+import csv
+import io
+import argparse
+import random
+import time
+from sg_rules import RULE_COLUMNS, flatten_security_groups, write_csv_rows
+
+# Add command-line arguments for the size of the synthetic security group fixture
+parser = argparse.ArgumentParser(description="Benchmark the Security Group rule flattening engines on a synthetic Organization-scale fixture - Arguments")
+parser.add_argument("-a", "--accounts", default=400, type=int, help="Number of accounts in the fixture")
+parser.add_argument("-g", "--groups", default=50, type=int, help="Number of security groups per account")
+parser.add_argument("-r", "--rules", default=10, type=int, help="Number of inbound rules per security group")
+parser.add_argument("-s", "--seed", default=42, type=int, help="Random seed for the fixture")
+args=parser.parse_args()
+
+# Return a random IP permission, covering the shapes seen in describe_security_groups responses:
+# CIDR ranges with and without descriptions, security group references, all-protocol rules without ports, and empty rules
+def random_permission(rng, outbound):
+    protocol = rng.choice(["-1", "6", "17", "1", "6", "6"])
+    permission = {"IpProtocol": protocol, "IpRanges": [], "Ipv6Ranges": [], "PrefixListIds": [], "UserIdGroupPairs": []}
+    if protocol != "-1":
+        from_port = rng.randint(0, 65535)
+        permission["FromPort"] = from_port
+        permission["ToPort"] = min(65535, from_port + rng.choice([0, 0, 10, 1000]))
+    shape = rng.random()
+    if shape < 0.6:
+        for _ in range(rng.randint(1, 4)):
+            ip_range = {"CidrIp": f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/24"}
+            if rng.random() < 0.5:
+                ip_range["Description"] = f"range {rng.randint(0, 999)}"
+            if outbound and rng.random() < 0.05:
+                ip_range["CidrIp"] = ""
+            permission["IpRanges"].append(ip_range)
+    elif shape < 0.9:
+        for _ in range(rng.randint(1, 3)):
+            permission["UserIdGroupPairs"].append({"GroupId": f"sg-{rng.getrandbits(64):017x}", "UserId": "111111111111"})
+    return permission
+
+# Return a list of describe security group responses (one per account), as written by sg_inventory.py
+def synthetic_inventory(rng):
+    inventory = []
+    for account_number in range(args.accounts):
+        account_id = f"{100000000000 + account_number}"
+        security_groups = []
+        for group_number in range(args.groups):
+            security_groups.append({
+                "GroupId": f"sg-{rng.getrandbits(64):017x}",
+                "GroupName": f"group-{group_number}",
+                "Description": f"Synthetic security group {group_number} for account {account_id} with a long description",
+                "OwnerId": account_id,
+                "IpPermissions": [random_permission(rng, False) for _ in range(args.rules)],
+                "IpPermissionsEgress": [random_permission(rng, True) for _ in range(rng.randint(1, 3))],
+            })
+        inventory.append({"SecurityGroups": security_groups})
+    return inventory
+
+# Yield a rule dict for each inbound and outbound permission in a security group.
+# This is the original row-at-a-time flattening loop of sg_json_converter.py, kept here as the reference implementation
+# that the columnar engine of sg_rules.py must match byte-for-byte.
+def security_group_rules(security_group):
+    # Initialize Rule Dict
+    rule = {
+        "account": "",
+        "sec_group_id": "",
+        "sec_group_name" : "",
+        "sec_group_description": "",
+        "direction": "",
+        "protocol": "",
+        "ip_ranges": "",
+        "src_port": "",
+        "dst_port": ""
+    }
+
+    # This main section will be the same for each security group
+    rule["sec_group_description"] = security_group["Description"][:50]
+    rule["sec_group_name"] = security_group["GroupName"]
+    rule["sec_group_id"] = security_group["GroupId"]
+    rule["account"] = security_group["OwnerId"]
+
+    # Iterate through inbound permissions in the security group
+    if "IpPermissions" in security_group:
+        for inbound_rule in security_group["IpPermissions"]:
+            # Set Inbound direction and reset ports
+            rule["direction"] = "Inbound"
+            rule["src_port"] = ""
+            rule["dst_port"] = ""
+            
+            # Set Src Port
+            if "FromPort" in inbound_rule:
+                rule["src_port"] = str(inbound_rule["FromPort"])
+            else:
+                rule["src_port"] = "Any"
+            
+            # Set Dest Port
+            if "ToPort" in inbound_rule:
+                rule["dst_port"] = str(inbound_rule["ToPort"])
+            else:
+                rule["dst_port"] = "Any"
+            
+            # Set Protocol
+            rule["protocol"] = inbound_rule["IpProtocol"]
+            if rule["protocol"] == "-1":
+                rule["protocol"] = "Any"
+            elif rule["protocol"] == "6":
+                rule["protocol"] = "TCP"
+            elif rule["protocol"] == "17":
+                rule["protocol"] = "UDP"        
+
+            # Set IP CIDR Ranges (may be multiple)
+            rule["ip_ranges"] = ""
+            if inbound_rule["IpRanges"]:
+                for range in inbound_rule["IpRanges"]:
+                    description_range = ""
+                    if "Description" in range:
+                        description_range = " ({})".format(range["Description"])                
+                    rule["ip_ranges"] = "{} {}{}".format(rule["ip_ranges"], range["CidrIp"], description_range)
+            else:
+                if inbound_rule["UserIdGroupPairs"]:
+                    for sg_id in inbound_rule["UserIdGroupPairs"]:
+                        rule["ip_ranges"] = "{} {}".format(rule["ip_ranges"], sg_id["GroupId"])
+                else:
+                    rule["ip_ranges"] = "Any"
+
+            # Yield a copy of the rule
+            yield dict(rule)
+
+    # Iterate through outbound permissions in the security group
+    if security_group["IpPermissionsEgress"]:
+        for outbound_rule in security_group["IpPermissionsEgress"]:
+            # Set Outbound direction and reset ports
+            rule["direction"] = "Outbound"
+            rule["src_port"] = ""
+            rule["dst_port"] = ""
+
+            # Set Source Port
+            if "FromPort" in outbound_rule:
+                rule["src_port"] = str(outbound_rule["FromPort"])
+            else:
+                rule["src_port"] = "Any"                
+            
+            # Set Destination Port
+            if "ToPort" in outbound_rule:
+                rule["dst_port"] = str(outbound_rule["ToPort"])
+            else:
+                rule["dst_port"] = "Any"                
+            
+            # Set Protocol
+            rule["protocol"] = outbound_rule["IpProtocol"]
+            if rule["protocol"] == "-1":
+                rule["protocol"] = "Any"
+            elif rule["protocol"] == "6":
+                rule["protocol"] = "TCP"
+            elif rule["protocol"] == "17":
+                rule["protocol"] = "UDP"            
+            
+            # Set IP CIDR Range (may be multiple)
+            rule["ip_ranges"] = ""
+            if outbound_rule["IpRanges"]:
+                for range in outbound_rule["IpRanges"]:
+                    description_range = ""
+                    if "Description" in range:
+                        description_range = " ({})".format(range["Description"])
+                    rule["ip_ranges"] = "{} {}{}".format(rule["ip_ranges"], range["CidrIp"], description_range)
+                    if not range["CidrIp"]:
+                        rule["ip_ranges"] = "Any"
+            else:
+                if outbound_rule["UserIdGroupPairs"]:
+                    for sg_id in outbound_rule["UserIdGroupPairs"]:
+                        rule["ip_ranges"] = "{} {}".format(rule["ip_ranges"], sg_id["GroupId"])
+                else:
+                    rule["ip_ranges"] = "Any"
+
+            # Yield a copy of the rule
+            yield dict(rule)
+
+# Flatten the fixture with the row-at-a-time reference implementation (one dict per rule, written with csv.DictWriter)
+def convert_rows(security_groups):
+    csv_file = io.StringIO()
+    csv_writer = csv.DictWriter(csv_file, fieldnames=RULE_COLUMNS)
+    csv_writer.writeheader()
+    for security_group in security_groups:
+        for row in security_group_rules(security_group):
+            csv_writer.writerow(row)
+    return csv_file.getvalue()
+
+# Flatten the fixture with the columnar engine, in batches of 1000 security groups as sg_json_converter.py does
+def convert_columns(security_groups):
+    csv_file = io.StringIO()
+    csv_writer = csv.writer(csv_file)
+    csv_writer.writerow(RULE_COLUMNS)
+    for start in range(0, len(security_groups), 1000):
+        write_csv_rows(csv_writer, flatten_security_groups(security_groups[start:start + 1000]))
+    return csv_file.getvalue()
+
+rng = random.Random(args.seed)
+security_groups = [security_group for response in synthetic_inventory(rng) for security_group in response["SecurityGroups"]]
+print(f"Synthetic fixture: {len(security_groups)} security groups")
+
+start = time.perf_counter()
+rows_output = convert_rows(security_groups)
+rows_seconds = time.perf_counter() - start
+
+start = time.perf_counter()
+columns_output = convert_columns(security_groups)
+columns_seconds = time.perf_counter() - start
+
+print(f"Rules flattened: {rows_output.count(chr(10)) - 1}")
+print(f"Row-at-a-time engine: {rows_seconds:.2f}s")
+print(f"Columnar engine: {columns_seconds:.2f}s")
+print(f"Speedup: {rows_seconds / columns_seconds:.2f}x")
+print(f"CSV output is byte-identical: {rows_output == columns_output}")
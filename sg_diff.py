@@ -0,0 +1,113 @@
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+import zlib
+from sg_rules import iter_security_groups, security_group_sources, display_ports
+
+# Add command-line arguments for the two security group dumps to compare
+parser = argparse.ArgumentParser(description="Compare Security Group Rules Between Two Inventory Dumps Script - Arguments")
+parser.add_argument("-b", "--before-file", required=True, type=str, help="Earlier security group dump: the JSON or JSON Lines output of sg_inventory.py")
+parser.add_argument("-a", "--after-file", required=True, type=str, help="Later security group dump to compare against the earlier one")
+parser.add_argument("-o", "--output-file", default="security_groups_diff.csv", type=str, help="File to write the added and removed rules to")
+parser.add_argument("-p", "--partitions", default=64, type=int, help="Number of partitions the dumps are split into by GroupId (more partitions = less memory)")
+parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
+args=parser.parse_args()
+
+diff_headers = [
+    'change',
+    'account',
+    'sec_group_id',
+    'sec_group_name',
+    'direction',
+    'protocol',
+    'from_port',
+    'to_port',
+    'source_type',
+    'source',
+    'source_description'
+]
+
+# Split a dump into partition files by GroupId, with one line per security group holding its canonical rule tuples.
+# Each security group lands in the same partition in both dumps, so the partitions can be compared one pair at a time in bounded memory.
+def partition_dump(file_name, partition_dir, prefix):
+    partition_files = [open(os.path.join(partition_dir, f"{prefix}{index}.jsonl"), 'w') for index in range(args.partitions)]
+    group_count = 0
+    with open(file_name, 'r') as sg_json:
+        for security_group in iter_security_groups(sg_json):
+            group_id = security_group["GroupId"]
+            account_id = security_group.get("AccountId", security_group.get("OwnerId", ""))
+            rules = list(security_group_sources(security_group))
+            partition_files[zlib.crc32(group_id.encode()) % args.partitions].write(json.dumps([group_id, account_id, security_group["GroupName"], rules]) + "\n")
+            group_count += 1
+    for partition_file in partition_files:
+        partition_file.close()
+    return group_count
+
+# Return a dict of GroupId to (account ID, group name, set of rule tuples) for a partition file
+def load_partition(file_name):
+    groups = {}
+    with open(file_name, 'r') as partition_file:
+        for line in partition_file:
+            group_id, account_id, group_name, rules = json.loads(line)
+            if group_id in groups:
+                groups[group_id][2].update(map(tuple, rules))
+            else:
+                groups[group_id] = (account_id, group_name, set(map(tuple, rules)))
+    return groups
+
+# Yield a diff row for each rule added to or removed from a security group
+def diff_rows(change, account_id, group_id, group_name, rules):
+    for direction, protocol, from_port, to_port, source_type, source, description in sorted(rules):
+        yield [change, account_id, group_id, group_name, direction, *display_ports(protocol, from_port, to_port), source_type, source, description]
+
+# Counters for the differences between the dumps
+groups_added = 0 # Counter to hold the number of security groups only in the later dump
+groups_removed = 0 # Counter to hold the number of security groups only in the earlier dump
+groups_changed = 0 # Counter to hold the number of security groups in both dumps whose rules differ
+rules_added = 0 # Counter to hold the number of rules added
+rules_removed = 0 # Counter to hold the number of rules removed
+
+start_time = time.perf_counter()
+with tempfile.TemporaryDirectory() as partition_dir:
+    before_count = partition_dump(args.before_file, partition_dir, "before")
+    after_count = partition_dump(args.after_file, partition_dir, "after")
+    if args.verbose: print(f"Partitioned {before_count} and {after_count} security groups in {time.perf_counter() - start_time:.1f}s")
+
+    with open(args.output_file, 'w', newline="") as diff_file:
+        writer = csv.writer(diff_file)
+        writer.writerow(diff_headers)
+        for index in range(args.partitions):
+            before_groups = load_partition(os.path.join(partition_dir, f"before{index}.jsonl"))
+            after_groups = load_partition(os.path.join(partition_dir, f"after{index}.jsonl"))
+            for group_id in sorted(before_groups.keys() | after_groups.keys()):
+                account_id, group_name, before_rules = before_groups.get(group_id, (None, None, set()))
+                if group_id in after_groups:
+                    account_id, group_name, after_rules = after_groups[group_id]
+                else:
+                    after_rules = set()
+                added = after_rules - before_rules
+                removed = before_rules - after_rules
+                if group_id not in before_groups:
+                    groups_added += 1
+                elif group_id not in after_groups:
+                    groups_removed += 1
+                elif added or removed:
+                    groups_changed += 1
+                rules_added += len(added)
+                rules_removed += len(removed)
+                for row in diff_rows("removed", account_id, group_id, group_name, removed):
+                    writer.writerow(row)
+                    if args.verbose: print(row)
+                for row in diff_rows("added", account_id, group_id, group_name, added):
+                    writer.writerow(row)
+                    if args.verbose: print(row)
+
+print("----------------------------------------")
+print("Security group comparison is complete")
+print(f"{groups_added} security groups added, {groups_removed} removed and {groups_changed} changed")
+print(f"{rules_added} rules added and {rules_removed} rules removed")
+if args.verbose: print(f"Compared in {time.perf_counter() - start_time:.1f}s")
+print(f"CSV output is saved at: {os.getcwd()}/{args.output_file}")
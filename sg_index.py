@@ -0,0 +1,177 @@
+# Queryable index of the security group rules in a sg_inventory.py dump, used by sg_query.py.
+# The index is a SQLite database stored next to the dump (<dump>.index.db), and is rebuilt whenever the dump changes. It holds:
+#   - an R*Tree (interval index) over the port range of each rule, so "which rules allow port 22" is answered without a scan
+#     (ICMP rules have a type and code rather than ports, so they are left out of it, and never match a port)
+#   - a CIDR prefix index over IpRanges and Ipv6Ranges, keyed by (family, prefix length, network address). Rules whose range contains an
+#     address are found by walking the address's prefixes (one indexed lookup per prefix length, as in a trie), and rules within a CIDR by a range lookup
+#   - a reverse index from each security group referenced in UserIdGroupPairs to the rules referencing it
+import ipaddress
+import os
+import sqlite3
+from sg_rules import iter_security_groups, security_group_sources, normalize_protocol, ICMP_PROTOCOLS
+
+# Number of rules inserted per batch when building the index
+BUILD_BATCH_SIZE = 10000
+
+# Version of the index layout, stored with the dump version so indexes built by an earlier layout are rebuilt
+INDEX_FORMAT = 2
+
+# Columns of the rules returned by queries, in order
+RESULT_COLUMNS = [
+    "account",
+    "region",
+    "sec_group_id",
+    "sec_group_name",
+    "direction",
+    "protocol",
+    "from_port",
+    "to_port",
+    "source",
+    "source_description"
+]
+
+
+# Return the index file name of a dump
+def index_file_name(dump_file_name):
+    return f"{dump_file_name}.index.db"
+
+
+# Return the (family, prefix length, network address bytes, last address bytes) of a CIDR or single address
+def cidr_key(cidr):
+    network = ipaddress.ip_network(cidr, strict=False)
+    return network.version, network.prefixlen, network.network_address.packed, network.broadcast_address.packed
+
+
+class SecurityGroupIndex:
+    def __init__(self, dump_file_name, rebuild=False):
+        self.dump_file_name = dump_file_name
+        self.file_name = index_file_name(dump_file_name)
+        self.rebuilt = False # Set if the index was (re)built when opened
+        dump_stat = os.stat(dump_file_name)
+        self.dump_version = f"{INDEX_FORMAT}:{dump_stat.st_size}:{dump_stat.st_mtime_ns}"
+        self.connection = sqlite3.connect(self.file_name)
+        if rebuild or self._stored_version() != self.dump_version:
+            self.build()
+
+    def _stored_version(self):
+        try:
+            return self.connection.execute("SELECT value FROM meta WHERE key = 'dump_version'").fetchone()[0]
+        except (sqlite3.OperationalError, TypeError):
+            return None
+
+    # Build the index from the dump, replacing any existing index
+    def build(self):
+        self.connection.executescript("""
+            DROP TABLE IF EXISTS meta;
+            DROP TABLE IF EXISTS groups;
+            DROP TABLE IF EXISTS rules;
+            DROP TABLE IF EXISTS rule_ports;
+            DROP TABLE IF EXISTS rule_cidrs;
+            DROP TABLE IF EXISTS rule_references;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE groups (
+                group_key INTEGER PRIMARY KEY,
+                account_id TEXT, region TEXT, group_id TEXT, group_name TEXT, description TEXT, vpc_id TEXT
+            );
+            CREATE TABLE rules (
+                rule_id INTEGER PRIMARY KEY,
+                group_key INTEGER, direction TEXT, protocol TEXT, from_port INTEGER, to_port INTEGER,
+                source_type TEXT, source TEXT, source_description TEXT
+            );
+            CREATE VIRTUAL TABLE rule_ports USING rtree_i32(rule_id, from_port, to_port);
+            CREATE TABLE rule_cidrs (rule_id INTEGER, family INTEGER, prefix_length INTEGER, network BLOB);
+            CREATE TABLE rule_references (group_id TEXT, rule_id INTEGER);
+        """)
+        groups, rules, ports, cidrs, references = [], [], [], [], []
+        rule_id = 0
+        with open(self.dump_file_name, 'r') as sg_json:
+            for group_key, security_group in enumerate(iter_security_groups(sg_json)):
+                groups.append((group_key, security_group.get("AccountId", security_group.get("OwnerId", "")), security_group.get("Region", ""),
+                               security_group["GroupId"], security_group["GroupName"], security_group.get("Description", ""), security_group.get("VpcId", "")))
+                for direction, protocol, from_port, to_port, source_type, source, description in security_group_sources(security_group):
+                    rule_id += 1
+                    rules.append((rule_id, group_key, direction, protocol, from_port, to_port, source_type, source, description))
+                    if protocol not in ICMP_PROTOCOLS:
+                        ports.append((rule_id, from_port, to_port))
+                    if source_type == "cidr" and source:
+                        family, prefix_length, network, last_address = cidr_key(source)
+                        cidrs.append((rule_id, family, prefix_length, network))
+                    elif source_type == "group":
+                        references.append((source, rule_id))
+                if len(rules) >= BUILD_BATCH_SIZE:
+                    self._insert(groups, rules, ports, cidrs, references)
+                    groups, rules, ports, cidrs, references = [], [], [], [], []
+        self._insert(groups, rules, ports, cidrs, references)
+        # Indexes are created after the bulk insert, which is faster than maintaining them row by row
+        self.connection.executescript("""
+            CREATE INDEX rule_cidrs_prefix ON rule_cidrs (family, prefix_length, network);
+            CREATE INDEX rule_cidrs_network ON rule_cidrs (family, network);
+            CREATE INDEX rule_references_group ON rule_references (group_id);
+        """)
+        self.connection.execute("INSERT INTO meta (key, value) VALUES ('dump_version', ?)", (self.dump_version,))
+        self.connection.commit()
+        self.rebuilt = True
+
+    def _insert(self, groups, rules, ports, cidrs, references):
+        self.connection.executemany("INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?, ?)", groups)
+        self.connection.executemany("INSERT INTO rules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rules)
+        self.connection.executemany("INSERT INTO rule_ports VALUES (?, ?, ?)", ports)
+        self.connection.executemany("INSERT INTO rule_cidrs VALUES (?, ?, ?, ?)", cidrs)
+        self.connection.executemany("INSERT INTO rule_references VALUES (?, ?)", references)
+
+    # Return the rules matching every given condition, as lists of RESULT_COLUMNS values:
+    #   port: rules whose port range includes the port (ICMP rules have no ports)
+    #   protocol: rules for the protocol (name or number, e.g. tcp or 6), or for all protocols
+    #   source: rules whose CIDR contains the address or CIDR (e.g. 0.0.0.0/0 only matches rules open to the world)
+    #   within: rules whose CIDR lies within the CIDR
+    #   references: rules referencing the security group ID
+    #   direction: "Inbound" or "Outbound" rules only
+    def query(self, port=None, protocol=None, source=None, within=None, references=None, direction=None):
+        conditions, parameters = [], []
+        if port is not None:
+            # The port interval index drives the query when there is no more selective (CIDR or reference) condition,
+            # otherwise the port range is checked on the rules found by that condition
+            if source is None and within is None and references is None:
+                conditions.append("rules.rule_id IN (SELECT rule_id FROM rule_ports WHERE from_port <= ? AND to_port >= ?)")
+            else:
+                conditions.append("rules.from_port <= ? AND rules.to_port >= ? AND rules.protocol NOT IN ('1', '58')")
+            parameters += [port, port]
+        if protocol is not None:
+            conditions.append("rules.protocol IN (?, '-1')")
+            parameters.append(normalize_protocol(protocol))
+        if source is not None:
+            family, prefix_length, network, last_address = cidr_key(source)
+            address = int.from_bytes(network, "big")
+            address_bits = len(network) * 8
+            prefix_lookups = []
+            for length in range(prefix_length + 1):
+                mask = ((1 << length) - 1) << (address_bits - length)
+                prefix_lookups.append("SELECT rule_id FROM rule_cidrs WHERE family = ? AND prefix_length = ? AND network = ?")
+                parameters += [family, length, (address & mask).to_bytes(len(network), "big")]
+            conditions.append(f"rules.rule_id IN ({' UNION ALL '.join(prefix_lookups)})")
+        if within is not None:
+            family, prefix_length, network, last_address = cidr_key(within)
+            conditions.append("rules.rule_id IN (SELECT rule_id FROM rule_cidrs WHERE family = ? AND network BETWEEN ? AND ? AND prefix_length >= ?)")
+            parameters += [family, network, last_address, prefix_length]
+        if references is not None:
+            conditions.append("rules.rule_id IN (SELECT rule_id FROM rule_references WHERE group_id = ?)")
+            parameters.append(references)
+        if direction is not None:
+            conditions.append("rules.direction = ?")
+            parameters.append(direction)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.connection.execute(f"""
+            SELECT groups.account_id, groups.region, groups.group_id, groups.group_name, rules.direction, rules.protocol,
+                   rules.from_port, rules.to_port, rules.source, rules.source_description
+            FROM rules JOIN groups ON groups.group_key = rules.group_key
+            {where}
+            ORDER BY rules.rule_id
+        """, parameters).fetchall()
+
+    # Return the number of security groups and rules in the index
+    def counts(self):
+        return (self.connection.execute("SELECT COUNT(*) FROM groups").fetchone()[0],
+                self.connection.execute("SELECT COUNT(*) FROM rules").fetchone()[0])
+
+    def close(self):
+        self.connection.close()
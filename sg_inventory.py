@@ -1,31 +1,52 @@
-import boto3
-from botocore.exceptions import ClientError
 import json
 import argparse
+import csv
 import os
+from org_inventory import OrgScanner
+from region_map import RegionMap
+from inventory_collectors import security_group_collectors, network_interface_collectors
+from snapshot_store import SnapshotStore
+from scan_checkpoint import ScanCheckpoint
 
 # Add command-line arguments for region and role to assume within accounts
 parser = argparse.ArgumentParser(description="Get Security Groups Cross-Account Python Script - Arguments")
 parser.add_argument("-r", "--region", default="us-east-1", type=str, help="AWS Region")
 parser.add_argument("-o", "--organization", action="store_true", help="If specified, execute across all accounts in AWS Organization")
 parser.add_argument("-a", "--assumed-role", default="ReadOnlyRole", type=str, help="Role to assume in each organization account")
-parser.add_argument("-f", "--file", default="security_groups.json", type=str, help="File to write security groups to")
+parser.add_argument("-f", "--file", type=str, help="File to write security groups to (default: security_groups.json, or security_groups.jsonl with --format jsonl)")
+parser.add_argument("--format", default="json", choices=["json", "jsonl"], help="Output format: a JSON list of describe security group responses, or JSON Lines with one security group per line, tagged with its account and region")
+parser.add_argument("-w", "--workers", default=1, type=int, help="Number of account/region combinations to scan concurrently (1 = serial)")
+parser.add_argument("--engine", default="threads", choices=["threads", "async"], help="Scan engine: a thread pool, or an asyncio event loop for very large scans (requires aiobotocore; --workers then sets the number of account/region combinations in flight, e.g. 500)")
+parser.add_argument("-m", "--max-account-requests", default=4, type=int, help="Maximum number of concurrent EC2 API requests per account, to stay under throttling limits")
+parser.add_argument("--eni-usage", action="store_true", help="If specified, count the network interfaces each security group is attached to (one paginated describe_network_interfaces pass per region), and mark the unattached groups as orphaned")
+parser.add_argument("--orphans-file", default="orphaned_security_groups.csv", type=str, help="File to write the orphaned security groups to, with --eni-usage")
+parser.add_argument("--since-last", action="store_true", help="If specified, only write the resources added, changed or removed since the last --since-last run (one entry per security group, with a Change key)")
+parser.add_argument("--state-dir", default="inventory_state", type=str, help="Directory holding the snapshot store used by --since-last")
+parser.add_argument("--resume", action="store_true", help="If specified, resume an interrupted run: account/region combinations completed by the previous run are taken from the checkpoint file instead of being scanned again")
+parser.add_argument("--checkpoint-file", type=str, help="File to checkpoint completed account/region combinations to (default: the output file name + '.checkpoint')")
+parser.add_argument("--all-regions", action="store_true", help="If specified, scan every region enabled in each account (instead of --region), skipping the regions found empty or denied by earlier runs")
+parser.add_argument("--region-map-file", default="region_map.json", type=str, help="File caching the enabled, empty and denied regions of each account, used by --all-regions")
+parser.add_argument("--refresh-regions", action="store_true", help="If specified with --all-regions, discover the enabled regions again and re-scan the regions found empty or denied by earlier runs")
+parser.add_argument("--max-pool-connections", default=10, type=int, help="Maximum number of HTTP connections kept open per pooled client (should be at least --max-account-requests)")
+parser.add_argument("--credential-cache", type=str, help="File to cache assumed-role credentials in, so back-to-back runs assume each role only once per session lifetime. The file is encrypted if INVENTORY_CREDENTIAL_KEY is set, and holds the credentials in plaintext otherwise")
 parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
 args=parser.parse_args()
+if args.file is None:
+    args.file = "security_groups.jsonl" if args.format == "jsonl" else "security_groups.json"
 
 # Get the Current Account ID and role and print to screen
-caller_identity = boto3.client('sts').get_caller_identity()
-current_account_id = caller_identity['Account']
-current_role = caller_identity['Arn']
+scanner = OrgScanner(args.assumed_role, "ListResourcesScript", args.workers, args.max_account_requests, args.verbose, credential_cache_file=args.credential_cache,
+                     max_pool_connections=args.max_pool_connections, engine=args.engine)
+current_account_id = scanner.current_account_id
 
 if (args.verbose):
     print(f"Current Account ID: {current_account_id}")
-    print(f"Current Role: {current_role}")
+    print(f"Current Role: {scanner.current_role}")
 
 # Configure the list of regions to iterate through, and print to screen.
 regions = [
     # Add any additional regions you want to check here.
-    # Regions that are denied by SCPs will cause the script to fail.
+    # Use --all-regions to scan every region enabled in each account instead.
 ]
 if args.region not in regions:
     regions.insert(0, args.region)
@@ -34,113 +55,142 @@ if (args.verbose):
     print("Regions selected:")
     print(regions)
 
-# Create a list object to hold the describe security group responses in each account:
-security_groups_list = [] # List to hold the describe security group responses
+# If all-regions mode is selected, scan every region enabled in each account, skipping the regions found empty or denied by earlier runs
+region_map = RegionMap(args.region_map_file, refresh=args.refresh_regions) if args.all_regions else None
+
+# If delta mode is selected, compare the security groups against the snapshot of the last run, and only write the changes
+delta = SnapshotStore(args.state_dir).delta('security_groups') if args.since_last else None
+
+# Counters for the security groups in each account:
 total_sg_count = 0 # Counter to hold the total number of security groups identified
-sg_count_account = 0 # Counter to hold the number of security groups identified in each account
+sg_entry_count = 0 # Counter to hold the number of entries (describe responses, or security groups in JSON Lines format) written
 sg_count_dict = {} # Dict to hold the number of security groups per account
 # sg_count_region (instantiated in each loop) holds the number of security groups identified in the current region in each account
 
-# Capture Security Groups for the current account:
-sg_count_account = 0
-for region in regions:
-    if args.verbose: print(f"Identifying Security Groups within account {current_account_id}, region {region}...")
-    ec2_client = boto3.client('ec2', region_name=region)
-    describe_security_groups_response = ec2_client.describe_security_groups()
-    security_groups_list.append(describe_security_groups_response)
-    sg_count_region = len(describe_security_groups_response['SecurityGroups'])
-    sg_count_account += sg_count_region
-    if args.verbose: print(f"Identified {sg_count_region} security groups in account {current_account_id} region {region}.")
-total_sg_count += sg_count_account
-sg_count_dict[current_account_id] = sg_count_account
-if args.verbose: print(f"Identified {sg_count_account} security groups in account {current_account_id}.")
-
-if args.verbose: print("Completed identification of Security Groups in the current account")
-
-# ---------- Cross-account functionality below ----------- 
-account_ids = [] # List to hold account IDs to iterate through
-error_list = [] # List to hold errors encountered
-account_ids_scanned = [current_account_id] # List to hold account IDs that have been scanned
-account_ids_failed = [] # List to hold account IDs that failed to scan
-
-# If organization / cross-account capabilities are selected, execute across all accounts by assuming roles and appending to the same file:
-if (args.organization == True):
-    # Create a list of AWS Account IDs in the AWS Organization, and print to screen
-    try:
-        organizations_client = boto3.client('organizations')
-        account_list = organizations_client.list_accounts()
-        for account in account_list['Accounts']:
-            if account['Id'] != current_account_id:
-                account_ids.append(account['Id'])
-    except ClientError as error: 
-        print(f"Couldn't retrieve account IDs from AWS Organization. Here's why: {error.response['Error']['Message']}")
-        error_list.append(error.response['Error']['Message'])
+# Write a list of security groups from an account/region to the output file, with the change type in delta mode.
+# In JSON format the security groups are written as an element of the JSON list, in the same format as a describe response.
+# In JSON Lines format each security group is written on its own line, tagged with its account and region, so the file can be read incrementally.
+def write_security_groups(sgfile, security_groups, account_id, region, change=None):
+    global sg_entry_count
+    if args.format == "jsonl":
+        for security_group in security_groups:
+            tagged_security_group = {"AccountId": account_id, "Region": region, **security_group}
+            if change is not None: tagged_security_group["Change"] = change
+            sgfile.write(json.dumps(tagged_security_group) + "\n")
+            sg_entry_count += 1
     else:
-        if args.verbose: print(f"{len(account_ids)} additional accounts found in your AWS Organization: ")
-        if args.verbose: print(account_ids)
-        
-        # Iterate through account Ids and regions
-        for account_id in account_ids:
-            if account_id is not current_account_id:
-                sg_count_account = 0 # Reset SG per-account counter
-                if args.verbose: print(f"Assuming role {args.assumed_role} in account {account_id}...")
-                try:
-                    # Assume role_name in each account and get temporary credentials (can use OrganizationAccountAccessRole but it is admin-level, advised to create/utilize read-only roles for this purposes)
-                    sts_client = boto3.client('sts')
-                    sts_response = sts_client.assume_role(RoleArn=f"arn:aws:iam::{account_id}:role/{args.assumed_role}", RoleSessionName="ListResourcesScript")
-                    temp_credentials = sts_response['Credentials']
-                    assumed_session = boto3.Session(                                                                                                                   
-                        aws_access_key_id=temp_credentials['AccessKeyId'],                                                                                             
-                        aws_secret_access_key=temp_credentials['SecretAccessKey'],                                                                                     
-                        aws_session_token=temp_credentials['SessionToken']
-                    )
-                except ClientError as error:
-                    error_list.append(error.response['Error']['Message'])
-                    account_ids_failed.append(account_id)
-                    print(f"Couldn't assume role. Here's why: {error.response['Error']['Message']}")
-                    print(f"Skipping account {account_id}")
-                else:
-                    # Capture security group details in each region iteratively, and append to the list
-                    account_ids_scanned.append(account_id)
-                    for region in regions:
-                        if args.verbose: print(f"Role {args.assumed_role} assumed successfully in account {account_id}")
-                        ec2_client = assumed_session.client('ec2', region_name=region)
-                        describe_security_groups_response = ec2_client.describe_security_groups()
-                        if describe_security_groups_response['SecurityGroups']:
-                            security_groups_list.append(describe_security_groups_response)
-                            sg_count_region = len(describe_security_groups_response['SecurityGroups'])
-                            sg_count_account += sg_count_region
-                            if args.verbose: print(f"Identified {len(describe_security_groups_response['SecurityGroups'])} security groups in account {account_id} region {region}.")
-                        else:
-                            if args.verbose: print(f"No security groups found in account {account_id} region {region}.")
-                total_sg_count += sg_count_account
-                sg_count_dict[account_id] = sg_count_account
-
-# Write security groups to file
+        if sg_entry_count: sgfile.write(", ")
+        sgfile.write(json.dumps({"Change": change, "SecurityGroups": security_groups} if change is not None else {"SecurityGroups": security_groups}))
+        sg_entry_count += 1
+
+# If ENI usage is selected, the network interfaces of each account are listed before its security groups (results are returned
+# in collector order within each account), and joined to them by GroupId as they are written
+collectors = network_interface_collectors + security_group_collectors if args.eni_usage else security_group_collectors
+eni_group_counts = {} # Dict to hold the number of network interfaces per security group ID, per (account ID, region) not yet written
+orphan_count = 0 # Counter to hold the number of security groups not attached to any network interface
+orphans_file = open(args.orphans_file, 'w', newline="") if args.eni_usage else None
+orphans_writer = csv.writer(orphans_file) if args.eni_usage else None
+if orphans_writer is not None: orphans_writer.writerow(['Account_ID', 'Region', 'Group_ID', 'Group_Name', 'VPC_ID', 'Description'])
+
+# Add the network interface count of each security group in an account/region, and mark the groups without any as orphaned.
+# If the network interfaces couldn't be listed, the security groups are left unmarked.
+def mark_eni_usage(security_groups, group_counts, account_id, region):
+    global orphan_count
+    if group_counts is None:
+        return
+    for security_group in security_groups:
+        security_group['NetworkInterfaceCount'] = group_counts.get(security_group['GroupId'], 0)
+        security_group['Orphaned'] = security_group['NetworkInterfaceCount'] == 0
+        if security_group['Orphaned']:
+            orphan_count += 1
+            orphans_writer.writerow([account_id, region, security_group['GroupId'], security_group['GroupName'], security_group.get('VpcId', ''), security_group['Description']])
+
+# Checkpoint each completed account/region combination, so an interrupted run can be resumed with --resume
+checkpoint = ScanCheckpoint(args.checkpoint_file or f"{args.file}.checkpoint", resume=args.resume)
+
+# Select the current account, and if organization / cross-account capabilities are selected, every account in the AWS Organization
+account_ids_scanned = scanner.select_accounts(args.organization)
+
+# Capture security group details for every account/region combination, streaming each describe response page to the file
+# (results are returned in a stable order, regardless of the number of workers)
 with open(args.file, 'w') as sgfile:
-
-    sgfile.write(json.dumps(security_groups_list))
+    if args.format == "json": sgfile.write("[")
+    for result in scanner.run(collectors, regions, checkpoint=checkpoint, region_map=region_map):
+        if result.collector == 'network_interfaces':
+            group_counts = eni_group_counts.setdefault((result.account_id, result.region), {})
+            for page_group_counts in result.items:
+                for group_id, count in page_group_counts.items():
+                    group_counts[group_id] = group_counts.get(group_id, 0) + count
+            if result.failed:
+                eni_group_counts[(result.account_id, result.region)] = None
+            continue
+        group_counts = eni_group_counts.pop((result.account_id, result.region), None)
+        sg_count_region = 0
+        for describe_security_groups_response in result.items:
+            sg_count_region += len(describe_security_groups_response['SecurityGroups'])
+            if delta is not None:
+                # In delta mode, write a separate entry per added/changed security group
+                # (the ENI usage is added after the groups are recorded, so a change in usage alone isn't reported as a change)
+                changes = [(security_group, delta.record(result.account_id, result.region, security_group['GroupId'], security_group))
+                           for security_group in describe_security_groups_response['SecurityGroups']]
+                mark_eni_usage(describe_security_groups_response['SecurityGroups'], group_counts, result.account_id, result.region)
+                for security_group, change in changes:
+                    if change is not None:
+                        write_security_groups(sgfile, [security_group], result.account_id, result.region, change)
+                continue
+            mark_eni_usage(describe_security_groups_response['SecurityGroups'], group_counts, result.account_id, result.region)
+            if args.format == "json":
+                # Write the whole describe response, as in previous versions of the output
+                if sg_entry_count: sgfile.write(", ")
+                sgfile.write(json.dumps(describe_security_groups_response))
+                sg_entry_count += 1
+            else:
+                write_security_groups(sgfile, describe_security_groups_response['SecurityGroups'], result.account_id, result.region)
+        # Security groups missing from a combination that failed to scan aren't reported as removed
+        if delta is not None and not result.failed: delta.mark_scanned(result.account_id, result.region)
+        sg_count_dict[result.account_id] = sg_count_dict.get(result.account_id, 0) + sg_count_region
+        total_sg_count += sg_count_region
+        if args.verbose:
+            if sg_count_region:
+                print(f"Identified {sg_count_region} security groups in account {result.account_id} region {result.region}.")
+            else:
+                print(f"No security groups found in account {result.account_id} region {result.region}.")
+    # Write the security groups that no longer exist since the last run
+    if delta is not None:
+        for account_id, region, group_id, security_group in delta.removed():
+            write_security_groups(sgfile, [security_group], account_id, region, "removed")
+    if args.format == "json": sgfile.write("]")
+
+if orphans_file is not None: orphans_file.close()
+
+# Save the region map for the next --all-regions run
+if region_map is not None:
+    region_map.save()
+
+# The run has finished, so the checkpoint is no longer needed
+checkpoint.close()
+
+if delta is not None:
+    delta.commit()
+    print(f"Changes since the last run: {delta.change_counts['added']} added, {delta.change_counts['changed']} changed, {delta.change_counts['removed']} removed")
 
 print("----------------------------------------")
 print("AWS security group identification is complete")
-print(f"{total_sg_count} security groups were identified in {len(security_groups_list)} account/region combinations.")
+print(f"{total_sg_count} security groups were identified in {sg_entry_count} {'lines' if args.format == 'jsonl' else 'describe security group responses'}.")
 print(f"The following {len(account_ids_scanned)} accounts and regions were scanned: ")
 
 print("Accounts:")
 print(account_ids_scanned)
 print("Regions:")
-print(regions)
+print(scanner.regions_scanned if region_map is not None else regions)
+
+if args.eni_usage:
+    print(f"{orphan_count} security groups are not attached to any network interface. The list is located at: {os.getcwd()}/{args.orphans_file}")
 
 if args.verbose:
     print("Number of security groups identified in each account: ")
     print(sg_count_dict)
 
-if error_list:
-    with open("errors.txt", "w") as error_file:
-        for error in error_list:
-            error_file.write(f"\n{error}")
-    print(f"The following {len(account_ids_failed)} accounts encountered errors:")
-    print(account_ids_failed)
-    print(f"{len(error_list)} errors occurred. Error messages are located at: {os.getcwd()}/errors.txt")
+scanner.write_errors()
 
-print(f"JSON output is saved at: {os.getcwd()}/{args.file}")
\ No newline at end of file
+print(f"{'JSON Lines' if args.format == 'jsonl' else 'JSON'} output is saved at: {os.getcwd()}/{args.file}")
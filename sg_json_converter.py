@@ -1,193 +1,85 @@
-import json
-import csv
 import argparse
 import os
-from pprint import pprint 
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from sg_rules import iter_security_groups, convert_chunk, CsvRuleWriter, GridTextRuleWriter, MarkdownRuleWriter, JsonRuleWriter, ParquetRuleWriter
 
 parser = argparse.ArgumentParser(description="Convert Security Groups JSON to CSV/TXT Script - Arguments")
-parser.add_argument("-i", "--input-file", default="security_groups.json", type=str, help="File to read security groups from")
+parser.add_argument("-i", "--input-file", default="security_groups.json", type=str, help="File to read security groups from: the complete JSON or JSON Lines output of sg_inventory.py, or '-' for stdin (JSON Lines from stdin or a named pipe are converted as they arrive)")
 parser.add_argument("-o", "--output-file", default="security_groups.csv", type=str, help="File to write CSV security groups to")
-parser.add_argument("-t", "--text", action="store_true", help="Generate a text output also with Tabulate")
-parser.add_argument("-j", "--json", action="store_true", help="Generate a simplified JSON output")
+parser.add_argument("-t", "--text", action="store_true", help="Generate a grid text output also (security_groups.txt)")
+parser.add_argument("-m", "--markdown", action="store_true", help="Generate a fixed-width markdown table output also (security_groups.md)")
+parser.add_argument("-j", "--json", action="store_true", help="Generate a simplified JSON output (security_groups_simplified.json)")
+parser.add_argument("-p", "--parquet", action="store_true", help="Generate a Parquet output also, requires pyarrow (security_groups.parquet)")
+parser.add_argument("-w", "--workers", default=1, type=int, help="Number of processes to flatten the security groups with (1 = single process)")
 parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
 args=parser.parse_args()
 
-# If text output is desired, import the tabulate library
+# Select the output writers. All the writers are fed from a single pass over the input.
+rule_writers = [CsvRuleWriter(args.output_file, echo=args.verbose)]
 if args.text:
-    from tabulate import tabulate
-
-# Open the input file
-with open(args.input_file, 'r') as sg_json:
-    all_accounts_json = json.loads(sg_json.read())
-
-# Create list to store security group rule dicts
-rules_list_of_dicts = []
-
-sec_group_count = 0 # Counter to hold the number of security groups identified in all accounts
-# Iterate through json file (list of dicts: security groups per account+region)
-for single_account_json in all_accounts_json:
-    account_security_groups = single_account_json["SecurityGroups"]
-    sec_group_count += len(account_security_groups) # Add to the counter, the number of security groups in this account/region
-    for security_group in account_security_groups:
-        # Initialize Rule Dict
-        rule = {
-            "account": "",
-            "sec_group_id": "",
-            "sec_group_name" : "",
-            "sec_group_description": "",
-            "direction": "",
-            "protocol": "",
-            "ip_ranges": "",
-            "src_port": "",
-            "dst_port": ""
-        }
-
-        # This main section will be the same for each security group
-        rule["sec_group_description"] = security_group["Description"][:50]
-        rule["sec_group_name"] = security_group["GroupName"]
-        rule["sec_group_id"] = security_group["GroupId"]
-        rule["account"] = security_group["OwnerId"]
-
-        # Iterate through inbound permissions in the security group
-        if "IpPermissions" in security_group:
-            for inbound_rule in security_group["IpPermissions"]:
-                # Set Inbound direction and reset ports
-                rule["direction"] = "Inbound"
-                rule["src_port"] = ""
-                rule["dst_port"] = ""
-                
-                # Set Src Port
-                if "FromPort" in inbound_rule:
-                    rule["src_port"] = str(inbound_rule["FromPort"])
-                else:
-                    rule["src_port"] = "Any"
-                
-                # Set Dest Port
-                if "ToPort" in inbound_rule:
-                    rule["dst_port"] = str(inbound_rule["ToPort"])
-                else:
-                    rule["dst_port"] = "Any"
-                
-                # Set Protocol
-                rule["protocol"] = inbound_rule["IpProtocol"]
-                if rule["protocol"] == "-1":
-                    rule["protocol"] = "Any"
-                elif rule["protocol"] == "6":
-                    rule["protocol"] = "TCP"
-                elif rule["protocol"] == "17":
-                    rule["protocol"] = "UDP"        
-
-                # Set IP CIDR Ranges (may be multiple)
-                rule["ip_ranges"] = ""
-                if inbound_rule["IpRanges"]:
-                    for range in inbound_rule["IpRanges"]:
-                        description_range = ""
-                        if "Description" in range:
-                            description_range = " ({})".format(range["Description"])                
-                        rule["ip_ranges"] = "{} {}{}".format(rule["ip_ranges"], range["CidrIp"], description_range)
-                else:
-                    if inbound_rule["UserIdGroupPairs"]:
-                        for sg_id in inbound_rule["UserIdGroupPairs"]:
-                            rule["ip_ranges"] = "{} {}".format(rule["ip_ranges"], sg_id["GroupId"])
-                    else:
-                        rule["ip_ranges"] = "Any"
-
-                # Add rule to list
-                updated_rule_dict = dict(rule)
-                rules_list_of_dicts.append(updated_rule_dict)
-
-        # Iterate through outbound permissions in the security group
-        if security_group["IpPermissionsEgress"]:
-            for outbound_rule in security_group["IpPermissionsEgress"]:
-                # Set Outbound direction and reset ports
-                rule["direction"] = "Outbound"
-                rule["src_port"] = ""
-                rule["dst_port"] = ""
-
-                # Set Source Port
-                if "FromPort" in outbound_rule:
-                    rule["src_port"] = str(outbound_rule["FromPort"])
-                else:
-                    rule["src_port"] = "Any"                
-                
-                # Set Destination Port
-                if "ToPort" in outbound_rule:
-                    rule["dst_port"] = str(outbound_rule["ToPort"])
-                else:
-                    rule["dst_port"] = "Any"                
-                
-                # Set Protocol
-                rule["protocol"] = outbound_rule["IpProtocol"]
-                if rule["protocol"] == "-1":
-                    rule["protocol"] = "Any"
-                elif rule["protocol"] == "6":
-                    rule["protocol"] = "TCP"
-                elif rule["protocol"] == "17":
-                    rule["protocol"] = "UDP"            
-                
-                # Set IP CIDR Range (may be multiple)
-                rule["ip_ranges"] = ""
-                if outbound_rule["IpRanges"]:
-                    for range in outbound_rule["IpRanges"]:
-                        description_range = ""
-                        if "Description" in range:
-                            description_range = " ({})".format(range["Description"])
-                        rule["ip_ranges"] = "{} {}{}".format(rule["ip_ranges"], range["CidrIp"], description_range)
-                        if not range["CidrIp"]:
-                            rule["ip_ranges"] = "Any"
-                else:
-                    if outbound_rule["UserIdGroupPairs"]:
-                        for sg_id in outbound_rule["UserIdGroupPairs"]:
-                            rule["ip_ranges"] = "{} {}".format(rule["ip_ranges"], sg_id["GroupId"])
-                    else:
-                        rule["ip_ranges"] = "Any"
-
-                # Add rule to lists
-                updated_rule_dict = dict(rule)
-                rules_list_of_dicts.append(updated_rule_dict)
-
-# Create list of headers for writing to CSV and TXT file
-csv_headers = [
-    "account",
-    "sec_group_id",
-    "sec_group_name",
-    "sec_group_description",
-    "direction",
-    "protocol",
-    "ip_ranges",
-    "src_port",
-    "dst_port"
-]
-
-# Write the security group rules to a CSV file
-with open(args.output_file, 'w') as csv_file:
-    csv_writer = csv.DictWriter(csv_file, fieldnames=csv_headers)
-    csv_writer.writeheader()
-    if args.verbose:
-        print(csv_headers)
-    for row in rules_list_of_dicts:
-        csv_writer.writerow(row)
-        if args.verbose:
-            print(list(row.values()))
-
-# If text output is desired, output the security group rules to text file and print to screen to screen, via tabulate
-if args.text:
-    rules_list_of_values = [list(rule.values()) for rule in rules_list_of_dicts]
-    with open('security_groups.txt', 'w') as sg_text:
-        sg_text.write(tabulate(rules_list_of_values, csv_headers, tablefmt="grid"))
-    if args.verbose:
-        print(tabulate(rules_list_of_values, csv_headers, tablefmt="grid"))
-    
-# If simplified JSON is desired, output the security group rules to json
+    rule_writers.append(GridTextRuleWriter("security_groups.txt", echo=args.verbose))
+if args.markdown:
+    rule_writers.append(MarkdownRuleWriter("security_groups.md", echo=args.verbose))
 if args.json:
-    with open('security_groups_simplified.json', 'w') as simplified_json:
-        json.dump(rules_list_of_dicts, simplified_json, indent=4)
-    if args.verbose:
-        pprint(rules_list_of_dicts)
-
-print(f"Identified {len(rules_list_of_dicts)} rules across {sec_group_count} security groups")
-print(f"CSV output saved at: {os.getcwd()}/{args.output_file}")
-if args.text:
-    print(f"Text output saved at: {os.getcwd()}/security_groups.txt")
-if args.json:
-    print(f"Simplified JSON output saved at: {os.getcwd()}/security_groups_simplified.json")
\ No newline at end of file
+    rule_writers.append(JsonRuleWriter("security_groups_simplified.json", echo=args.verbose))
+if args.parquet:
+    rule_writers.append(ParquetRuleWriter("security_groups.parquet"))
+
+# Number of security groups flattened per chunk. Each chunk is flattened into rule columns and written out before the next one is read.
+CHUNK_SIZE = 1000
+
+# Yield the security groups from an iterator in lists of up to chunk_size.
+# The input is ordered by account/region, so each chunk holds consecutive security groups of one or a few account/region combinations.
+def chunks(security_groups, chunk_size):
+    chunk = []
+    for security_group in security_groups:
+        chunk.append(security_group)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Yield convert_chunk results for each chunk in the input order, converting up to workers * 2 chunks ahead in a process pool.
+# Only the chunks in flight are held in memory, rather than the whole input or output.
+def convert_chunks(chunk_iterator, keep_columns, workers):
+    converter = partial(convert_chunk, keep_columns=keep_columns)
+    if workers <= 1:
+        yield from map(converter, chunk_iterator)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        pending = []
+        for chunk in chunk_iterator:
+            pending.append(executor.submit(converter, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+# The worker processes are forked, so they don't re-run this script; where fork isn't available, convert in a single process
+if args.workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+    print("Multiple workers require the 'fork' start method, which isn't available on this platform. Converting in a single process.")
+    args.workers = 1
+
+# Read the security groups from the input file, flatten them into rule columns chunk by chunk, and pass each chunk's rules to the writers in order.
+# The CSV text of each chunk is rendered along with the flattening (in the worker processes, if selected), and the rule columns
+# are only returned if another writer or verbose output needs them.
+keep_columns = len(rule_writers) > 1 or args.verbose
+rule_count = 0 # Counter to hold the number of rules identified in all accounts
+sec_group_count = 0 # Counter to hold the number of security groups identified in all accounts
+with (sys.stdin if args.input_file == "-" else open(args.input_file, 'r')) as sg_json:
+    chunk_iterator = chunks(iter_security_groups(sg_json, raw_lines=args.workers > 1), CHUNK_SIZE)
+    for chunk_sec_group_count, chunk_rule_count, chunk_csv, rule_columns in convert_chunks(chunk_iterator, keep_columns, args.workers):
+        sec_group_count += chunk_sec_group_count
+        rule_count += chunk_rule_count
+        for rule_writer in rule_writers:
+            rule_writer.write(rule_columns, csv_text=chunk_csv)
+for rule_writer in rule_writers:
+    rule_writer.close()
+
+print(f"Identified {rule_count} rules across {sec_group_count} security groups")
+for rule_writer in rule_writers:
+    print(f"{rule_writer.label} output saved at: {os.getcwd()}/{rule_writer.file_name}")
@@ -0,0 +1,53 @@
+import argparse
+import csv
+import time
+from sg_index import SecurityGroupIndex, RESULT_COLUMNS
+from sg_rules import display_ports
+from table_renderer import render_table
+
+# Add command-line arguments for the security group dump and the query conditions
+parser = argparse.ArgumentParser(description="Query Security Group Rules Script - Arguments")
+parser.add_argument("-i", "--input-file", default="security_groups.json", type=str, help="Security group dump to query: the JSON or JSON Lines output of sg_inventory.py (indexed on first use, in <input-file>.index.db)")
+parser.add_argument("-p", "--port", type=int, help="Only rules allowing this port, e.g. 22")
+parser.add_argument("--protocol", type=str, help="Only rules allowing this protocol: tcp, udp, icmp, icmpv6 or a protocol number (rules for all protocols always match)")
+parser.add_argument("-s", "--source", type=str, help="Only rules whose CIDR contains this address or CIDR, e.g. 0.0.0.0/0 for rules open to the world, or 10.1.2.3")
+parser.add_argument("--within", type=str, help="Only rules whose CIDR lies within this CIDR, e.g. 10.0.0.0/8")
+parser.add_argument("-g", "--references", type=str, help="Only rules referencing this security group ID (UserIdGroupPairs), e.g. sg-0abc")
+parser.add_argument("-d", "--direction", default="inbound", choices=["inbound", "outbound", "any"], help="Only inbound or outbound rules (default: inbound)")
+parser.add_argument("-o", "--output-file", type=str, help="File to write the matching rules to as CSV, instead of printing a table")
+parser.add_argument("--rebuild", action="store_true", help="If specified, rebuild the index even if the dump hasn't changed")
+parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
+args=parser.parse_args()
+
+# Open the index, building it if the dump is new or has changed since it was indexed
+start_time = time.perf_counter()
+sg_index = SecurityGroupIndex(args.input_file, rebuild=args.rebuild)
+if args.verbose:
+    group_count, rule_count = sg_index.counts()
+    action = "Built" if sg_index.rebuilt else "Opened"
+    print(f"{action} the index of {group_count} security groups and {rule_count} rules in {time.perf_counter() - start_time:.3f}s: {sg_index.file_name}")
+
+# Run the query
+start_time = time.perf_counter()
+direction = None if args.direction == "any" else args.direction.capitalize()
+rules = sg_index.query(port=args.port, protocol=args.protocol, source=args.source, within=args.within, references=args.references, direction=direction)
+query_time = time.perf_counter() - start_time
+sg_index.close()
+
+# Show protocols by name, the ports of rules for all protocols as Any, and the type and code of ICMP rules
+rows = []
+for rule in rules:
+    row = list(rule)
+    row[5:8] = display_ports(row[5], row[6], row[7])
+    rows.append(row)
+
+if args.output_file:
+    with open(args.output_file, 'w', newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(RESULT_COLUMNS)
+        writer.writerows(rows)
+    print(f"CSV output is saved at: {args.output_file}")
+elif rows:
+    print(render_table(rows, RESULT_COLUMNS))
+
+print(f"{len(rows)} matching rules in {len(set((row[0], row[2]) for row in rows))} security groups ({query_time * 1000:.1f} ms)")
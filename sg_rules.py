@@ -0,0 +1,338 @@
+# Security group rule flattening core, shared by sg_json_converter.py and the other security group tools.
+# Rules are flattened in batch into column lists (one list per output column) rather than one dict per rule,
+# and written to CSV, text and JSON straight from the columns.
+import csv
+import io
+import json
+import re
+from table_renderer import StreamingTableWriter, GRID, MARKDOWN
+
+# Output columns of the flattened security group rules, in order
+RULE_COLUMNS = [
+    "account",
+    "sec_group_id",
+    "sec_group_name",
+    "sec_group_description",
+    "direction",
+    "protocol",
+    "ip_ranges",
+    "src_port",
+    "dst_port"
+]
+
+# Display names of the IP protocol numbers (other protocols are shown as-is)
+PROTOCOL_NAMES = {"-1": "Any", "6": "TCP", "17": "UDP"}
+
+# IP protocol numbers of the protocol names used in IpProtocol ("tcp", "udp", "icmp", "icmpv6") and in queries ("any")
+PROTOCOL_NUMBERS = {"tcp": "6", "udp": "17", "icmp": "1", "icmpv6": "58", "any": "-1", "all": "-1"}
+
+# Protocols whose FromPort and ToPort are an ICMP type and code rather than a port range
+ICMP_PROTOCOLS = {"1", "58"}
+
+# Display names of the protocol numbers of canonical rules (see security_group_sources)
+RULE_PROTOCOL_NAMES = dict(PROTOCOL_NAMES, **{"1": "ICMP", "58": "ICMPv6"})
+
+# Number of characters read from a JSON list file at a time
+JSON_READ_SIZE = 1 << 20
+
+# The separator following an element of a JSON list
+_LIST_SEPARATOR = re.compile(r'\s*[,\]]')
+
+
+# Yield each element of a top-level JSON list, parsed one element at a time from a read buffer (text is the start of the file up to and
+# including the opening '[', already read), so memory use is bounded by the largest element rather than the whole file
+def iter_json_list(json_file, text):
+    decoder = json.JSONDecoder()
+    buffer = text.lstrip()[1:] # Skip the opening '['
+    position = 0
+    while True:
+        # Skip the separators before the next element, reading more of the file as needed
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position == len(buffer):
+            buffer, position = json_file.read(JSON_READ_SIZE), 0
+            if not buffer:
+                raise ValueError("Unterminated JSON list")
+            continue
+        if buffer[position] == "]":
+            return
+        # Parse the next element, reading more of the file until it is complete (read sizes grow with the element,
+        # so a large element is parsed a bounded number of times). An element is only complete once it is followed by a separator
+        # or the end of the list, as a number cut off by the end of the buffer also parses.
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                if _LIST_SEPARATOR.match(buffer, end):
+                    break
+            except json.JSONDecodeError:
+                pass
+            more = json_file.read(max(JSON_READ_SIZE, len(buffer) - position))
+            if not more:
+                raise ValueError("Invalid or unterminated JSON list")
+            buffer, position = buffer[position:] + more, 0
+        yield element
+        position = end
+
+# Yield each security group in the input file. The input is either the JSON list of describe security group responses written by sg_inventory.py,
+# or JSON Lines with one security group per line (sg_inventory.py --format jsonl). Both are read incrementally (JSON list input one describe
+# response at a time, JSON Lines input one line at a time), so memory use stays bounded. When JSON Lines are read from stdin or a named pipe
+# (e.g. sg_inventory.py --format jsonl -f <fifo> with sg_json_converter.py -i <fifo>), conversion starts while the inventory is still being written.
+# A regular file must be complete: reading stops at its current end, and a partly written last line fails to parse.
+# If raw_lines is set, JSON Lines input is yielded as the unparsed lines, so that parsing can be left to a worker process.
+def iter_security_groups(sg_json, raw_lines=False):
+    # The formats are told apart by the first non-whitespace character (sg_inventory.py writes a JSON list on a single line)
+    text = ""
+    while not text.strip():
+        character = sg_json.read(1)
+        if not character:
+            return
+        text += character
+    if text.strip() == "[":
+        for single_account_json in iter_json_list(sg_json, text):
+            yield from single_account_json["SecurityGroups"]
+        return
+    line = text + sg_json.readline()
+    while line:
+        if line.strip():
+            yield line if raw_lines else json.loads(line)
+        line = sg_json.readline()
+
+
+# Return a new, empty set of rule columns
+def new_rule_columns():
+    return {column: [] for column in RULE_COLUMNS}
+
+
+# Return the ip_ranges value of a permission, as built by the reference implementation (security_group_rules in sg_converter_benchmark.py):
+# each CIDR (with its description) or referenced security group is preceded by a space, and an empty outbound CIDR resets the value to "Any"
+def _ip_ranges(permission, outbound):
+    ip_ranges = permission["IpRanges"]
+    if ip_ranges:
+        value = ""
+        for ip_range in ip_ranges:
+            if outbound and not ip_range["CidrIp"]:
+                value = "Any"
+            elif "Description" in ip_range:
+                value += " " + ip_range["CidrIp"] + " (" + ip_range["Description"] + ")"
+            else:
+                value += " " + ip_range["CidrIp"]
+        return value
+    if permission["UserIdGroupPairs"]:
+        return "".join([" " + pair["GroupId"] for pair in permission["UserIdGroupPairs"]])
+    return "Any"
+
+
+# Flatten a batch of security groups into rule columns, appending to the columns given (or to new columns).
+# Values shared by every rule of a security group are computed once per group and repeated with list.extend.
+def flatten_security_groups(security_groups, columns=None):
+    if columns is None:
+        columns = new_rule_columns()
+    account_column = columns["account"]
+    group_id_column = columns["sec_group_id"]
+    group_name_column = columns["sec_group_name"]
+    description_column = columns["sec_group_description"]
+    direction_column = columns["direction"]
+    protocol_column = columns["protocol"]
+    ip_ranges_column = columns["ip_ranges"]
+    src_port_column = columns["src_port"]
+    dst_port_column = columns["dst_port"]
+    protocol_names = PROTOCOL_NAMES
+
+    for security_group in security_groups:
+        inbound_permissions = security_group.get("IpPermissions") or []
+        outbound_permissions = security_group.get("IpPermissionsEgress") or []
+        permission_count = len(inbound_permissions) + len(outbound_permissions)
+        if not permission_count:
+            continue
+        account_column.extend([security_group["OwnerId"]] * permission_count)
+        group_id_column.extend([security_group["GroupId"]] * permission_count)
+        group_name_column.extend([security_group["GroupName"]] * permission_count)
+        description_column.extend([security_group["Description"][:50]] * permission_count)
+        direction_column.extend(["Inbound"] * len(inbound_permissions))
+        direction_column.extend(["Outbound"] * len(outbound_permissions))
+        for outbound, permissions in ((False, inbound_permissions), (True, outbound_permissions)):
+            for permission in permissions:
+                protocol = permission["IpProtocol"]
+                protocol_column.append(protocol_names.get(protocol, protocol))
+                ip_ranges_column.append(_ip_ranges(permission, outbound))
+                src_port_column.append(str(permission["FromPort"]) if "FromPort" in permission else "Any")
+                dst_port_column.append(str(permission["ToPort"]) if "ToPort" in permission else "Any")
+    return columns
+
+
+# Return the rules in a set of rule columns as rows (lists of values, in RULE_COLUMNS order)
+def rule_rows(columns):
+    return list(zip(*[columns[column] for column in RULE_COLUMNS]))
+
+
+# Write the rules in a set of rule columns to a csv writer (the header is written separately)
+def write_csv_rows(csv_writer, columns):
+    csv_writer.writerows(zip(*[columns[column] for column in RULE_COLUMNS]))
+
+
+# Return the rules in a set of rule columns as a list of rule dicts, for the simplified JSON output
+def rule_dicts(columns):
+    return [dict(zip(RULE_COLUMNS, row)) for row in zip(*[columns[column] for column in RULE_COLUMNS])]
+
+
+# Flatten a chunk of security groups, returning the number of security groups and rules, the CSV text of the rules, and (if keep_columns) the rule columns.
+# Used by the worker processes of sg_json_converter.py --workers; chunks of JSON Lines input are passed as raw lines and parsed here.
+def convert_chunk(chunk, keep_columns=False):
+    security_groups = [json.loads(item) if isinstance(item, str) else item for item in chunk]
+    columns = flatten_security_groups(security_groups)
+    csv_file = io.StringIO()
+    write_csv_rows(csv.writer(csv_file), columns)
+    return len(security_groups), len(columns["account"]), csv_file.getvalue(), columns if keep_columns else None
+
+
+# Return the protocol number of an IpProtocol or query protocol, given by name or number (e.g. "tcp" and "6" both return "6")
+def normalize_protocol(protocol):
+    protocol = str(protocol).lower()
+    return PROTOCOL_NUMBERS.get(protocol, protocol)
+
+# Return the display (protocol, from port, to port) of a canonical rule: protocols by name, the ports of rules for all protocols as Any,
+# and the type and code of ICMP rules as e.g. "type 8" and "code Any"
+def display_ports(protocol, from_port, to_port):
+    if protocol == "-1":
+        return "Any", "Any", "Any"
+    if protocol in ICMP_PROTOCOLS:
+        return RULE_PROTOCOL_NAMES[protocol], f"type {'Any' if from_port == -1 else from_port}", f"code {'Any' if to_port == -1 else to_port}"
+    return RULE_PROTOCOL_NAMES.get(protocol, protocol), from_port, to_port
+
+# Yield a (direction, protocol, from_port, to_port, source_type, source, description) tuple for each source of each permission in a security group.
+# This is the canonical form of a rule used by sg_index.py, sg_diff.py and sg_analyzer.py: the protocol is given by number, rules without
+# ports (all protocols, or protocols other than TCP and UDP) cover ports 0-65535, and for ICMP rules from_port and to_port are the ICMP type
+# and code (-1 for any type or code).
+def security_group_sources(security_group):
+    for direction, permissions_key in (("Inbound", "IpPermissions"), ("Outbound", "IpPermissionsEgress")):
+        for permission in security_group.get(permissions_key) or []:
+            protocol = normalize_protocol(permission["IpProtocol"])
+            if protocol in ICMP_PROTOCOLS:
+                from_port, to_port = permission.get("FromPort", -1), permission.get("ToPort", -1)
+            elif protocol == "-1":
+                from_port, to_port = 0, 65535
+            else:
+                from_port, to_port = permission.get("FromPort", 0), permission.get("ToPort", 65535)
+            for ip_range in permission.get("IpRanges", []):
+                yield direction, protocol, from_port, to_port, "cidr", ip_range.get("CidrIp", ""), ip_range.get("Description", "")
+            for ip_range in permission.get("Ipv6Ranges", []):
+                yield direction, protocol, from_port, to_port, "cidr", ip_range.get("CidrIpv6", ""), ip_range.get("Description", "")
+            for group_pair in permission.get("UserIdGroupPairs", []):
+                yield direction, protocol, from_port, to_port, "group", group_pair["GroupId"], group_pair.get("Description", "")
+            for prefix_list in permission.get("PrefixListIds", []):
+                yield direction, protocol, from_port, to_port, "prefix_list", prefix_list["PrefixListId"], prefix_list.get("Description", "")
+
+
+# ---------- Output writers -----------
+# Each writer receives the rule columns of every chunk in order through write(), and finishes its output file in close().
+# A single pass over the input can feed several writers at once. The CSV writer can also take the chunk's CSV text,
+# when it was already rendered by a worker process.
+
+# Write the rules to a CSV file
+class CsvRuleWriter:
+    label = "CSV"
+
+    def __init__(self, file_name, echo=False):
+        self.file_name = file_name
+        self.echo = echo
+        self.file = open(file_name, 'w')
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(RULE_COLUMNS)
+        if echo: print(RULE_COLUMNS)
+
+    def write(self, columns, csv_text=None):
+        if csv_text is None:
+            write_csv_rows(self.csv_writer, columns)
+        else:
+            self.file.write(csv_text)
+        if self.echo:
+            for row in rule_rows(columns):
+                print(list(row))
+
+    def close(self):
+        self.file.close()
+
+
+# Write the rules to a grid text table. Column widths are sized from all the rules, which are spooled to disk until close().
+class GridTextRuleWriter:
+    label = "Text"
+
+    def __init__(self, file_name, echo=False):
+        self.file_name = file_name
+        self.table_writer = StreamingTableWriter(file_name, RULE_COLUMNS, GRID, echo=echo)
+
+    def write(self, columns, csv_text=None):
+        self.table_writer.write_rows(rule_rows(columns))
+
+    def close(self):
+        self.table_writer.close()
+
+
+# Column widths of the fixed-width markdown table (values longer than the width are written in full)
+MARKDOWN_COLUMN_WIDTHS = [12, 25, 30, 50, 10, 8, 50, 8, 8]
+
+# Write the rules to a fixed-width markdown table, one row at a time
+class MarkdownRuleWriter:
+    label = "Markdown"
+
+    def __init__(self, file_name, echo=False):
+        self.file_name = file_name
+        self.table_writer = StreamingTableWriter(file_name, RULE_COLUMNS, MARKDOWN, widths=MARKDOWN_COLUMN_WIDTHS, echo=echo)
+
+    def write(self, columns, csv_text=None):
+        self.table_writer.write_rows(rule_rows(columns))
+
+    def close(self):
+        self.table_writer.close()
+
+
+# Write the rules to the simplified JSON list of rule dicts (formatted as json.dump with indent=4), one chunk at a time
+class JsonRuleWriter:
+    label = "Simplified JSON"
+
+    def __init__(self, file_name, echo=False):
+        self.file_name = file_name
+        self.echo = echo
+        self.file = open(file_name, 'w')
+        self.rule_count = 0
+
+    def write(self, columns, csv_text=None):
+        for rule in rule_dicts(columns):
+            self.file.write(",\n" if self.rule_count else "[\n")
+            self.file.write("    " + json.dumps(rule, indent=4).replace("\n", "\n    "))
+            self.rule_count += 1
+            if self.echo: print(rule)
+
+    def close(self):
+        self.file.write("\n]" if self.rule_count else "[]")
+        self.file.close()
+
+
+# Write the rules to a Parquet file (requires pyarrow), one row group per chunk
+class ParquetRuleWriter:
+    label = "Parquet"
+
+    def __init__(self, file_name, echo=False):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.file_name = file_name
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in RULE_COLUMNS])
+        self.parquet_writer = pyarrow.parquet.ParquetWriter(file_name, self.schema)
+
+    def write(self, columns, csv_text=None):
+        if columns["account"]:
+            self.parquet_writer.write_table(self.pyarrow.table({column: columns[column] for column in RULE_COLUMNS}, schema=self.schema))
+
+    def close(self):
+        self.parquet_writer.close()
+
+
+# Output writers by format name
+RULE_WRITERS = {
+    "csv": CsvRuleWriter,
+    "text": GridTextRuleWriter,
+    "markdown": MarkdownRuleWriter,
+    "json": JsonRuleWriter,
+    "parquet": ParquetRuleWriter,
+}
@@ -0,0 +1,114 @@
+# Local snapshot store for incremental (delta) inventories, used by the --since-last mode of the inventory scripts.
+# Each resource is recorded in a SQLite database under the state directory, keyed by inventory type, account, region and resource ID,
+# with a hash of its content. Comparing a new run against the stored snapshot yields only the added, changed and removed resources.
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Change types reported for each resource in a delta
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+
+# Return a stable hash of a resource's content
+def content_hash(content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SnapshotStore:
+    def __init__(self, state_dir="inventory_state"):
+        os.makedirs(state_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(state_dir, "snapshots.db"))
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                inventory TEXT NOT NULL,
+                started REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS resources (
+                inventory TEXT NOT NULL,
+                account_id TEXT NOT NULL,
+                region TEXT NOT NULL,
+                resource_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                content TEXT NOT NULL,
+                run_id INTEGER NOT NULL,
+                PRIMARY KEY (inventory, account_id, region, resource_id)
+            );
+        """)
+
+    # Start comparing a new run of an inventory type against its stored snapshot
+    def delta(self, inventory):
+        run_id = self.connection.execute("INSERT INTO runs (inventory, started) VALUES (?, ?)", (inventory, time.time())).lastrowid
+        return SnapshotDelta(self.connection, inventory, run_id)
+
+    def close(self):
+        self.connection.close()
+
+
+# The comparison of one inventory run against the stored snapshot. Resources are recorded one at a time as they are streamed from the scan,
+# so only the snapshot index (not the whole inventory) is needed to work out the delta.
+class SnapshotDelta:
+    def __init__(self, connection, inventory, run_id):
+        self.connection = connection
+        self.inventory = inventory
+        self.run_id = run_id
+        self.scanned_scopes = set() # Set of (account ID, region) combinations scanned in this run
+        self.change_counts = {ADDED: 0, CHANGED: 0, REMOVED: 0}
+
+    # Record an account/region combination as scanned, so that resources missing from it are reported as removed.
+    # Call once all the resources of the combination have been recorded, and only if it was scanned completely: combinations that
+    # were not scanned in this run (e.g. a different --region) or failed to scan keep their snapshot as-is.
+    def mark_scanned(self, account_id, region):
+        self.scanned_scopes.add((account_id, region))
+
+    # Record a resource seen in this run, returning ADDED or CHANGED, or None if it is unchanged since the last run
+    def record(self, account_id, region, resource_id, content):
+        new_hash = content_hash(content)
+        stored = self.connection.execute(
+            "SELECT content_hash FROM resources WHERE inventory = ? AND account_id = ? AND region = ? AND resource_id = ?",
+            (self.inventory, account_id, region, resource_id)
+        ).fetchone()
+        if stored is None:
+            change = ADDED
+        elif stored[0] != new_hash:
+            change = CHANGED
+        else:
+            change = None
+        if change is None:
+            self.connection.execute(
+                "UPDATE resources SET run_id = ? WHERE inventory = ? AND account_id = ? AND region = ? AND resource_id = ?",
+                (self.run_id, self.inventory, account_id, region, resource_id)
+            )
+        else:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO resources (inventory, account_id, region, resource_id, content_hash, content, run_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.inventory, account_id, region, resource_id, new_hash, json.dumps(content, default=str), self.run_id)
+            )
+            self.change_counts[change] += 1
+        return change
+
+    # Yield (account ID, region, resource ID, content) for each resource in a scanned account/region that was not seen in this run,
+    # and remove it from the snapshot. Call once all the resources of the run have been recorded.
+    def removed(self):
+        removed_keys = []
+        stored_rows = self.connection.execute(
+            "SELECT account_id, region, resource_id, content FROM resources WHERE inventory = ? AND run_id != ?",
+            (self.inventory, self.run_id)
+        )
+        for account_id, region, resource_id, content in stored_rows:
+            if (account_id, region) in self.scanned_scopes:
+                removed_keys.append((self.inventory, account_id, region, resource_id))
+                self.change_counts[REMOVED] += 1
+                yield account_id, region, resource_id, json.loads(content)
+        self.connection.executemany(
+            "DELETE FROM resources WHERE inventory = ? AND account_id = ? AND region = ? AND resource_id = ?",
+            removed_keys
+        )
+
+    # Save the new snapshot
+    def commit(self):
+        self.connection.commit()
@@ -0,0 +1,116 @@
+# Streaming grid and markdown table renderer, used for the text outputs of sg_json_converter.py and list_anfw_rules.py in place of tabulate.
+# Tables are rendered one row at a time. Column widths are either fixed up front, or sized in a single pre-pass: the rows are spooled
+# to a temporary file while the widths are measured, then rendered from the spool, so memory use doesn't grow with the number of rows.
+# Each rendered line is written to the file and (optionally) printed to screen, so the table is only rendered once.
+import csv
+import tempfile
+
+GRID = "grid"
+MARKDOWN = "markdown"
+
+
+# Return the display text of a cell (newlines would break the table layout, so they are replaced with spaces).
+# Grid tables strip surrounding whitespace from each cell, as tabulate does; the fixed-width markdown table keeps values as-is.
+def cell_text(value, strip=False):
+    text = str(value).replace("\r", " ").replace("\n", " ")
+    return text.strip() if strip else text
+
+
+# Render the lines of a table in the grid or markdown style, for a given set of column widths
+class TableRenderer:
+    def __init__(self, headers, widths, style=GRID):
+        self.headers = headers
+        self.widths = widths
+        self.style = style
+        self.strip = style == GRID
+        self.row_format = "| " + " | ".join(f"{{{index}:{width}s}}" for index, width in enumerate(widths)) + " |"
+        if style == GRID:
+            self.border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+            self.header_border = "+" + "+".join("=" * (width + 2) for width in widths) + "+"
+        else:
+            self.border = None
+            self.header_border = "| " + " | ".join("-" * width for width in widths) + " |"
+
+    def header_lines(self):
+        lines = [self.row_format.format(*[cell_text(header, self.strip) for header in self.headers]), self.header_border]
+        return [self.border] + lines if self.border else lines
+
+    def row_lines(self, row):
+        line = self.row_format.format(*[cell_text(value, self.strip) for value in row])
+        return [line, self.border] if self.border else [line]
+
+
+# Return the width of each column needed to fit the headers and rows
+def column_widths(headers, rows, style=GRID):
+    strip = style == GRID
+    widths = [len(cell_text(header, strip)) for header in headers]
+    for row in rows:
+        for index, value in enumerate(row):
+            widths[index] = max(widths[index], len(cell_text(value, strip)))
+    return widths
+
+
+# Return a whole table as a string (for small tables already held in memory)
+def render_table(rows, headers, style=GRID):
+    renderer = TableRenderer(headers, column_widths(headers, rows, style), style)
+    lines = renderer.header_lines()
+    for row in rows:
+        lines.extend(renderer.row_lines(row))
+    return "\n".join(lines)
+
+
+# Write a table to a file one row at a time. With fixed widths, each row is rendered as soon as it is written;
+# otherwise rows are spooled to a temporary file while the column widths are measured, and rendered on close().
+# Several tables can be written to the same file one after the other by opening the later ones in append mode (mode='a').
+class StreamingTableWriter:
+    def __init__(self, file_name, headers, style=GRID, widths=None, echo=False, mode='w'):
+        self.file_name = file_name
+        self.headers = headers
+        self.style = style
+        self.echo = echo
+        self.file = open(file_name, mode)
+        self.renderer = None
+        if widths is not None:
+            self.renderer = TableRenderer(headers, widths, style)
+            self._write_lines(self.renderer.header_lines())
+        else:
+            self.strip = style == GRID
+            self.widths = [len(cell_text(header, self.strip)) for header in headers]
+            self.spool = tempfile.TemporaryFile('w+', newline="")
+            self.spool_writer = csv.writer(self.spool)
+
+    def _write_lines(self, lines):
+        text = "\n".join(lines) + "\n"
+        self.file.write(text)
+        if self.echo: print(text, end="")
+
+    def write_rows(self, rows):
+        if self.renderer is not None:
+            lines = []
+            for row in rows:
+                lines.extend(self.renderer.row_lines(row))
+            if lines: self._write_lines(lines)
+            return
+        widths = self.widths
+        strip = self.strip
+        for row in rows:
+            texts = [cell_text(value, strip) for value in row]
+            for index, text in enumerate(texts):
+                if len(text) > widths[index]:
+                    widths[index] = len(text)
+            self.spool_writer.writerow(texts)
+
+    def close(self):
+        if self.renderer is None:
+            self.renderer = TableRenderer(self.headers, self.widths, self.style)
+            self._write_lines(self.renderer.header_lines())
+            self.spool.seek(0)
+            lines = []
+            for row in csv.reader(self.spool):
+                lines.extend(self.renderer.row_lines(row))
+                if len(lines) >= 1000:
+                    self._write_lines(lines)
+                    lines = []
+            if lines: self._write_lines(lines)
+            self.spool.close()
+        self.file.close()
@@ -1,9 +1,11 @@
-import boto3
-from botocore.exceptions import ClientError
-import json
 import argparse
 import os
 import csv
+from org_inventory import OrgScanner
+from region_map import RegionMap
+from inventory_collectors import waf_collectors, waf_headers, make_waf_detail_collectors, waf_detail_headers, waf_rule_headers
+from snapshot_store import SnapshotStore
+from scan_checkpoint import ScanCheckpoint
 
 # Add command-line arguments for region and role to assume within accounts
 parser = argparse.ArgumentParser(description="Get WAF Web ACLs Cross-Account Python Script - Arguments")
@@ -11,22 +13,38 @@ parser.add_argument("-r", "--region", default="us-east-1", type=str, help="AWS R
 parser.add_argument("-o", "--organization", action="store_true", help="If specified, execute across all accounts in AWS Organization")
 parser.add_argument("-a", "--assumed-role", default="ReadOnlyRole", type=str, help="Role to assume in each organization account")
 parser.add_argument("-f", "--file", default="waf_web_acls.csv", type=str, help="File to write WAF web acls to")
+parser.add_argument("-w", "--workers", default=1, type=int, help="Number of account/region combinations to scan concurrently (1 = serial)")
+parser.add_argument("--engine", default="threads", choices=["threads", "async"], help="Scan engine: a thread pool, or an asyncio event loop for very large scans (requires aiobotocore; --workers then sets the number of account/region combinations in flight, e.g. 500)")
+parser.add_argument("-m", "--max-account-requests", default=4, type=int, help="Maximum number of concurrent WAF API requests per account, to stay under throttling limits")
+parser.add_argument("--detail", action="store_true", help="If specified, add the capacity (WCU), default action, rules, managed rule groups and associated resources of each Web ACL, and write its rules to --rules-file")
+parser.add_argument("--rules-file", default="waf_web_acl_rules.csv", type=str, help="File to write the rules of each Web ACL to, one row per rule, with --detail")
+parser.add_argument("-d", "--detail-workers", default=4, type=int, help="Number of Web ACLs described concurrently within each account/region, with --detail")
+parser.add_argument("--max-region-requests", default=2, type=int, help="Maximum number of concurrent WAF detail requests per account and region, to stay under the WAFv2 rate limits")
+parser.add_argument("--since-last", action="store_true", help="If specified, only write the resources added, changed or removed since the last --since-last run (with a Change column)")
+parser.add_argument("--state-dir", default="inventory_state", type=str, help="Directory holding the snapshot store used by --since-last")
+parser.add_argument("--resume", action="store_true", help="If specified, resume an interrupted run: account/region combinations completed by the previous run are taken from the checkpoint file instead of being scanned again")
+parser.add_argument("--checkpoint-file", type=str, help="File to checkpoint completed account/region combinations to (default: the output file name + '.checkpoint')")
+parser.add_argument("--all-regions", action="store_true", help="If specified, scan every region enabled in each account (instead of --region), skipping the regions found empty or denied by earlier runs")
+parser.add_argument("--region-map-file", default="region_map.json", type=str, help="File caching the enabled, empty and denied regions of each account, used by --all-regions")
+parser.add_argument("--refresh-regions", action="store_true", help="If specified with --all-regions, discover the enabled regions again and re-scan the regions found empty or denied by earlier runs")
+parser.add_argument("--max-pool-connections", default=10, type=int, help="Maximum number of HTTP connections kept open per pooled client (should be at least --max-account-requests)")
+parser.add_argument("--credential-cache", type=str, help="File to cache assumed-role credentials in, so back-to-back runs assume each role only once per session lifetime. The file is encrypted if INVENTORY_CREDENTIAL_KEY is set, and holds the credentials in plaintext otherwise")
 parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
 args=parser.parse_args()
 
 # Get the Current Account ID and role and print to screen
-caller_identity = boto3.client('sts').get_caller_identity()
-current_account_id = caller_identity['Account']
-current_role = caller_identity['Arn']
+scanner = OrgScanner(args.assumed_role, "ListWAFInventoryScript", args.workers, args.max_account_requests, args.verbose, credential_cache_file=args.credential_cache,
+                     max_pool_connections=args.max_pool_connections, engine=args.engine)
+current_account_id = scanner.current_account_id
 
 if (args.verbose):
     print(f"Current Account ID: {current_account_id}")
-    print(f"Current Role: {current_role}")
+    print(f"Current Role: {scanner.current_role}")
 
 # Configure the list of regions to iterate through, and print to screen.
 regions = [
     # Add any additional regions you want to check here.
-    # Regions that are denied by SCPs will cause the script to fail.
+    # Use --all-regions to scan every region enabled in each account instead.
 ]
 if args.region not in regions:
     regions.insert(0, args.region)
@@ -35,126 +53,84 @@ if (args.verbose):
     print("Regions selected:")
     print(regions)
 
-# Create a list object to hold the waf web acls in each account:
-waf_list_of_values = [] # List to hold the list of values for each row in the customized waf output
+# If all-regions mode is selected, scan every region enabled in each account, skipping the regions found empty or denied by earlier runs
+region_map = RegionMap(args.region_map_file, refresh=args.refresh_regions) if args.all_regions else None
+
+# If detail mode is selected, each Web ACL is described, and its rules are written to the rules file
+if args.detail:
+    waf_collectors = make_waf_detail_collectors(args.detail_workers, args.max_region_requests)
+    waf_headers = waf_detail_headers
+total_rule_count = 0 # Counter to hold the total number of Web ACL rules written, with --detail
+
+# If delta mode is selected, compare the Web ACLs against the snapshot of the last run, and only write the changes
+# (with --detail, a change in any rule is a change of its Web ACL, and only the rules of added and changed Web ACLs are written)
+delta = SnapshotStore(args.state_dir).delta('waf_web_acls_detail' if args.detail else 'waf_web_acls') if args.since_last else None
+if delta is not None:
+    waf_headers = ['Change'] + waf_headers
+
+# Counters for the waf web acls in each account:
 total_webacl_count = 0 # Counter to hold the total number of WAF Web ACLs identified
-webacl_count_account = 0 # Counter to hold the number of WAF Web ACLs identified in each account
 webacl_count_dict = {} # Dict to hold the number of WAF Web ACLs per account
 
-# Capture WAF Web ACLs for the current account: 
-
-webacl_count_account = 0
-for region in regions:
-    if args.verbose: print(f"Identifying WAF web ACLs within account {current_account_id}, region {region}...")
-    client = boto3.client('wafv2', region_name=region)
-    regional_waf = client.list_web_acls(Scope='REGIONAL')
-    if regional_waf['WebACLs']:
-        for acl in regional_waf['WebACLs']:
-            waf_row_list = [current_account_id, region, acl['Name'], acl['Id'], acl['Description'], acl['ARN']]
-            waf_list_of_values.append(waf_row_list)
-        webacl_count_region = len(regional_waf['WebACLs'])
-        webacl_count_account += webacl_count_region
-        if args.verbose: print(f"Identified {webacl_count_region} Web ACLs in account {current_account_id} region {region}.")
-client = boto3.client('wafv2', region_name='us-east-1')
-cf_waf = client.list_web_acls(Scope='CLOUDFRONT')
-if cf_waf['WebACLs']: 
-    for acl in cf_waf['WebACLs']:
-        waf_row_list = [current_account_id, 'CLOUDFRONT', acl['Name'], acl['Id'], acl['Description'], acl['ARN']]
-        waf_list_of_values.append(waf_row_list)
-    webacl_count_region = len(cf_waf['WebACLs'])
-    webacl_count_account += webacl_count_region
-    if args.verbose: print(f"Identified {webacl_count_region} Global/CloudFront Web ACLs in account {current_account_id}.")
-total_webacl_count += webacl_count_account
-webacl_count_dict[current_account_id] = webacl_count_account
-if args.verbose: print(f"Found {webacl_count_account} WAF Web ACLs in account {current_account_id}")
-
-if args.verbose: print("Completed identification of WAF Web ACLs in the current account")
-
-# ---------- Cross-account functionality below ----------- 
-account_ids = [] # List to hold account IDs to iterate through
-error_list = [] # List to hold errors encountered
-account_ids_scanned = [current_account_id] # List to hold account IDs that have been scanned
-account_ids_failed = [] # List to hold account IDs that failed to scan
-
-# If organization / cross-account capabilities are selected, execute across all accounts by assuming roles and appending to the same file:
-if (args.organization == True):
-    # Create a list of AWS Account IDs in the AWS Organization, and print to screen
-    try:
-        organizations_client = boto3.client('organizations')
-        account_list = organizations_client.list_accounts()
-        for account in account_list['Accounts']:
-            if account['Id'] != current_account_id:
-                account_ids.append(account['Id'])
-    except ClientError as error: 
-        print(f"Couldn't retrieve account IDs from AWS Organization. Here's why: {error.response['Error']['Message']}")
-        error_list.append(error.response['Error']['Message'])
-    else:
-        if args.verbose: print(f"{len(account_ids)} additional accounts found in your AWS Organization: ")
-        if args.verbose: print(account_ids)
-
-        # Iterate through account Ids and regions, capturing WAF Web ACLs
-        for account_id in account_ids:
-            if account_id is not current_account_id:
-                webacl_count_account = 0 # Reset WAF per-account counter
-                if args.verbose: print(f"Assuming role {args.assumed_role} in account {account_id}...")
-                try:
-                    # Assume role_name in each account and get temporary credentials (can use OrganizationAccountAccessRole but it is admin-level, advised to create/utilize read-only roles for this purposes)
-                    sts_client = boto3.client('sts')
-                    sts_response = sts_client.assume_role(RoleArn=f"arn:aws:iam::{account_id}:role/{args.assumed_role}", RoleSessionName="ListWAFInventoryScript")
-                    temp_credentials = sts_response['Credentials']
-                    assumed_session = boto3.Session(                                                                                                                   
-                        aws_access_key_id=temp_credentials['AccessKeyId'],                                                                                             
-                        aws_secret_access_key=temp_credentials['SecretAccessKey'],                                                                                     
-                        aws_session_token=temp_credentials['SessionToken']
-                    )
-                except ClientError as error:
-                    error_list.append(error.response['Error']['Message'])
-                    account_ids_failed.append(account_id)
-                    print(f"Couldn't assume role. Here's why: {error.response['Error']['Message']}")
-                    print(f"Skipping account {account_id}")
-                else:
-                    # Capture WAF Web ACLs for the current account in each region iteratively, and append to the list
-                    account_ids_scanned.append(account_id)
-                    for region in regions:
-                        if args.verbose: print(f"Identifying WAF web ACLs within account {current_account_id}, region {region}...")
-                        client = assumed_session.client('wafv2', region_name=region)
-                        regional_waf = client.list_web_acls(Scope='REGIONAL')
-                        if regional_waf['WebACLs']:
-                            for acl in regional_waf['WebACLs']:
-                                waf_row_list = [account_id, region, acl['Name'], acl['Id'], acl['Description'], acl['ARN']]
-                                waf_list_of_values.append(waf_row_list)
-                            webacl_count_region = len(regional_waf['WebACLs'])
-                            webacl_count_account += webacl_count_region
-                            if args.verbose: print(f"Identified {webacl_count_region} Web ACLs in account {current_account_id} region {region}.")
-                    client = assumed_session.client('wafv2', region_name='us-east-1')
-                    cf_waf = client.list_web_acls(Scope='CLOUDFRONT')
-                    if cf_waf['WebACLs']:
-                        for acl in cf_waf['WebACLs']:
-                            waf_row_list = [account_id, 'CLOUDFRONT', acl['Name'], acl['Id'], acl['Description'], acl['ARN']]
-                            waf_list_of_values.append(waf_row_list)
-                        webacl_count_region = len(cf_waf['WebACLs'])
-                        webacl_count_account += webacl_count_region
-                        if args.verbose: print(f"Identified {webacl_count_region} Global/CloudFront Web ACLs in account {current_account_id}.")
-                total_webacl_count += webacl_count_account
-                webacl_count_dict[account_id] = webacl_count_account
-
-waf_headers = [
-    'Account_ID',
-    'Region',
-    'Web_ACL_Name',
-    'Web_ACL_ID',
-    'Web_ACL_Description',
-    'Web_ACL_ARN'
-]
+# Checkpoint each completed account/region combination, so an interrupted run can be resumed with --resume
+checkpoint = ScanCheckpoint(args.checkpoint_file or f"{args.file}.checkpoint", resume=args.resume)
+
+# Select the current account, and if organization / cross-account capabilities are selected, every account in the AWS Organization
+account_ids_scanned = scanner.select_accounts(args.organization)
 
-# Write WAF Web ACLs to csv file
+# Capture regional and Global/CloudFront WAF Web ACLs for every account/region combination, streaming each row to the csv file as it is identified
+# (results are returned in a stable order, regardless of the number of workers)
+rulescsvfile = open(args.rules_file, 'w', newline="") if args.detail else None
 with open(args.file, 'w', newline="") as wafcsvfile:
     writer = csv.writer(wafcsvfile)
     writer.writerow(waf_headers)
     if args.verbose: print(waf_headers)
-    for row in waf_list_of_values:
-        writer.writerow(row)
-        if args.verbose: print(row)
+    rules_writer = csv.writer(rulescsvfile) if args.detail else None
+    if rules_writer is not None: rules_writer.writerow(waf_rule_headers)
+    for result in scanner.run(waf_collectors, regions, checkpoint=checkpoint, region_map=region_map):
+        webacl_count_region = 0
+        for item in result.items:
+            # Detail collectors yield each Web ACL row with the rows of its rules
+            row, rule_rows = item if args.detail else (item, [])
+            webacl_count_region += 1
+            if delta is not None:
+                change = delta.record(result.account_id, row[1], row[3], [row, rule_rows] if args.detail else row)
+                if change is None:
+                    continue
+                row = [change] + row
+            writer.writerow(row)
+            if args.verbose: print(row)
+            if rules_writer is not None:
+                rules_writer.writerows(rule_rows)
+                total_rule_count += len(rule_rows)
+        # Global/CloudFront Web ACLs are recorded under the CLOUDFRONT region, as in the csv output
+        # (Web ACLs missing from a combination that failed to scan aren't reported as removed)
+        if delta is not None and not result.failed: delta.mark_scanned(result.account_id, 'CLOUDFRONT' if result.collector == 'waf_cloudfront' else result.region)
+        webacl_count_dict[result.account_id] = webacl_count_dict.get(result.account_id, 0) + webacl_count_region
+        total_webacl_count += webacl_count_region
+        if args.verbose and webacl_count_region:
+            if result.collector == 'waf_cloudfront':
+                print(f"Identified {webacl_count_region} Global/CloudFront Web ACLs in account {result.account_id}.")
+            else:
+                print(f"Identified {webacl_count_region} Web ACLs in account {result.account_id} region {result.region}.")
+    # Write the Web ACLs that no longer exist since the last run
+    if delta is not None:
+        for account_id, region, webacl_id, row in delta.removed():
+            if args.detail: row = row[0]
+            writer.writerow(['removed'] + row)
+            if args.verbose: print(['removed'] + row)
+if rulescsvfile is not None: rulescsvfile.close()
+
+# Save the region map for the next --all-regions run
+if region_map is not None:
+    region_map.save()
+
+# The run has finished, so the checkpoint is no longer needed
+checkpoint.close()
+
+if delta is not None:
+    delta.commit()
+    print(f"Changes since the last run: {delta.change_counts['added']} added, {delta.change_counts['changed']} changed, {delta.change_counts['removed']} removed")
 
 print("----------------------------------------")
 print("AWS WAF Web ACL inventory is complete")
@@ -164,18 +140,13 @@ print(f"The following {len(account_ids_scanned)} accounts and regions were scann
 print("Accounts:")
 print(account_ids_scanned)
 print("Regions:")
-print(regions)
+print(scanner.regions_scanned if region_map is not None else regions)
 
 if args.verbose: 
     print("Number of WAF Web ACLs identified in each account:")
     print(webacl_count_dict)
 
-if error_list:
-    with open("errors.txt", "w") as error_file:
-        for error in error_list:
-            error_file.write(f"\n{error}")
-    print(f"The following {len(account_ids_failed)} accounts encountered errors:")
-    print(account_ids_failed)
-    print(f"{len(error_list)} errors occurred. Error messages are located at: {os.getcwd()}/errors.txt")
+scanner.write_errors()
 
 print(f"CSV output is saved at: {os.getcwd()}/{args.file}")
+if args.detail: print(f"{total_rule_count} Web ACL rules were written. The rules table is located at: {os.getcwd()}/{args.rules_file}")